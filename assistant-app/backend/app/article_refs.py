@@ -0,0 +1,145 @@
+import re
+import unicodedata
+from typing import Dict, List, Optional, Tuple
+
+from .law_codes import normalize_article_no
+
+# Canonical code keys and the names users (and the corpus metadata) give them.
+# Longer aliases are matched first, so "code des obligations et contrats" wins over "obligations et contrats".
+CODE_ALIASES = {
+    "travail": ["code du travail", "code de travail", "droit du travail", "code travail"],
+    "penal": ["code penal", "code penale", "droit penal"],
+    "famille": [
+        "code de la famille", "code famille", "moudawana", "moudouwana", "mudawana",
+        "mudawwana", "moudawwana", "mudawanah",
+    ],
+    "commerce": ["code de commerce", "code du commerce", "code commerce", "code comerce"],
+    "obligations": [
+        "dahir des obligations et contrats", "dahir formant code des obligations et des contrats",
+        "code des obligations et des contrats", "code des obligations et contrats",
+        "obligations et contrats", "code obligation contrats", "doc", "coc",
+    ],
+    "constitution": ["constitution"],
+    "loi_09_08": ["loi 09-08", "loi n 09-08", "loi no 09-08", "loi 09.08", "loi 9-08"],
+    "loi_43_20": ["loi 43-20", "loi n 43-20", "loi no 43-20", "loi 43.20"],
+}
+# Acronyms that are also ordinary words ("le doc que j'ai reçu"): they only
+# name a code when written in capitals or right after an article reference
+AMBIGUOUS_ALIASES = {"doc", "coc"}
+
+_NUMBER = r"(?:premier|1er|\d+(?:\s*[-–]\s*\d+)?(?:\s*(?:bis|ter|quater))?)"
+ARTICLE_PATTERN = re.compile(
+    rf"\b(?:articles?|art\.?)\s+({_NUMBER}(?:\s*(?:,|et|&)\s*{_NUMBER})*)",
+    re.IGNORECASE,
+)
+_NUMBER_PATTERN = re.compile(_NUMBER, re.IGNORECASE)
+# How far after an article number a code name still qualifies it ("article 53 de la loi ...")
+FOLLOWING_CODE_WINDOW = 40
+# An article reference ending where an ambiguous alias starts ("article 230 du doc")
+_ARTICLE_BEFORE = re.compile(
+    rf"\b(?:articles?|art\.?)\s+{_NUMBER}(?:\s*(?:,|et|&)\s*{_NUMBER})*\s*(?:du|de la|de l'|des|d')?\s*$",
+    re.IGNORECASE,
+)
+# Corpus folder and file names: "code_travail_2011", "Loi_09_08_2009_full.json"
+_CORPUS_NAME = re.compile(r"(?:.*/)?([a-z0-9_]+?)(?:_(?:19|20)\d\d)?(?:_full)?(?:-fr)?(?:\.[a-z]+)?")
+
+
+def _fold(text: str) -> str:
+    """Lowercase and strip accents, degree signs and underscores, keeping hyphens."""
+    text = unicodedata.normalize("NFKD", text.lower())
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    text = text.replace("–", "-").replace("°", " ").replace("’", "'").replace("_", " ")
+    return re.sub(r"\s+", " ", text)
+
+
+_ALIAS_PATTERN = re.compile(
+    r"\b(" + "|".join(
+        re.escape(alias) for alias in sorted(
+            (alias for aliases in CODE_ALIASES.values() for alias in aliases), key=len, reverse=True
+        )
+    ) + r")\b"
+)
+_ALIAS_TO_CODE = {alias: code for code, aliases in CODE_ALIASES.items() for alias in aliases}
+
+
+def canonical_code(name: str) -> Optional[str]:
+    """Map a code name (user wording, corpus metadata or folder name) to its canonical key."""
+    if not name:
+        return None
+    corpus_name = _CORPUS_NAME.fullmatch(name.strip().lower())
+    if corpus_name:
+        name = corpus_name.group(1)
+        if name in CODE_ALIASES:
+            return name
+    match = _ALIAS_PATTERN.search(_fold(name))
+    return _ALIAS_TO_CODE[match.group(1)] if match else None
+
+
+def _names_code(query: str, folded: str, match) -> bool:
+    """Whether an alias found in the folded query really names a code."""
+    alias = match.group(1)
+    if alias not in AMBIGUOUS_ALIASES:
+        return True
+    return bool(re.search(rf"\b{alias.upper()}\b", query) or _ARTICLE_BEFORE.search(folded, 0, match.start()))
+
+
+def parse_references(query: str) -> List[Tuple[Optional[str], str]]:
+    """
+    Extract explicit article references from a question.
+
+    Returns (code, article number) pairs with normalized numbers. Each
+    article takes the code named right after it ("article 147 du Code du
+    Travail"), otherwise the closest one before it; code is None when the
+    question names no code for it. "DOC" and "COC" count only in capitals
+    or right after an article reference.
+    """
+    folded = _fold(query)
+    codes = [
+        (m.start(), _ALIAS_TO_CODE[m.group(1)]) for m in _ALIAS_PATTERN.finditer(folded) if _names_code(query, folded, m)
+    ]
+    references = []
+    for match in ARTICLE_PATTERN.finditer(folded):
+        following = [code for start, code in codes if match.end() <= start <= match.end() + FOLLOWING_CODE_WINDOW]
+        preceding = [code for start, code in codes if start < match.start()]
+        code = following[0] if following else (preceding[-1] if preceding else None)
+        for number in _NUMBER_PATTERN.findall(match.group(1)):
+            reference = (code, normalize_article_no(number))
+            if reference not in references:
+                references.append(reference)
+    return references
+
+
+class ArticleIndex:
+    """Exact (code, article number) -> document id index over the corpus."""
+
+    def __init__(self):
+        self._ids: Dict[Tuple[str, str], List[str]] = {}
+
+    @classmethod
+    def from_corpus(cls, corpus_data: Dict) -> "ArticleIndex":
+        index = cls()
+        for doc_id, document in zip(corpus_data['doc_ids'], corpus_data['documents']):
+            metadata = document.metadata
+            code = canonical_code(
+                metadata.get('code') or metadata.get('loi') or metadata.get('code_display')
+                or metadata.get('source_file') or ""
+            )
+            number = metadata.get('article_no') or metadata.get('article_number') or metadata.get('article_id')
+            if code and number:
+                index.add(code, number, doc_id)
+        return index
+
+    def add(self, code: str, article_no, doc_id: str):
+        self._ids.setdefault((code, normalize_article_no(article_no)), []).append(doc_id)
+
+    def __len__(self):
+        return len(self._ids)
+
+    def lookup(self, references: List[Tuple[Optional[str], str]]) -> List[str]:
+        """Document ids of the references that name a code, in query order."""
+        doc_ids = []
+        for code, number in references:
+            for doc_id in self._ids.get((code, number), []) if code else []:
+                if doc_id not in doc_ids:
+                    doc_ids.append(doc_id)
+        return doc_ids
@@ -1,14 +1,19 @@
+import os
 from datetime import datetime
 from typing import List, Optional
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Query
 from pydantic import BaseModel, Field
-from bson import ObjectId
 
 from app.auth.models import UserInDB
-from app.auth.utils import get_current_active_user, users_collection
+from app.auth.utils import get_current_active_user
+from app.auth import chat_store
+from app.serialization import FastJSONResponse, streamed_json_object
 
 router = APIRouter(prefix="/chat", tags=["chat"])
 
+# Message pages at least this long are encoded and sent incrementally
+HISTORY_STREAM_MIN_MESSAGES = int(os.getenv("HISTORY_STREAM_MIN_MESSAGES", "200"))
+
 
 class ChatMessage(BaseModel):
     role: str
@@ -16,92 +21,128 @@ class ChatMessage(BaseModel):
     articles: Optional[List[dict]] = []
 
 
+class PagedChatMessage(ChatMessage):
+    seq: int
+
+
+class ChatSessionSummary(BaseModel):
+    id: str
+    title: str
+    date: datetime
+    message_count: int = 0
+
+
 class ChatSession(BaseModel):
     id: str
     title: str
     date: datetime
-    messages: List[ChatMessage]
+    messages: List[PagedChatMessage]
     articles: Optional[List[dict]] = []
+    # Pass as `after` to /history/{id}/messages to load the remaining messages
+    next_cursor: Optional[int] = None
+
+
+class ChatMessagePage(BaseModel):
+    messages: List[PagedChatMessage]
+    next_cursor: Optional[int] = None
 
 
 class ChatSessionUpdate(BaseModel):
     title: Optional[str] = None
 
 
+# The read endpoints return documents from our own store: they are shaped to
+# their response model here and encoded directly, without the model validation
+# and re-serialization FastAPI would otherwise run. The response_model stays
+# declared for the API schema.
+
+def _message_out(message: dict) -> dict:
+    """The PagedChatMessage fields of a stored (hydrated) message."""
+    return {
+        "role": message["role"],
+        "content": message["content"],
+        "articles": message.get("articles", []),
+        "seq": message["seq"],
+    }
+
+
+def _messages_response(head: dict, messages: List[dict]):
+    if len(messages) >= HISTORY_STREAM_MIN_MESSAGES:
+        return streamed_json_object(head, "messages", map(_message_out, messages))
+    return FastJSONResponse({**head, "messages": [_message_out(message) for message in messages]})
+
+
 @router.post("/history", status_code=201)
 async def create_chat_session(
     message: ChatMessage,
     user: UserInDB = Depends(get_current_active_user)
 ):
     """Create a new chat session with the first message"""
-    
-    # Create title from first message (truncate if needed)
-    title = message.content[:30] + "..." if len(message.content) > 30 else message.content
-    
-    # Create new session
-    session = {
-        "id": str(ObjectId()),
-        "title": title,
-        "date": datetime.utcnow(),
-        "messages": [message.dict()],
-        "articles": message.articles if message.role == "assistant" else []
-    }
-    
-    # Update user document - with async
-    result = await users_collection.update_one(
-        {"email": user.email},
-        {"$push": {"chat_sessions": session}}
-    )
-    
-    if result.modified_count == 0:
-        raise HTTPException(status_code=500, detail="Failed to create chat session")
-    
-    return {"id": session["id"], "title": session["title"]}
-
-
-@router.get("/history", response_model=List[ChatSession])
-async def get_chat_history(user: UserInDB = Depends(get_current_active_user)):
-    """Get all chat sessions for the current user"""
-    
-    # Get user document with chat sessions - with async
-    user_data = await users_collection.find_one(
-        {"email": user.email},
-        {"_id": 0, "chat_sessions": 1}
-    )
-    
-    if not user_data or "chat_sessions" not in user_data:
-        return []
-    
-    # Sort chat sessions by date (newest first)
-    chat_sessions = sorted(
-        user_data["chat_sessions"], 
-        key=lambda x: x.get("date", datetime.min), 
-        reverse=True
-    )
-    
-    return chat_sessions
+    title = chat_store.make_title(message.content)
+    articles = message.articles if message.role == "assistant" else []
+    session_id = await chat_store.create_session(user.email, title, [message.dict()], articles)
+    return {"id": session_id, "title": title}
+
+
+@router.get("/history", response_model=List[ChatSessionSummary])
+async def get_chat_history(
+    limit: int = Query(50, ge=1, le=200),
+    before: Optional[str] = None,
+    user: UserInDB = Depends(get_current_active_user)
+):
+    """
+    List the current user's chat sessions, newest first.
+
+    Only titles, dates and message counts are returned. When more sessions
+    exist, the X-Next-Cursor header holds the value to pass as `before`.
+    """
+    try:
+        sessions, next_cursor = await chat_store.list_sessions(user.email, limit, before)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    # The summaries are built with exactly the ChatSessionSummary fields
+    headers = {"X-Next-Cursor": next_cursor} if next_cursor else None
+    return FastJSONResponse(sessions, headers=headers)
 
 
 @router.get("/history/{session_id}", response_model=ChatSession)
 async def get_chat_session(
     session_id: str,
+    limit: int = Query(100, ge=1, le=500),
     user: UserInDB = Depends(get_current_active_user)
 ):
-    """Get a specific chat session by ID"""
-    
-    # Find user with the specific chat session - with async
-    user_data = await users_collection.find_one(
-        {
-            "email": user.email,
-            "chat_sessions.id": session_id
-        },
-        {"_id": 0, "chat_sessions.$": 1}
-    )
-    
-    if not user_data or "chat_sessions" not in user_data or not user_data["chat_sessions"]:
+    """Get a specific chat session by ID with its first page of messages"""
+    session = await chat_store.get_session(user.email, session_id)
+    if not session:
         raise HTTPException(status_code=404, detail="Chat session not found")
-    
-    return user_data["chat_sessions"][0]
+
+    messages, next_cursor = await chat_store.get_messages(session_id, limit=limit)
+    # One article lookup for the session and its messages
+    chat_store.hydrate_articles([session, *messages])
+    return _messages_response({
+        "id": session["_id"],
+        "title": session["title"],
+        "date": session["date"],
+        "articles": session.get("articles", []),
+        "next_cursor": next_cursor,
+    }, messages)
+
+
+@router.get("/history/{session_id}/messages", response_model=ChatMessagePage)
+async def get_chat_messages(
+    session_id: str,
+    after: int = Query(0, ge=0),
+    limit: int = Query(50, ge=1, le=500),
+    user: UserInDB = Depends(get_current_active_user)
+):
+    """Page through the messages of a session (cursor = last seen seq)"""
+    session = await chat_store.get_session(user.email, session_id, {"_id": 1})
+    if not session:
+        raise HTTPException(status_code=404, detail="Chat session not found")
+
+    messages, next_cursor = await chat_store.get_messages(session_id, after=after, limit=limit)
+    chat_store.hydrate_articles(messages)
+    return _messages_response({"next_cursor": next_cursor}, messages)
 
 
 @router.delete("/history/{session_id}")
@@ -110,16 +151,9 @@ async def delete_chat_session(
     user: UserInDB = Depends(get_current_active_user)
 ):
     """Delete a specific chat session by ID"""
-    
-    # With async
-    result = await users_collection.update_one(
-        {"email": user.email},
-        {"$pull": {"chat_sessions": {"id": session_id}}}
-    )
-    
-    if result.modified_count == 0:
+    if not await chat_store.delete_session(user.email, session_id):
         raise HTTPException(status_code=404, detail="Chat session not found")
-    
+
     return {"detail": "Chat session deleted successfully"}
 
 
@@ -128,16 +162,7 @@ async def delete_all_chat_sessions(
     user: UserInDB = Depends(get_current_active_user)
 ):
     """Delete all chat sessions for the current user"""
-    
-    # With async
-    result = await users_collection.update_one(
-        {"email": user.email},
-        {"$set": {"chat_sessions": []}}
-    )
-    
-    if result.modified_count == 0:
-        raise HTTPException(status_code=500, detail="Failed to delete chat sessions")
-    
+    await chat_store.delete_all_sessions(user.email)
     return {"detail": "All chat sessions deleted successfully"}
 
 
@@ -148,24 +173,14 @@ async def update_chat_session(
     user: UserInDB = Depends(get_current_active_user)
 ):
     """Update a chat session (currently only title can be updated)"""
-    
-    update_fields = {f"chat_sessions.$.{k}": v for k, v in update_data.dict(exclude_unset=True).items()}
-    
+
+    update_fields = update_data.dict(exclude_unset=True)
+
     if not update_fields:
         raise HTTPException(status_code=400, detail="No fields to update")
-    
-    # With async
-    result = await users_collection.update_one(
-        {
-            "email": user.email,
-            "chat_sessions.id": session_id
-        },
-        {"$set": update_fields}
-    )
-    
-    if result.modified_count == 0:
+
+    if not await chat_store.update_session(user.email, session_id, update_fields):
         raise HTTPException(status_code=404, detail="Chat session not found")
-    
+
     # Get the updated session
-    updated_session = await get_chat_session(session_id, user)
-    return updated_session
\ No newline at end of file
+    return await get_chat_session(session_id, 100, user)
@@ -0,0 +1,347 @@
+import asyncio
+import zlib
+from datetime import datetime, timedelta
+from typing import List, Optional
+
+import bson
+from bson import Binary, ObjectId
+from pymongo import ASCENDING, DESCENDING, ReturnDocument
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+
+from app.auth.utils import chat_archive_collection, chat_sessions_collection, chat_messages_collection
+from app.metrics import Counter
+
+# Chat sessions live in their own collection (one document per session) and
+# messages in another (one document per message, ordered by a per-session
+# sequence number), so that neither grows inside the user document.
+# Sessions inactive for a long time move to a third collection, one
+# compressed document per session with its messages, and move back the
+# first time they are opened.
+
+SESSION_SUMMARY_PROJECTION = {"title": 1, "date": 1, "seq": 1}
+
+# An archive is "pending" from the moment it is written until the session's
+# messages have left the hot collection; restoring waits for the move to
+# finish, unless the archiver stopped midway (pending for this long).
+ARCHIVE_PENDING_TIMEOUT = 60
+
+SESSIONS_TIERED = Counter(
+    "juridoc_chat_sessions_tiered",
+    "Chat sessions moved to the archive or restored from it",
+    ["direction"],
+)
+ARCHIVE_BYTES = Counter(
+    "juridoc_chat_archive_bytes",
+    "Size of the archived sessions before and after compression",
+    ["kind"],
+)
+
+# Articles are stored as ids plus the version of the index they come from,
+# and resolved to their text when read. The source (the RAG pipeline) is
+# registered at startup and provides `index_version` and `get_articles(ids)`.
+_article_source = None
+
+
+def set_article_source(source):
+    global _article_source
+    _article_source = source
+
+
+def compact_articles(articles: List[dict]) -> dict:
+    """
+    The stored fields of a list of articles: their ids and the index
+    version, or the articles themselves when some have no id.
+    """
+    if _article_source is None or not all(article.get("id") for article in articles):
+        return {"articles": articles}
+    return {
+        "article_ids": [article["id"] for article in articles],
+        "index_version": _article_source.index_version,
+    }
+
+
+def hydrate_articles(documents: List[dict]) -> List[dict]:
+    """
+    Replace the stored article ids of sessions or messages with the
+    articles, resolved in a single lookup. Articles the current index no
+    longer has come back with their id only, and so do the articles of
+    another index version (the same id may now hold other text), marked stale.
+    """
+    stored = [document for document in documents if "article_ids" in document]
+    current = [document for document in stored if _is_current(document)]
+    doc_ids = [doc_id for document in current for doc_id in document["article_ids"]]
+    resolved = _article_source.get_articles(doc_ids) if doc_ids else {}
+    for document in stored:
+        doc_ids = document.pop("article_ids")
+        if _is_current(document):
+            document["articles"] = [resolved.get(doc_id) or {"id": doc_id} for doc_id in doc_ids]
+        else:
+            document["articles"] = [{"id": doc_id, "stale": True} for doc_id in doc_ids]
+        document.pop("index_version", None)
+    return documents
+
+
+def _is_current(document: dict) -> bool:
+    """Whether the article ids of a document come from the index being served."""
+    return _article_source is not None and document.get("index_version") == _article_source.index_version
+
+
+def make_title(question: str) -> str:
+    """Create a session title from its first message (truncated if needed)."""
+    return question[:30] + "..." if len(question) > 30 else question
+
+
+async def ensure_indexes():
+    """Create the indexes used by the listing and paging queries (idempotent)."""
+    await chat_sessions_collection.create_index([("user", ASCENDING), ("date", DESCENDING)])
+    await chat_messages_collection.create_index(
+        [("session_id", ASCENDING), ("seq", ASCENDING)], unique=True
+    )
+    # Scanned by the tiering job
+    await chat_sessions_collection.create_index([("updated_at", ASCENDING)])
+    await chat_archive_collection.create_index([("user", ASCENDING), ("date", DESCENDING)])
+
+
+def _encode_cursor(session: dict) -> str:
+    return f"{session['date'].isoformat()}_{session['_id']}"
+
+
+def _decode_cursor(cursor: str) -> dict:
+    date_part, _, session_id = cursor.rpartition("_")
+    date = datetime.fromisoformat(date_part)
+    return {"$or": [
+        {"date": {"$lt": date}},
+        {"date": date, "_id": {"$lt": session_id}},
+    ]}
+
+
+def _message_documents(session_id: str, messages: List[dict], first_seq: int) -> List[dict]:
+    now = datetime.utcnow()
+    documents = []
+    for i, message in enumerate(messages):
+        document = {"session_id": session_id, "seq": first_seq + i, "date": now, **message}
+        if document.get("articles"):
+            document.update(compact_articles(document.pop("articles")))
+        documents.append(document)
+    return documents
+
+
+async def create_session(email: str, title: str, messages: List[dict], articles: List[dict]) -> str:
+    """Create a session with its first messages and return its id."""
+    session_id = str(ObjectId())
+    now = datetime.utcnow()
+    await chat_sessions_collection.insert_one({
+        "_id": session_id,
+        "user": email,
+        "title": title,
+        "date": now,
+        "updated_at": now,
+        "seq": len(messages),
+        **compact_articles(articles),
+    })
+    if messages:
+        await chat_messages_collection.insert_many(_message_documents(session_id, messages, 1))
+    return session_id
+
+
+async def append_messages(email: str, session_id: str, messages: List[dict], articles: List[dict]) -> bool:
+    """Append messages to a session; returns False if the session does not exist."""
+    article_fields = compact_articles(articles)
+    # Drop the other representation in case the session predates compaction
+    stale_fields = ["article_ids", "index_version"] if "articles" in article_fields else ["articles"]
+    # Reserve a range of sequence numbers atomically
+    update = {
+        "$inc": {"seq": len(messages)},
+        "$set": {**article_fields, "updated_at": datetime.utcnow()},
+        "$unset": {field: "" for field in stale_fields},
+    }
+    session = await chat_sessions_collection.find_one_and_update(
+        {"_id": session_id, "user": email}, update, projection={"seq": 1}, return_document=ReturnDocument.AFTER,
+    )
+    if session is None:
+        # Continuing an archived conversation brings it back first
+        if not await restore_session(email, session_id):
+            return False
+        session = await chat_sessions_collection.find_one_and_update(
+            {"_id": session_id, "user": email}, update, projection={"seq": 1}, return_document=ReturnDocument.AFTER,
+        )
+        if session is None:
+            return False
+    first_seq = session["seq"] - len(messages) + 1
+    await chat_messages_collection.insert_many(_message_documents(session_id, messages, first_seq))
+    return True
+
+
+async def list_sessions(email: str, limit: int, before: Optional[str] = None):
+    """Return one page of session summaries (newest first) and the cursor of the next page."""
+    query = {"user": email}
+    if before:
+        query.update(_decode_cursor(before))
+    order = [("date", DESCENDING), ("_id", DESCENDING)]
+    hot = await chat_sessions_collection.find(query, SESSION_SUMMARY_PROJECTION).sort(order).to_list(length=limit + 1)
+    # Archived sessions are listed too; the archive keeps their summary fields uncompressed
+    cold = await chat_archive_collection.find(query, SESSION_SUMMARY_PROJECTION).sort(order).to_list(length=limit + 1)
+    # A session being archived is in both collections for a moment
+    merged = {session["_id"]: session for session in cold + hot}
+    sessions = sorted(merged.values(), key=lambda session: (session["date"], session["_id"]), reverse=True)[:limit + 1]
+
+    next_cursor = _encode_cursor(sessions[limit - 1]) if len(sessions) > limit else None
+    summaries = [
+        {
+            "id": session["_id"],
+            "title": session["title"],
+            "date": session["date"],
+            "message_count": session.get("seq", 0),
+        }
+        for session in sessions[:limit]
+    ]
+    return summaries, next_cursor
+
+
+async def get_session(email: str, session_id: str, projection: Optional[dict] = None):
+    """Return a session document owned by the user (restoring it from the archive), or None."""
+    query = {"_id": session_id, "user": email}
+    session = await chat_sessions_collection.find_one(query, projection or {"user": 0})
+    if session is None and await restore_session(email, session_id):
+        session = await chat_sessions_collection.find_one(query, projection or {"user": 0})
+    return session
+
+
+async def get_session_article_ids(email: str, session_id: str) -> Optional[List[str]]:
+    """
+    Ids of the session's current articles (empty when they come from another
+    index version), or None if the session does not exist.
+    """
+    session = await get_session(email, session_id, {"article_ids": 1, "index_version": 1, "articles.id": 1})
+    if not session:
+        return None
+    if "article_ids" in session:
+        # Ids of an older index may point to other articles now: no follow-up reuse then
+        return session["article_ids"] if _is_current(session) else []
+    # Sessions not compacted yet (and those saved before article ids were stored)
+    return [article["id"] for article in session.get("articles") or [] if article.get("id")]
+
+
+async def get_messages(session_id: str, after: int = 0, limit: int = 50):
+    """Return messages with seq > after, in order, and the cursor of the next page."""
+    cursor = chat_messages_collection.find(
+        {"session_id": session_id, "seq": {"$gt": after}},
+        {"_id": 0, "session_id": 0},
+    )
+    messages = await cursor.sort("seq", ASCENDING).to_list(length=limit + 1)
+    next_cursor = messages[limit - 1]["seq"] if len(messages) > limit else None
+    return messages[:limit], next_cursor
+
+
+async def update_session(email: str, session_id: str, fields: dict) -> bool:
+    result = await chat_sessions_collection.update_one(
+        {"_id": session_id, "user": email},
+        # Counts as activity, and lets an archiver that read the session before notice the change
+        {"$set": {**fields, "updated_at": datetime.utcnow()}},
+    )
+    if result.matched_count == 0 and await restore_session(email, session_id):
+        return await update_session(email, session_id, fields)
+    return result.matched_count > 0
+
+
+async def delete_session(email: str, session_id: str) -> bool:
+    result = await chat_sessions_collection.delete_one({"_id": session_id, "user": email})
+    if result.deleted_count == 0:
+        archived = await chat_archive_collection.delete_one({"_id": session_id, "user": email})
+        return archived.deleted_count > 0
+    await chat_messages_collection.delete_many({"session_id": session_id})
+    return True
+
+
+async def delete_all_sessions(email: str) -> int:
+    session_ids = await chat_sessions_collection.distinct("_id", {"user": email})
+    if session_ids:
+        await chat_messages_collection.delete_many({"session_id": {"$in": session_ids}})
+        await chat_sessions_collection.delete_many({"user": email})
+    archived = await chat_archive_collection.delete_many({"user": email})
+    return len(session_ids) + archived.deleted_count
+
+
+async def archive_session(session: dict) -> bool:
+    """
+    Move a session and its messages to the archive, as one zlib-compressed
+    BSON document (summary fields stay readable for the session list).
+    Returns False, leaving the session in place, if it changed meanwhile.
+    """
+    session_id = session["_id"]
+    messages = await chat_messages_collection.find({"session_id": session_id}).sort("seq", ASCENDING).to_list(None)
+    if len(messages) != session.get("seq", 0):
+        # Messages still being appended
+        return False
+    raw = bson.encode({"session": session, "messages": messages})
+    data = zlib.compress(raw)
+    pending_since = datetime.utcnow()
+    await chat_archive_collection.replace_one({"_id": session_id}, {
+        "_id": session_id,
+        "user": session["user"],
+        "title": session["title"],
+        "date": session["date"],
+        "seq": session.get("seq", 0),
+        "updated_at": session["updated_at"],
+        "pending_since": pending_since,
+        "data": Binary(data),
+    }, upsert=True)
+    # Only an unchanged session is removed from the hot collections
+    removed = await chat_sessions_collection.delete_one(
+        {"_id": session_id, "seq": session.get("seq", 0), "updated_at": session["updated_at"]}
+    )
+    if removed.deleted_count == 0:
+        # Written to (or deleted) since it was read: drop the archive
+        await chat_archive_collection.delete_one({"_id": session_id, "pending_since": pending_since})
+        return False
+    # Restoring waits until the archive stops being pending, so it cannot
+    # re-insert messages that are about to be deleted here
+    await chat_messages_collection.delete_many({"session_id": session_id, "seq": {"$lte": session.get("seq", 0)}})
+    await chat_archive_collection.update_one(
+        {"_id": session_id, "pending_since": pending_since},
+        {"$unset": {"pending_since": ""}, "$set": {"archived_at": datetime.utcnow()}},
+    )
+    SESSIONS_TIERED.inc(direction="archived")
+    ARCHIVE_BYTES.inc(len(raw), kind="raw")
+    ARCHIVE_BYTES.inc(len(data), kind="compressed")
+    return True
+
+
+async def archive_inactive_sessions(inactive_before: datetime, limit: int) -> int:
+    """Archive up to `limit` sessions not updated since `inactive_before`; returns how many moved."""
+    cursor = chat_sessions_collection.find({"updated_at": {"$lt": inactive_before}}).limit(limit)
+    archived = 0
+    async for session in cursor:
+        archived += await archive_session(session)
+    return archived
+
+
+async def restore_session(email: str, session_id: str) -> bool:
+    """Bring an archived session of the user back to the hot collections; False if there is none."""
+    query = {"_id": session_id, "user": email}
+    archived = await chat_archive_collection.find_one(query)
+    while archived and archived.get("pending_since"):
+        if datetime.utcnow() - archived["pending_since"] > timedelta(seconds=ARCHIVE_PENDING_TIMEOUT):
+            # Left pending by an archiver that stopped: the archive holds every message
+            break
+        # Still being archived: restore once its messages are gone from the hot collection
+        await asyncio.sleep(0.05)
+        archived = await chat_archive_collection.find_one(query)
+    if archived is None:
+        return False
+    payload = bson.decode(zlib.decompress(archived["data"]))
+    if payload["messages"]:
+        try:
+            await chat_messages_collection.insert_many(payload["messages"], ordered=False)
+        except BulkWriteError:
+            # Partly restored already (by a concurrent read)
+            pass
+    # Opening it counts as activity, so the next tiering run leaves it hot
+    session = {**payload["session"], "updated_at": datetime.utcnow()}
+    try:
+        await chat_sessions_collection.insert_one(session)
+    except DuplicateKeyError:
+        pass
+    await chat_archive_collection.delete_one({"_id": session_id})
+    SESSIONS_TIERED.inc(direction="restored")
+    return True
@@ -6,8 +6,8 @@ from pymongo.errors import DuplicateKeyError
 
 from app.auth.models import Token, UserCreate, UserResponse, UserInDB
 from app.auth.utils import (
-    authenticate_user, create_access_token, get_password_hash,
-    ACCESS_TOKEN_EXPIRE_MINUTES, users_collection, get_current_active_user
+    authenticate_user, create_access_token, get_password_hash_async,
+    ACCESS_TOKEN_EXPIRE_MINUTES, AUTH_PROJECTION, users_collection, get_current_active_user
 )
 
 router = APIRouter(prefix="/auth", tags=["auth"])
@@ -16,7 +16,7 @@ router = APIRouter(prefix="/auth", tags=["auth"])
 @router.post("/register", response_model=UserResponse, status_code=status.HTTP_201_CREATED)
 async def register_user(user_data: UserCreate):
     # Check if user exists
-    existing_user = await users_collection.find_one({"email": user_data.email})
+    existing_user = await users_collection.find_one({"email": user_data.email}, {"_id": 1})
     if existing_user:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
@@ -26,18 +26,17 @@ async def register_user(user_data: UserCreate):
     # Create new user
     user_dict = user_data.dict()
     user_dict.pop("password")
-    hashed_password = get_password_hash(user_data.password)
+    hashed_password = await get_password_hash_async(user_data.password)
     
     user_in_db = UserInDB(
         **user_dict,
-        hashed_password=hashed_password,
-        chat_sessions=[]  # Initialize with empty chat sessions
+        hashed_password=hashed_password
     )
     
     try:
         result = await users_collection.insert_one(user_in_db.dict(by_alias=True))
         user_id = result.inserted_id
-        created_user = await users_collection.find_one({"_id": user_id})
+        created_user = await users_collection.find_one({"_id": user_id}, AUTH_PROJECTION)
         return {
             "id": str(created_user["_id"]),
             "email": created_user["email"],
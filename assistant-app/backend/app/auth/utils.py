@@ -1,4 +1,8 @@
+import asyncio
 import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from collections import OrderedDict
 from datetime import datetime, timedelta
 from typing import Optional
 from jose import JWTError, jwt
@@ -15,17 +19,42 @@ SECRET_KEY = os.getenv("SECRET_KEY", "your-secret-key-placeholder")
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
 
-# Password hashing
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# Principal cache: resolved users keyed by token subject. Nothing updates
+# a user document in place, so entries are never invalidated: the TTL is
+# the only bound on how stale a cached user can be (in every process).
+PRINCIPAL_CACHE_TTL = float(os.getenv("PRINCIPAL_CACHE_TTL", "60"))
+PRINCIPAL_CACHE_SIZE = int(os.getenv("PRINCIPAL_CACHE_SIZE", "10000"))
+
+# Only the fields needed to build a UserInDB (never chat data)
+AUTH_PROJECTION = {
+    "email": 1, "full_name": 1, "is_active": 1, "hashed_password": 1,
+    "created_at": 1, "updated_at": 1,
+}
+
+# Password hashing (bcrypt runs on a small dedicated pool, never on the event loop)
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", "2"))
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=BCRYPT_ROUNDS)
+# Extra logins wait in the pool's queue without holding a thread
+_hash_executor = ThreadPoolExecutor(max_workers=PASSWORD_HASH_WORKERS, thread_name_prefix="bcrypt")
 
 # OAuth2 setup
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="auth/token")
 
 # MongoDB setup - use Motor for async operations
 mongo_uri = os.getenv("MONGODB_URI", "mongodb://localhost:27017")
-client = AsyncIOMotorClient(mongo_uri)
+if mongo_uri.startswith("mongomock://"):
+    # In-memory stand-in, used by the load-testing harness
+    from mongomock_motor import AsyncMongoMockClient
+    client = AsyncMongoMockClient()
+else:
+    client = AsyncIOMotorClient(mongo_uri)
 db = client.legal_assistant
 users_collection = db.users
+chat_sessions_collection = db.chat_sessions
+chat_messages_collection = db.chat_messages
+# Sessions inactive for a long time, compressed (see chat_store.archive_session)
+chat_archive_collection = db.chat_archive
 
 # Helper functions
 def verify_password(plain_password, hashed_password):
@@ -34,17 +63,47 @@ def verify_password(plain_password, hashed_password):
 def get_password_hash(password):
     return pwd_context.hash(password)
 
+async def _run_hashing(func, *args):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_hash_executor, func, *args)
+
+async def verify_password_async(plain_password, hashed_password):
+    return await _run_hashing(verify_password, plain_password, hashed_password)
+
+async def get_password_hash_async(password):
+    return await _run_hashing(get_password_hash, password)
+
 async def get_user(email: str):
-    user_dict = await users_collection.find_one({"email": email})
+    user_dict = await users_collection.find_one({"email": email}, AUTH_PROJECTION)
     if user_dict:
         return UserInDB(**user_dict)
     return None
 
+_principal_cache = OrderedDict()
+
+async def get_cached_user(email: str):
+    """Resolve a user through the principal cache (LRU with TTL; unknown users are not cached)."""
+    entry = _principal_cache.get(email)
+    now = time.monotonic()
+    if entry is not None and entry[0] > now:
+        _principal_cache.move_to_end(email)
+        return entry[1]
+
+    user = await get_user(email)
+    if user is None:
+        _principal_cache.pop(email, None)
+        return None
+    _principal_cache[email] = (now + PRINCIPAL_CACHE_TTL, user)
+    _principal_cache.move_to_end(email)
+    while len(_principal_cache) > PRINCIPAL_CACHE_SIZE:
+        _principal_cache.popitem(last=False)
+    return user
+
 async def authenticate_user(email: str, password: str):
     user = await get_user(email)
     if not user:
         return False
-    if not verify_password(password, user.hashed_password):
+    if not await verify_password_async(password, user.hashed_password):
         return False
     return user
 
@@ -72,7 +131,7 @@ async def get_current_user(token: str = Depends(oauth2_scheme)):
         token_data = TokenData(email=email)
     except JWTError:
         raise credentials_exception
-    user = await get_user(email=token_data.email)
+    user = await get_cached_user(token_data.email)
     if user is None:
         raise credentials_exception
     return user
@@ -0,0 +1,60 @@
+"""
+BM25+ retrieval served by worker processes.
+
+rank_bm25 scores every document in Python and NLTK tokenizes in Python, so
+in the API process they hold the GIL against every other request. With
+BM25_PROCESSES set, each worker process loads its own copy of the index
+and queries are tokenized and scored there.
+"""
+import multiprocessing
+import pickle
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from .metrics import timed
+from .text_processing import preprocess_text
+
+# Index of this worker process (set by _load_index)
+_bm25 = None
+_doc_ids = None
+
+
+def _load_index(path: str):
+    global _bm25, _doc_ids
+    with open(path, "rb") as f:
+        data = pickle.load(f)
+    _bm25, _doc_ids = data["bm25"], data["doc_ids"]
+
+
+def _document_count() -> int:
+    return len(_doc_ids)
+
+
+def _search(queries, top_k):
+    results = []
+    for query in queries:
+        scores = _bm25.get_scores(preprocess_text(query))
+        top_indices = np.argsort(scores)[::-1][:top_k]
+        results.append([(_doc_ids[idx], float(scores[idx])) for idx in top_indices])
+    return results
+
+
+class ProcessPoolBM25Retriever:
+    """Same interface as BM25PlusRetriever, scored in worker processes."""
+
+    def __init__(self, path: str, processes: int):
+        # Spawned so that the workers do not inherit the API's torch threads
+        self.pool = ProcessPoolExecutor(
+            max_workers=processes, mp_context=multiprocessing.get_context("spawn"),
+            initializer=_load_index, initargs=(path,),
+        )
+        count = self.pool.submit(_document_count).result()
+        print(f"BM25 Plus model loaded from {path} in {processes} worker processes ({count} documents)")
+
+    def retrieve(self, query, top_k=5):
+        return self.retrieve_batch([query], top_k)[0]
+
+    def retrieve_batch(self, queries, top_k=5):
+        with timed("bm25"):
+            return self.pool.submit(_search, list(queries), top_k).result()
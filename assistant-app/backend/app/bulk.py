@@ -0,0 +1,177 @@
+"""
+Answer a file of questions (CSV with a "question" column, or JSON Lines)
+in bulk, writing each answer to a JSON Lines file as soon as it is ready.
+
+Retrieval runs once per batch of questions and generation calls go through
+the scheduler at bulk priority, a few at a time. Rerunning the same command
+after an interruption skips the rows already answered. Run from the
+backend directory:
+
+    python -m app.bulk questions.csv --output answers.jsonl [--concurrency 2]
+"""
+import argparse
+import asyncio
+import csv
+import json
+import os
+from typing import List
+
+from .executors import ExecutorBusy, pipeline_executor
+from .generation import GenerationError
+from .metrics import Counter
+from .rag_pipeline import format_article_response
+from .scheduler import BULK, SchedulerOverloaded, generation_scheduler
+
+# Generation calls a bulk run keeps in flight (interactive traffic still goes first)
+BULK_CONCURRENCY = int(os.getenv("BULK_CONCURRENCY", "2"))
+# Questions retrieved together
+BULK_RETRIEVAL_BATCH = int(os.getenv("BULK_RETRIEVAL_BATCH", "16"))
+
+BULK_ANSWERS = Counter(
+    "juridoc_bulk_answers",
+    "Questions processed by bulk runs",
+    ["outcome"],
+)
+
+
+def read_questions(path: str) -> List[dict]:
+    """Rows of a CSV (a "question" column, optionally "id") or JSON Lines file, numbered from 0."""
+    with open(path, encoding="utf-8-sig", newline="") as f:
+        if path.endswith(".csv"):
+            records = list(csv.DictReader(f))
+        else:
+            records = [json.loads(line) for line in f if line.strip()]
+    rows = []
+    for row, record in enumerate(records):
+        if isinstance(record, str):
+            record = {"question": record}
+        question = (record.get("question") or "").strip()
+        if question:
+            rows.append({"row": row, "id": record.get("id"), "question": question})
+    return rows
+
+
+class JsonlResults:
+    """Results appended to a JSON Lines file, one line per row."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._cut_short = False
+
+    async def completed_rows(self) -> set:
+        if not os.path.exists(self.path):
+            return set()
+        completed = set()
+        with open(self.path, encoding="utf-8") as f:
+            for line in f:
+                self._cut_short = not line.endswith("\n")
+                try:
+                    result = json.loads(line)
+                except ValueError:
+                    # A line cut short by the interruption
+                    continue
+                if "answer" in result:
+                    completed.add(result["row"])
+        return completed
+
+    async def write(self, result: dict):
+        with open(self.path, "a", encoding="utf-8") as f:
+            if self._cut_short:
+                # Don't glue the first result onto the interrupted line
+                f.write("\n")
+                self._cut_short = False
+            f.write(json.dumps(result, ensure_ascii=False) + "\n")
+
+
+async def _patiently(call, *args, retry_on=SchedulerOverloaded):
+    """Await call(*args), waiting out the overload rejections that interactive requests would get."""
+    while True:
+        try:
+            return await call(*args)
+        except retry_on as exc:
+            await asyncio.sleep(exc.retry_after)
+
+
+async def _generate(pipeline, row: dict, documents, retrieval_mode, user_id: str):
+    """
+    Answer one row. Every attempt is a new generation call, so each one
+    takes its own bulk token; only calls the executor turned away before
+    running are retried as they are.
+    """
+    while True:
+        if pipeline.backend.rate_limited:
+            await _patiently(generation_scheduler.acquire, user_id, BULK)
+        try:
+            return await _patiently(
+                pipeline_executor.run, pipeline.answer_with_context, row["question"], documents, retrieval_mode,
+                retry_on=ExecutorBusy,
+            )
+        except SchedulerOverloaded as exc:
+            # Quota exhausted upstream: the backend paused the scheduler, the next token waits for it
+            if not pipeline.backend.rate_limited:
+                await asyncio.sleep(exc.retry_after)
+
+
+async def _answer_row(pipeline, row: dict, context, results, user_id: str, slots: asyncio.Semaphore):
+    documents, retrieval_mode = context
+    async with slots:
+        result = {"row": row["row"], "id": row["id"], "question": row["question"]}
+        try:
+            answer, documents, _ = await _generate(pipeline, row, documents, retrieval_mode, user_id)
+        except GenerationError as e:
+            BULK_ANSWERS.inc(outcome="failed")
+            result["error"] = str(e)
+        else:
+            BULK_ANSWERS.inc(outcome="answered")
+            articles = [format_article_response(doc) for doc in documents]
+            result.update(
+                answer=answer,
+                articles=[{key: article[key] for key in ("id", "article_number", "code")} for article in articles],
+                retrieval=retrieval_mode,
+            )
+    await results.write(result)
+
+
+async def run_bulk(
+    pipeline, rows: List[dict], results, user_id: str,
+    concurrency: int = BULK_CONCURRENCY, batch_size: int = BULK_RETRIEVAL_BATCH,
+):
+    """
+    Answer the rows not yet answered in `results` (rows that failed are
+    retried). Returns the number of rows processed by this run.
+    """
+    completed = await results.completed_rows()
+    pending = [row for row in rows if row["row"] not in completed]
+    slots = asyncio.Semaphore(concurrency)
+    for start in range(0, len(pending), batch_size):
+        batch = pending[start:start + batch_size]
+        contexts = await _patiently(
+            pipeline_executor.run, pipeline.retrieve_contexts_batch, [row["question"] for row in batch],
+            retry_on=ExecutorBusy,
+        )
+        await asyncio.gather(*(
+            _answer_row(pipeline, row, context, results, user_id, slots) for row, context in zip(batch, contexts)
+        ))
+    return len(pending)
+
+
+async def _main(args):
+    from .generation import build_generation_backend
+    from .rag_pipeline import RAGPipeline
+
+    rows = read_questions(args.questions)
+    results = JsonlResults(args.output)
+    done = len(await results.completed_rows())
+    print(f"{len(rows)} questions, {done} already answered in {args.output}")
+    pipeline = RAGPipeline(build_generation_backend())
+    processed = await run_bulk(pipeline, rows, results, "bulk-cli", args.concurrency, args.batch_size)
+    print(f"Processed {processed} questions into {args.output}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("questions", help="CSV (with a 'question' column) or JSON Lines file")
+    parser.add_argument("--output", required=True, help="JSON Lines file the answers are appended to")
+    parser.add_argument("--concurrency", type=int, default=BULK_CONCURRENCY)
+    parser.add_argument("--batch-size", type=int, default=BULK_RETRIEVAL_BATCH)
+    asyncio.run(_main(parser.parse_args()))
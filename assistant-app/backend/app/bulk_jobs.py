@@ -0,0 +1,146 @@
+import asyncio
+import os
+from datetime import datetime, timedelta
+from typing import List, Optional
+
+from bson import ObjectId
+from pymongo import ASCENDING, ReturnDocument
+
+from .auth.utils import db
+from .bulk import run_bulk
+
+# Bulk jobs of the /ask/batch endpoint: the job (its questions and progress)
+# and one result document per answered row. A worker holds a job through a
+# lease it renews while running, so a job left behind by a stopped worker is
+# picked up again (resuming after its last answered row) by another one.
+bulk_jobs_collection = db.bulk_jobs
+bulk_results_collection = db.bulk_job_results
+
+BULK_MAX_QUESTIONS = int(os.getenv("BULK_MAX_QUESTIONS", "1000"))
+BULK_JOB_LEASE = float(os.getenv("BULK_JOB_LEASE", "120"))
+
+# Jobs running in this process (the event loop only keeps weak references to tasks)
+_running = {}
+
+
+class MongoResults:
+    """Results of one job, one document per row."""
+
+    def __init__(self, job_id: str):
+        self.job_id = job_id
+
+    async def completed_rows(self) -> set:
+        return set(await bulk_results_collection.distinct("row", {"job_id": self.job_id, "answer": {"$exists": True}}))
+
+    async def write(self, result: dict):
+        previous = await bulk_results_collection.find_one_and_replace(
+            {"job_id": self.job_id, "row": result["row"]}, {"job_id": self.job_id, **result},
+            {"error": 1}, upsert=True,
+        )
+        # A row answered on a retry no longer counts as failed
+        counts = {"completed": 1} if "answer" in result else {"failed": 1}
+        if previous and "error" in previous:
+            counts["failed"] = counts.get("failed", 0) - 1
+        await bulk_jobs_collection.update_one(
+            {"_id": self.job_id}, {"$inc": counts, "$set": {"updated_at": datetime.utcnow()}}
+        )
+
+
+async def ensure_indexes():
+    await bulk_jobs_collection.create_index([("status", ASCENDING), ("lease_until", ASCENDING)])
+    await bulk_results_collection.create_index([("job_id", ASCENDING), ("row", ASCENDING)], unique=True)
+
+
+async def create_job(email: str, questions: List[str]) -> dict:
+    now = datetime.utcnow()
+    job = {
+        "_id": str(ObjectId()),
+        "user": email,
+        "status": "queued",
+        "questions": questions,
+        "total": len(questions),
+        "completed": 0,
+        "failed": 0,
+        "created_at": now,
+        "updated_at": now,
+        "lease_until": now,
+    }
+    await bulk_jobs_collection.insert_one(job)
+    return job
+
+
+async def get_job(email: str, job_id: str) -> Optional[dict]:
+    return await bulk_jobs_collection.find_one({"_id": job_id, "user": email}, {"questions": 0})
+
+
+async def get_results(job_id: str, after: int = -1, limit: int = 100):
+    """Results with row > after, in row order, and the cursor of the next page."""
+    cursor = bulk_results_collection.find({"job_id": job_id, "row": {"$gt": after}}, {"_id": 0, "job_id": 0})
+    results = await cursor.sort("row", ASCENDING).to_list(length=limit + 1)
+    next_cursor = results[limit - 1]["row"] if len(results) > limit else None
+    return results[:limit], next_cursor
+
+
+async def _claim(job_id: Optional[str] = None) -> Optional[dict]:
+    """Take the lease of a job nobody holds (this one, or any unfinished one)."""
+    now = datetime.utcnow()
+    query = {"status": {"$in": ["queued", "running"]}, "lease_until": {"$lte": now}}
+    if job_id:
+        query["_id"] = job_id
+    return await bulk_jobs_collection.find_one_and_update(
+        query,
+        {"$set": {"status": "running", "lease_until": now + timedelta(seconds=BULK_JOB_LEASE)}},
+        return_document=ReturnDocument.AFTER,
+    )
+
+
+async def _renew_lease(job_id: str):
+    while True:
+        await asyncio.sleep(BULK_JOB_LEASE / 3)
+        await bulk_jobs_collection.update_one(
+            {"_id": job_id},
+            {"$set": {"lease_until": datetime.utcnow() + timedelta(seconds=BULK_JOB_LEASE)}},
+        )
+
+
+async def _run_job(pipeline, job: dict):
+    rows = [{"row": row, "id": None, "question": question} for row, question in enumerate(job["questions"])]
+    renewal = asyncio.create_task(_renew_lease(job["_id"]))
+    status = "failed"
+    try:
+        await run_bulk(pipeline, rows, MongoResults(job["_id"]), job["user"])
+        status = "done"
+    except asyncio.CancelledError:
+        # The worker is stopping: release the job so that another one resumes it
+        status = "queued"
+        raise
+    except Exception as e:
+        print(f"Bulk job {job['_id']} failed: {e}")
+    finally:
+        renewal.cancel()
+        _running.pop(job["_id"], None)
+        await bulk_jobs_collection.update_one(
+            {"_id": job["_id"]},
+            {"$set": {"status": status, "updated_at": datetime.utcnow(), "lease_until": datetime.utcnow()}},
+        )
+
+
+def _start(pipeline, job: dict):
+    _running[job["_id"]] = asyncio.create_task(_run_job(pipeline, job))
+
+
+async def start_job(pipeline, job_id: str):
+    job = await _claim(job_id)
+    if job:
+        _start(pipeline, job)
+
+
+async def resume_jobs(pipeline, interval: float = BULK_JOB_LEASE / 2):
+    """Pick up the jobs whose worker stopped (runs as a background task)."""
+    while True:
+        job = await _claim()
+        while job:
+            print(f"Resuming bulk job {job['_id']} ({job['completed']}/{job['total']} answered)")
+            _start(pipeline, job)
+            job = await _claim()
+        await asyncio.sleep(interval)
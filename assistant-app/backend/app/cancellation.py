@@ -0,0 +1,50 @@
+import contextvars
+import threading
+
+from .metrics import Counter
+
+CANCELLED = Counter(
+    "juridoc_requests_cancelled",
+    "Answers abandoned because the client went away, by the stage they were stopped in",
+    ["stage"],
+)
+
+# Set when the client of the current request is gone; worker threads see it
+# through the copied context
+_cancel_event = contextvars.ContextVar("cancel_event", default=None)
+
+
+class RequestCancelled(Exception):
+    """
+    Raised at a pipeline checkpoint once the request has been cancelled.
+
+    `partial` holds the text generated before the stop (if any) and
+    `generation_started` whether the generation backend had been called.
+    """
+
+    def __init__(self, partial: str = None):
+        super().__init__("Request cancelled")
+        self.partial = partial
+        self.generation_started = partial is not None
+        self.documents = []
+
+
+def start_cancellation_scope(event: threading.Event = None) -> threading.Event:
+    """Make the current context cancellable (by `event`, or a new one); set the returned event to cancel it."""
+    event = event or threading.Event()
+    _cancel_event.set(event)
+    return event
+
+
+def current_cancel_event():
+    return _cancel_event.get()
+
+
+def is_cancelled() -> bool:
+    event = _cancel_event.get()
+    return event is not None and event.is_set()
+
+
+def check_cancelled():
+    if is_cancelled():
+        raise RequestCancelled()
@@ -0,0 +1,86 @@
+import asyncio
+import os
+import socket
+from datetime import datetime, timedelta
+
+from pymongo.errors import DuplicateKeyError
+
+from .auth import chat_store
+from .auth.utils import db
+from .metrics import Gauge
+
+# Sessions not updated for this many days move to the archive (0 disables tiering)
+CHAT_ARCHIVE_AFTER_DAYS = float(os.getenv("CHAT_ARCHIVE_AFTER_DAYS", "90"))
+CHAT_TIERING_INTERVAL = float(os.getenv("CHAT_TIERING_INTERVAL", "3600"))
+# Sessions archived per run, so that a backlog is spread over several runs
+CHAT_TIERING_BATCH = int(os.getenv("CHAT_TIERING_BATCH", "1000"))
+
+# Every API worker runs the tiering loop, but only the one holding this lease
+# archives sessions; another worker takes over once it has not been renewed
+# for two intervals.
+tiering_lease_collection = db.task_leases
+TIERING_LEASE_ID = "chat_tiering"
+_worker_id = f"{socket.gethostname()}:{os.getpid()}"
+
+COLLECTION_BYTES = Gauge(
+    "juridoc_mongo_collection_bytes",
+    "Size of a collection: its uncompressed data, storage on disk and indexes",
+    ["collection", "kind"],
+)
+COLLECTION_DOCUMENTS = Gauge(
+    "juridoc_mongo_collection_documents",
+    "Documents in a collection",
+    ["collection"],
+)
+
+STORAGE_COLLECTIONS = ("users", "chat_sessions", "chat_messages", "chat_archive")
+
+
+async def refresh_storage_metrics():
+    """Update the size gauges of the collections (hot ones should fit in memory)."""
+    for name in STORAGE_COLLECTIONS:
+        stats = await db[name].aggregate([{"$collStats": {"storageStats": {}}}]).to_list(length=1)
+        storage = stats[0]["storageStats"] if stats else {}
+        COLLECTION_DOCUMENTS.set(storage.get("count", 0), collection=name)
+        COLLECTION_BYTES.set(storage.get("size", 0), collection=name, kind="data")
+        COLLECTION_BYTES.set(storage.get("storageSize", 0), collection=name, kind="storage")
+        COLLECTION_BYTES.set(storage.get("totalIndexSize", 0), collection=name, kind="indexes")
+
+
+async def _hold_lease(interval: float) -> bool:
+    """Take or renew the tiering lease; False while another worker holds it."""
+    now = datetime.utcnow()
+    try:
+        await tiering_lease_collection.find_one_and_update(
+            {"_id": TIERING_LEASE_ID, "$or": [{"holder": _worker_id}, {"lease_until": {"$lte": now}}]},
+            {"$set": {"holder": _worker_id, "lease_until": now + timedelta(seconds=2 * interval)}},
+            upsert=True,
+        )
+    except DuplicateKeyError:
+        # Held by another worker (the upsert collided with its document)
+        return False
+    return True
+
+
+async def archive_inactive_sessions():
+    inactive_before = datetime.utcnow() - timedelta(days=CHAT_ARCHIVE_AFTER_DAYS)
+    archived = await chat_store.archive_inactive_sessions(inactive_before, CHAT_TIERING_BATCH)
+    if archived:
+        print(f"Archived {archived} chat sessions inactive since {inactive_before:%Y-%m-%d}")
+
+
+async def run_tiering(interval: float = CHAT_TIERING_INTERVAL):
+    """Archive inactive sessions and refresh the storage metrics periodically (runs as a background task)."""
+    while True:
+        if CHAT_ARCHIVE_AFTER_DAYS > 0:
+            try:
+                if await _hold_lease(interval):
+                    await archive_inactive_sessions()
+            except Exception as e:
+                print(f"Chat session tiering failed: {e}")
+        try:
+            await refresh_storage_metrics()
+        except Exception as e:
+            # Not every deployment allows $collStats (nor does the in-memory stand-in)
+            print(f"Could not read collection storage stats: {e}")
+        await asyncio.sleep(interval)
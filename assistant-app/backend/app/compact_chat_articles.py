@@ -0,0 +1,77 @@
+"""
+Replace the article texts embedded in chat sessions and messages with
+article ids plus the version of the index they come from (the form the API
+now writes, see auth/chat_store.py).
+
+Article lists with an entry that has no id are left as they are. The
+migration is idempotent: compacted documents no longer match its queries.
+Run from the backend directory:
+
+    python -m app.compact_chat_articles [--dry-run] [--corpus path/to/corpus_lookup.pkl]
+"""
+import argparse
+
+from pymongo import UpdateOne
+
+from .db_init import db, init_db
+
+BATCH_SIZE = 1000
+DEFAULT_CORPUS = "../../knowledge_base/vector_store/corpus_lookup.pkl"
+
+
+def compaction(document: dict, index_version: str):
+    """The update compacting one document, or None if some of its articles have no id."""
+    articles = document.get("articles") or []
+    if not all(article.get("id") for article in articles):
+        return None
+    return UpdateOne(
+        {"_id": document["_id"]},
+        {
+            "$set": {"article_ids": [article["id"] for article in articles], "index_version": index_version},
+            "$unset": {"articles": ""},
+        },
+    )
+
+
+def compact_collection(collection, query: dict, index_version: str, dry_run: bool = False):
+    """Compact the matching documents in batches; returns (compacted, skipped)."""
+    compacted = skipped = 0
+    batch = []
+    # Only the ids are read, never the article texts
+    for document in collection.find(query, {"articles.id": 1}):
+        update = compaction(document, index_version)
+        if update is None:
+            skipped += 1
+            continue
+        compacted += 1
+        if not dry_run:
+            batch.append(update)
+        if len(batch) >= BATCH_SIZE:
+            collection.bulk_write(batch, ordered=False)
+            batch = []
+    if batch:
+        collection.bulk_write(batch, ordered=False)
+    return compacted, skipped
+
+
+def migrate(corpus_path: str, dry_run: bool = False):
+    from .rag_pipeline import corpus_version
+
+    init_db()
+    with open(corpus_path, "rb") as f:
+        index_version = corpus_version(f.read())
+
+    sessions = compact_collection(db.chat_sessions, {"articles": {"$exists": True}}, index_version, dry_run)
+    messages = compact_collection(db.chat_messages, {"articles.0": {"$exists": True}}, index_version, dry_run)
+    action = "Would compact" if dry_run else "Compacted"
+    print(f"{action} {sessions[0]} chat sessions and {messages[0]} messages (index version {index_version})")
+    if sessions[1] or messages[1]:
+        print(f"Left {sessions[1]} sessions and {messages[1]} messages with articles that have no id")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--dry-run", action="store_true", help="Only count the documents to compact")
+    parser.add_argument("--corpus", default=DEFAULT_CORPUS, help="Corpus the stored article ids refer to")
+    args = parser.parse_args()
+    migrate(args.corpus, dry_run=args.dry_run)
@@ -1,21 +1,34 @@
-from pymongo import MongoClient, ASCENDING
+from pymongo import MongoClient, ASCENDING, DESCENDING
 import os
 
-# MongoDB connection
-MONGO_CONNECTION_STRING = os.getenv("MONGO_CONNECTION_STRING", "mongodb://localhost:27017")
-client = MongoClient(MONGO_CONNECTION_STRING)
-db = client.juridoc_db
+# MongoDB connection (same database as the API, see auth/utils.py)
+MONGO_CONNECTION_STRING = os.getenv("MONGODB_URI", "mongodb://localhost:27017")
+if MONGO_CONNECTION_STRING.startswith("mongomock://"):
+    # In-memory stand-in, like the API's (tests and the load-testing harness)
+    import mongomock
+    client = mongomock.MongoClient()
+else:
+    client = MongoClient(MONGO_CONNECTION_STRING)
+db = client.legal_assistant
 
 def init_db():
     """Initialize database with required collections and indexes."""
-    # Create users collection if it doesn't exist
-    if "users" not in db.list_collection_names():
-        db.create_collection("users")
-    
+    # Create collections if they don't exist
+    existing = db.list_collection_names()
+    for name in ("users", "chat_sessions", "chat_messages", "chat_archive", "bulk_jobs", "bulk_job_results", "task_leases"):
+        if name not in existing:
+            db.create_collection(name)
+
     # Create indexes
     db.users.create_index([("email", ASCENDING)], unique=True)
-    
+    db.chat_sessions.create_index([("user", ASCENDING), ("date", DESCENDING)])
+    db.chat_messages.create_index([("session_id", ASCENDING), ("seq", ASCENDING)], unique=True)
+    db.chat_sessions.create_index([("updated_at", ASCENDING)])
+    db.chat_archive.create_index([("user", ASCENDING), ("date", DESCENDING)])
+    db.bulk_jobs.create_index([("status", ASCENDING), ("lease_until", ASCENDING)])
+    db.bulk_job_results.create_index([("job_id", ASCENDING), ("row", ASCENDING)], unique=True)
+
     print("Database initialization completed successfully!")
 
 if __name__ == "__main__":
-    init_db()
\ No newline at end of file
+    init_db()
@@ -0,0 +1,252 @@
+"""
+Query embedding with dynamic batching.
+
+Concurrent query encodes are gathered for up to EMBED_MAX_WAIT_MS (or
+until EMBED_MAX_BATCH queries) and encoded in one forward pass, which on
+CPU costs little more than encoding a single query. The batcher runs in
+process by default; with EMBEDDING_SERVICE_SOCKET set, the API workers
+send their queries to one embedding service per host instead of each
+loading the model. Both sides authenticate with EMBEDDING_SERVICE_AUTHKEY,
+and the socket is created in a directory only the service's user can
+enter:
+
+    EMBEDDING_SERVICE_AUTHKEY=... python -m app.embedding_service --socket /run/juridoc/embed.sock [--metrics-port 9101]
+"""
+import argparse
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from multiprocessing.connection import Client, Listener
+
+import numpy as np
+
+from .metrics import Histogram, render_latest
+
+# Unix socket of the host's embedding service (unset: each process embeds its own queries)
+EMBEDDING_SERVICE_SOCKET = os.getenv("EMBEDDING_SERVICE_SOCKET")
+# Shared secret of the service and its clients (connections are authenticated before any message is read)
+EMBEDDING_SERVICE_AUTHKEY = os.getenv("EMBEDDING_SERVICE_AUTHKEY", "")
+DEFAULT_SOCKET = "/tmp/juridoc-embed/embed.sock"
+EMBED_MAX_BATCH = int(os.getenv("EMBED_MAX_BATCH", "16"))
+EMBED_MAX_WAIT_MS = float(os.getenv("EMBED_MAX_WAIT_MS", "5"))
+DEFAULT_EMBED_MODEL = "intfloat/multilingual-e5-large"
+
+EMBED_BATCH_SIZE = Histogram(
+    "juridoc_embed_batch_size",
+    "Queries encoded per forward pass",
+    buckets=(1, 2, 4, 8, 16, 32, 64),
+)
+EMBED_QUEUE_WAIT = Histogram(
+    "juridoc_embed_queue_wait_seconds",
+    "Time a query encode waited for its batch to start",
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0),
+)
+
+
+class EmbeddingServiceError(Exception):
+    """The embedding service could not encode the queries."""
+
+
+class QueryBatcher:
+    """
+    Encodes queries in batches on a single thread.
+
+    `encode_fn` takes a list of queries and returns their embeddings; it is
+    only ever called from the batching thread, so the model needs no lock.
+    """
+
+    def __init__(self, encode_fn, max_batch: int = EMBED_MAX_BATCH, max_wait: float = EMBED_MAX_WAIT_MS / 1000):
+        self.encode_fn = encode_fn
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name="embed-batcher", daemon=True)
+        self._thread.start()
+
+    def __call__(self, queries) -> np.ndarray:
+        """Embeddings of `queries` (one row per query), blocking until their batch is encoded."""
+        future = Future()
+        self._queue.put((list(queries), future, time.perf_counter()))
+        return future.result()
+
+    def _next_batch(self):
+        batch = [self._queue.get()]
+        size = len(batch[0][0])
+        deadline = time.perf_counter() + self.max_wait
+        while size < self.max_batch:
+            timeout = deadline - time.perf_counter()
+            if timeout <= 0:
+                break
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                break
+            batch.append(item)
+            size += len(item[0])
+        return batch, size
+
+    def _run(self):
+        while True:
+            batch, size = self._next_batch()
+            start = time.perf_counter()
+            for _, _, enqueued in batch:
+                EMBED_QUEUE_WAIT.observe(start - enqueued)
+            EMBED_BATCH_SIZE.observe(size)
+            try:
+                vectors = np.asarray(self.encode_fn([q for queries, _, _ in batch for q in queries]), dtype=np.float32)
+            except Exception as e:
+                for _, future, _ in batch:
+                    future.set_exception(e)
+                continue
+            offset = 0
+            for queries, future, _ in batch:
+                future.set_result(vectors[offset:offset + len(queries)])
+                offset += len(queries)
+
+
+class EmbeddingClient:
+    """Encodes queries through the host's embedding service (one connection per thread)."""
+
+    def __init__(self, socket_path: str, authkey: bytes):
+        self.socket_path = socket_path
+        self.authkey = authkey
+        self._local = threading.local()
+
+    def __call__(self, queries) -> np.ndarray:
+        try:
+            return self._request(list(queries))
+        except (EOFError, OSError):
+            # The service restarted since this thread connected: reconnect once
+            self._local.connection = None
+            try:
+                return self._request(list(queries))
+            except (EOFError, OSError) as e:
+                raise EmbeddingServiceError(f"Embedding service unavailable at {self.socket_path}: {e}") from e
+
+    def _request(self, queries):
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = self._local.connection = Client(
+                self.socket_path, family="AF_UNIX", authkey=self.authkey
+            )
+        connection.send(queries)
+        status, result = connection.recv()
+        if status != "ok":
+            raise EmbeddingServiceError(result)
+        return result
+
+
+def load_query_encoder(embed_model_name: str = DEFAULT_EMBED_MODEL):
+    """
+    The embedding model and query encoder of a retriever. With the embedding
+    service configured, no model is loaded (None) and queries go to the service.
+    """
+    if EMBEDDING_SERVICE_SOCKET:
+        print(f"Encoding queries with the embedding service at {EMBEDDING_SERVICE_SOCKET}")
+        return None, EmbeddingClient(EMBEDDING_SERVICE_SOCKET, service_authkey())
+    embed_model = load_embed_model(embed_model_name)
+    return embed_model, batched_encoder(embed_model)
+
+
+def service_authkey() -> bytes:
+    # multiprocessing.connection unpickles what it receives: never run it unauthenticated
+    if len(EMBEDDING_SERVICE_AUTHKEY) < 16:
+        raise RuntimeError("Set EMBEDDING_SERVICE_AUTHKEY (at least 16 characters) to use the embedding service")
+    return EMBEDDING_SERVICE_AUTHKEY.encode()
+
+
+def _private_directory(path: str):
+    """Create (or check) a directory only the current user can access."""
+    os.makedirs(path, mode=0o700, exist_ok=True)
+    info = os.stat(path)
+    if info.st_uid != os.getuid() or info.st_mode & 0o077:
+        raise RuntimeError(f"{path} must belong to this user and be accessible by nobody else (mode 0700)")
+
+
+def load_embed_model(embed_model_name: str = DEFAULT_EMBED_MODEL):
+    import torch
+    from llama_index.embeddings.huggingface import HuggingFaceEmbedding
+
+    # Check if GPU is available
+    device = "cuda" if torch.cuda.is_available() else "cpu"
+    print(f"Using device: {device} for embeddings")
+    return HuggingFaceEmbedding(model_name=embed_model_name, device=device)
+
+
+def batched_encoder(embed_model) -> QueryBatcher:
+    from .retrievers import embed_queries
+
+    return QueryBatcher(lambda queries: embed_queries(embed_model, queries))
+
+
+def _serve_connection(connection, encoder: QueryBatcher):
+    with connection:
+        while True:
+            try:
+                queries = connection.recv()
+            except (EOFError, OSError):
+                return
+            try:
+                connection.send(("ok", encoder(queries)))
+            except Exception as e:
+                connection.send(("error", f"{type(e).__name__}: {e}"))
+
+
+def _serve_metrics(port: int):
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            body = render_latest().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    print(f"Embedding metrics on http://127.0.0.1:{port}/metrics")
+
+
+def serve(socket_path: str, embed_model_name: str = DEFAULT_EMBED_MODEL, metrics_port: int = None):
+    """Serve query encodes on a Unix socket, one thread per connected worker thread."""
+    authkey = service_authkey()
+    _private_directory(os.path.dirname(os.path.abspath(socket_path)))
+    encoder = batched_encoder(load_embed_model(embed_model_name))
+    if metrics_port:
+        _serve_metrics(metrics_port)
+    if os.path.exists(socket_path):
+        # Left over by a previous run
+        os.unlink(socket_path)
+    # The socket is created owner-only, on top of the private directory
+    umask = os.umask(0o177)
+    try:
+        listener = Listener(socket_path, family="AF_UNIX", authkey=authkey)
+    finally:
+        os.umask(umask)
+    with listener:
+        print(f"Embedding service listening on {socket_path} (batches of up to {encoder.max_batch}, "
+              f"{encoder.max_wait * 1000:g} ms wait)")
+        while True:
+            try:
+                connection = listener.accept()
+            except Exception as e:
+                # A client with the wrong key (rejected before anything is unpickled)
+                print(f"Refused embedding service connection: {e}")
+                continue
+            threading.Thread(target=_serve_connection, args=(connection, encoder), daemon=True).start()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Query embedding service with dynamic batching")
+    parser.add_argument("--socket", default=EMBEDDING_SERVICE_SOCKET or DEFAULT_SOCKET)
+    parser.add_argument("--model", default=DEFAULT_EMBED_MODEL)
+    parser.add_argument("--metrics-port", type=int, default=None, help="Serve Prometheus metrics on this port")
+    args = parser.parse_args()
+    serve(args.socket, args.model, args.metrics_port)
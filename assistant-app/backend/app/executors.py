@@ -0,0 +1,70 @@
+import asyncio
+import contextvars
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from .metrics import Counter, Gauge
+from .scheduler import SchedulerOverloaded
+
+# Threads running the (blocking) pipeline: retrieval, torch encoding and the generation call
+PIPELINE_THREADS = int(os.getenv("PIPELINE_THREADS", "8"))
+# Calls allowed to wait for a thread before new ones are turned away
+PIPELINE_MAX_PENDING = int(os.getenv("PIPELINE_MAX_PENDING", "32"))
+
+EXECUTOR_IN_FLIGHT = Gauge(
+    "juridoc_executor_in_flight",
+    "Calls running or waiting in a pipeline executor",
+    ["executor"],
+)
+EXECUTOR_REJECTED = Counter(
+    "juridoc_executor_rejected",
+    "Calls turned away because the executor's queue was full",
+    ["executor"],
+)
+
+
+class ExecutorBusy(SchedulerOverloaded):
+    """Raised when a call is turned away before it ran (nothing was attempted)."""
+
+
+class BoundedExecutor:
+    """
+    Runs blocking calls on a dedicated thread pool, off the event loop.
+
+    At most `workers` calls run at once and `max_pending` more may wait;
+    beyond that run() raises ExecutorBusy (503) rather than letting
+    the queue grow. A call keeps its slot until its thread finishes, even if
+    the awaiting request is cancelled. Calls run in a copy of the caller's
+    context, so stage timings still reach the request.
+    """
+
+    def __init__(self, name: str, workers: int, max_pending: int):
+        self.name = name
+        self.capacity = workers + max_pending
+        self.in_flight = 0
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=name)
+
+    async def run(self, fn, *args):
+        if self.in_flight >= self.capacity:
+            EXECUTOR_REJECTED.inc(executor=self.name)
+            raise ExecutorBusy("The server is busy, please retry shortly", retry_after=1)
+        loop = asyncio.get_running_loop()
+        self._acquire()
+        try:
+            future = self._executor.submit(contextvars.copy_context().run, fn, *args)
+        except BaseException:
+            self._release()
+            raise
+        future.add_done_callback(lambda _: loop.call_soon_threadsafe(self._release))
+        return await asyncio.wrap_future(future)
+
+    def _acquire(self):
+        self.in_flight += 1
+        EXECUTOR_IN_FLIGHT.set(self.in_flight, executor=self.name)
+
+    def _release(self):
+        self.in_flight -= 1
+        EXECUTOR_IN_FLIGHT.set(self.in_flight, executor=self.name)
+
+
+pipeline_executor = BoundedExecutor("pipeline", PIPELINE_THREADS, PIPELINE_MAX_PENDING)
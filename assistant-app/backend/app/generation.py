@@ -0,0 +1,361 @@
+import contextvars
+import json
+import os
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import requests
+from dotenv import load_dotenv
+
+from .cancellation import RequestCancelled, check_cancelled, current_cancel_event, is_cancelled
+from .metrics import Counter, record_stage
+from .scheduler import SchedulerOverloaded, generation_scheduler
+
+load_dotenv()
+
+# Backend selection: the primary answers, the fallback takes over on errors (and hedges slow calls)
+GENERATION_BACKEND = os.getenv("GENERATION_BACKEND", "gemini")
+GENERATION_FALLBACK_BACKEND = os.getenv("GENERATION_FALLBACK_BACKEND", "")
+GENERATION_HEDGE = os.getenv("GENERATION_HEDGE", "true").lower() in ("1", "true", "yes")
+# The hedge fires once the primary is slower than this percentile of its recent latencies
+GENERATION_HEDGE_PERCENTILE = float(os.getenv("GENERATION_HEDGE_PERCENTILE", "95"))
+GENERATION_HEDGE_MIN_DELAY = float(os.getenv("GENERATION_HEDGE_MIN_DELAY", "1.0"))
+# Used until enough latencies have been observed
+GENERATION_HEDGE_INITIAL_DELAY = float(os.getenv("GENERATION_HEDGE_INITIAL_DELAY", "5.0"))
+GENERATION_HEDGE_MIN_SAMPLES = 20
+GENERATION_WORKERS = int(os.getenv("GENERATION_WORKERS", "16"))
+
+# Overridable so that a local stand-in can replace the Gemini API
+GEMINI_API_BASE = os.getenv("GEMINI_API_BASE", "https://generativelanguage.googleapis.com")
+GEMINI_MODEL = os.getenv("GEMINI_MODEL", "gemini-2.0-flash")
+# Seconds to connect, and to wait for each streamed chunk, before a Gemini call fails
+GEMINI_CONNECT_TIMEOUT = float(os.getenv("GEMINI_CONNECT_TIMEOUT", "5"))
+GEMINI_READ_TIMEOUT = float(os.getenv("GEMINI_READ_TIMEOUT", "30"))
+VLLM_MODEL_PATH = os.getenv(
+    "VLLM_MODEL_PATH",
+    "/mnt/d/a_PROJECTS/legal-rag-assistant/FineTuned-Qwen-Morocco/qwen-morocco-legal/merged_16bit",
+)
+STUB_GENERATION_DELAY = float(os.getenv("STUB_GENERATION_DELAY", "0"))
+STUB_GENERATION_ERROR_RATE = float(os.getenv("STUB_GENERATION_ERROR_RATE", "0"))
+
+HEDGES = Counter(
+    "juridoc_generation_hedges",
+    "Hedged second generation requests, by the backend that answered first",
+    ["winner"],
+)
+FALLBACKS = Counter(
+    "juridoc_generation_fallbacks",
+    "Generations answered by the fallback backend after the primary failed",
+    ["primary"],
+)
+ERRORS = Counter(
+    "juridoc_generation_errors",
+    "Failed generation calls",
+    ["backend"],
+)
+
+_executor = ThreadPoolExecutor(max_workers=GENERATION_WORKERS, thread_name_prefix="generation")
+
+
+class GenerationError(Exception):
+    """Raised when a backend could not produce an answer."""
+
+
+class GenerationBackend:
+    """Turns a system prompt and a user prompt into an answer."""
+    name = "base"
+    # Whether calls consume the shared Gemini rate-limit tokens
+    rate_limited = False
+
+    def generate(self, system_prompt: str, prompt: str, legal: bool = True) -> str:
+        raise NotImplementedError
+
+
+class GeminiBackend(GenerationBackend):
+    name = "gemini"
+    rate_limited = True
+
+    def __init__(self, api_key: str = None, model_name: str = GEMINI_MODEL):
+        self.api_key = api_key or os.environ.get("GEMINI_API_KEY")
+        if not self.api_key:
+            raise ValueError("Gemini API key is required. Provide it as a parameter or set GEMINI_API_KEY environment variable.")
+        self.model_name = model_name
+        # Streamed so that a cancelled request can close the connection mid-answer
+        self.api_url = (
+            f"{GEMINI_API_BASE}/v1beta/models/{self.model_name}:streamGenerateContent?alt=sse&key={self.api_key}"
+        )
+
+    def generate(self, system_prompt: str, prompt: str, legal: bool = True) -> str:
+        payload = {
+            "contents": [{
+                "parts": [{"text": f"{system_prompt}\n\n{prompt}"}]
+            }],
+            "generationConfig": {
+                "temperature": 0.5,
+                "topP": 0.9,
+                "topK": 40,
+                "maxOutputTokens": 800 if legal else 300
+            }
+        }
+
+        check_cancelled()
+        start = time.perf_counter()
+        parts = []
+        try:
+            response = requests.post(
+                self.api_url, headers={'Content-Type': 'application/json'}, json=payload, stream=True,
+                timeout=(GEMINI_CONNECT_TIMEOUT, GEMINI_READ_TIMEOUT),
+            )
+            # Closed on every way out, so that an error never leaves the connection open
+            with response:
+                if response.status_code == 429:
+                    # Quota exhausted upstream: pause the scheduler and surface a 429 instead of an answer
+                    retry_after = _parse_retry_after(response)
+                    generation_scheduler.pause(retry_after)
+                    raise SchedulerOverloaded("Gemini quota exceeded, retry later", retry_after, 429)
+                if not response.ok:
+                    print(f"Response content: {response.text}")
+                response.raise_for_status()
+                for line in response.iter_lines():
+                    # Server-sent events; the body is UTF-8 whatever the Content-Type says
+                    if not line.startswith(b"data:"):
+                        continue
+                    if not parts:
+                        record_stage("llm_ttft", time.perf_counter() - start)
+                    parts.append(_candidate_text(json.loads(line[5:])))
+                    if is_cancelled():
+                        # Leaving the block closes the connection, which stops the generation upstream
+                        raise RequestCancelled("".join(parts))
+            record_stage("llm_call", time.perf_counter() - start)
+        except requests.exceptions.HTTPError as http_err:
+            print(f"HTTP error occurred: {http_err}")
+            raise GenerationError(f"Gemini API HTTP error: {http_err}") from http_err
+        except requests.exceptions.RequestException as req_err:
+            raise GenerationError(f"Gemini API request failed: {req_err}") from req_err
+        except ValueError as val_err:
+            raise GenerationError(f"Invalid Gemini API response: {val_err}") from val_err
+
+        answer = "".join(parts)
+        return answer or "Je suis désolé, je n'ai pas pu générer une réponse. Veuillez réessayer."
+
+
+def _candidate_text(chunk: dict) -> str:
+    candidates = chunk.get("candidates") or []
+    if not candidates:
+        return ""
+    return "".join(part["text"] for part in candidates[0].get("content", {}).get("parts", []) if "text" in part)
+
+
+class VLLMBackend(GenerationBackend):
+    """The fine-tuned Qwen model served in-process by vLLM."""
+    name = "vllm"
+
+    def __init__(self, model_path: str = VLLM_MODEL_PATH, max_gpu_memory: float = 0.7):
+        import torch
+        from transformers import AutoTokenizer
+        from vllm import LLM
+
+        print("Loading the Qwen2 model with minimal memory usage...")
+        self.tokenizer = AutoTokenizer.from_pretrained(model_path, trust_remote_code=True)
+        # One engine, one generate call at a time
+        self._lock = threading.Lock()
+
+        # Set environment variables for memory management
+        os.environ['PYTORCH_CUDA_ALLOC_CONF'] = 'expandable_segments:True'
+
+        if torch.cuda.is_available():
+            # Clear CUDA cache first
+            torch.cuda.empty_cache()
+
+            # Get available GPU memory
+            free_memory = torch.cuda.get_device_properties(0).total_memory / (1024**3)  # in GB
+            print(f"GPU has {free_memory:.2f} GB total memory")
+
+            # Extremely conservative settings for 4GB GPU
+            self.llm = LLM(
+                model=model_path,
+                tensor_parallel_size=1,
+                gpu_memory_utilization=0.3,  # Extremely conservative
+                max_model_len=256,          # Minimal context length
+                trust_remote_code=True,
+                swap_space=2,               # More aggressive CPU offloading
+                enforce_eager=True,         # Avoid CUDA graphs
+                dtype="float16"             # 16-bit precision
+            )
+        else:
+            self.llm = LLM(
+                model=model_path,
+                tensor_parallel_size=1,
+                max_model_len=512,
+                trust_remote_code=True,
+                dtype="float16"
+            )
+
+    def generate(self, system_prompt: str, prompt: str, legal: bool = True) -> str:
+        from vllm import SamplingParams
+
+        messages = [
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": prompt}
+        ]
+        text = self.tokenizer.apply_chat_template(messages, tokenize=False)
+        sampling_params = SamplingParams(
+            temperature=0.5 if legal else 0.7,  # Slightly higher for more natural conversation
+            top_p=0.9,
+            repetition_penalty=1.2,
+            top_k=40,
+            max_tokens=768 if legal else 256
+        )
+        start = time.perf_counter()
+        try:
+            with self._lock:
+                # The engine cannot be interrupted, but a call cancelled while waiting is skipped
+                check_cancelled()
+                outputs = self.llm.generate(text, sampling_params=sampling_params)
+        except Exception as e:
+            raise GenerationError(f"vLLM generation failed: {e}") from e
+        record_stage("llm_call", time.perf_counter() - start)
+        return outputs[0].outputs[0].text
+
+
+class StubBackend(GenerationBackend):
+    """Canned answers for local runs and tests; STUB_GENERATION_* simulate latency and failures."""
+    name = "stub"
+
+    def __init__(self, delay: float = STUB_GENERATION_DELAY, error_rate: float = STUB_GENERATION_ERROR_RATE):
+        self.delay = delay
+        self.error_rate = error_rate
+
+    def generate(self, system_prompt: str, prompt: str, legal: bool = True) -> str:
+        if self.delay:
+            # Waits on the cancellation event so that a cancelled call returns early
+            event = current_cancel_event()
+            if event is None:
+                time.sleep(self.delay)
+            elif event.wait(self.delay):
+                raise RequestCancelled("")
+        if random.random() < self.error_rate:
+            raise GenerationError("Simulated stub failure")
+        references = [line.split("] ", 1)[1] for line in prompt.splitlines() if line.startswith("[Document ")]
+        if not references:
+            return "Bonjour ! Je suis votre assistant juridique. Posez-moi une question sur le droit marocain."
+        return "D'après les textes disponibles :\n" + "\n".join(f"- {reference}" for reference in references)
+
+
+class FallbackBackend(GenerationBackend):
+    """
+    A primary backend backed by a secondary one.
+
+    The secondary answers when the primary fails, and (with hedging) also
+    receives a copy of any call the primary has not answered within the
+    configured percentile of its recent latencies; the first answer wins.
+    """
+
+    def __init__(self, primary: GenerationBackend, secondary: GenerationBackend, hedge: bool = GENERATION_HEDGE):
+        self.primary = primary
+        self.secondary = secondary
+        self.hedge = hedge
+        self.name = f"{primary.name}+{secondary.name}"
+        self.rate_limited = primary.rate_limited
+        self._latencies = deque(maxlen=500)
+
+    def hedge_delay(self) -> float:
+        if len(self._latencies) < GENERATION_HEDGE_MIN_SAMPLES:
+            return GENERATION_HEDGE_INITIAL_DELAY
+        ordered = sorted(self._latencies)
+        index = min(len(ordered) - 1, int(GENERATION_HEDGE_PERCENTILE / 100 * len(ordered)))
+        return max(GENERATION_HEDGE_MIN_DELAY, ordered[index])
+
+    def _submit(self, backend: GenerationBackend, *args):
+        # Each call runs in a copy of the caller's context so that its stage timings are recorded
+        context = contextvars.copy_context()
+        return _executor.submit(context.run, backend.generate, *args)
+
+    def _record_latency(self, start: float):
+        def done(future):
+            if not future.exception():
+                self._latencies.append(time.perf_counter() - start)
+        return done
+
+    def _can_hedge(self) -> bool:
+        if not self.hedge or is_cancelled():
+            return False
+        # Hedges to a rate-limited backend only spend tokens that are free right now
+        return not self.secondary.rate_limited or generation_scheduler.bucket.try_acquire() == 0
+
+    def generate(self, system_prompt: str, prompt: str, legal: bool = True) -> str:
+        args = (system_prompt, prompt, legal)
+        primary = self._submit(self.primary, *args)
+        primary.add_done_callback(self._record_latency(time.perf_counter()))
+        backends = {primary: self.primary}
+
+        done, _ = wait([primary], timeout=self.hedge_delay())
+        if not done and self._can_hedge():
+            backends[self._submit(self.secondary, *args)] = self.secondary
+        hedged = len(backends) > 1
+
+        # The first successful answer wins
+        pending, error = set(backends), None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                error = future.exception()
+                if error is None:
+                    if hedged:
+                        HEDGES.inc(winner=backends[future].name)
+                    return future.result()
+                if not isinstance(error, (GenerationError, SchedulerOverloaded)):
+                    raise error
+                ERRORS.inc(backend=backends[future].name)
+                print(f"Generation with {backends[future].name} failed: {error}")
+
+        # Every backend that ran failed; without a hedge the fallback has not been tried yet
+        check_cancelled()
+        if hedged or (isinstance(error, SchedulerOverloaded) and self.secondary.rate_limited):
+            raise error
+        FALLBACKS.inc(primary=self.primary.name)
+        return self.secondary.generate(*args)
+
+
+def create_backend(name: str, **kwargs) -> GenerationBackend:
+    if name == "gemini":
+        return GeminiBackend(**kwargs)
+    if name == "vllm":
+        return VLLMBackend(**kwargs)
+    if name == "stub":
+        return StubBackend(**kwargs)
+    raise ValueError(f"Unknown generation backend: {name}")
+
+
+def with_fallback(primary: GenerationBackend, fallback: str = GENERATION_FALLBACK_BACKEND) -> GenerationBackend:
+    """Wrap a backend with the configured fallback (if any)."""
+    if not fallback:
+        return primary
+    return FallbackBackend(primary, create_backend(fallback))
+
+
+def build_generation_backend() -> GenerationBackend:
+    """The backend configured by GENERATION_BACKEND and GENERATION_FALLBACK_BACKEND."""
+    return with_fallback(create_backend(GENERATION_BACKEND))
+
+
+def _parse_retry_after(response, default: float = 60.0) -> float:
+    """Read the retry delay from a Gemini 429 (Retry-After header or RetryInfo detail)."""
+    header = response.headers.get("Retry-After")
+    if header and header.isdigit():
+        return float(header)
+    try:
+        details = response.json().get("error", {}).get("details", [])
+    except ValueError:
+        return default
+    for detail in details:
+        delay = detail.get("retryDelay")
+        if delay:
+            try:
+                return float(delay.rstrip("s"))
+            except ValueError:
+                pass
+    return default
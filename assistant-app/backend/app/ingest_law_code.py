@@ -0,0 +1,317 @@
+"""
+Ingest a law PDF of the official gazette into the article JSON of
+knowledge_base/law_codes.
+
+Pages are extracted in parallel, one page range per worker process, and
+every finished range is checkpointed next to the output so that a large
+gazette resumes where it stopped. The pages are then split into articles
+(chapitre, section, article_no, text) and streamed to the JSON file.
+
+    python -m app.ingest_law_code loi_43_20_2020.pdf --loi "Loi n° 43-20 ..." --out loi_43_20_2020_full.json
+    python -m app.ingest_law_code --verify                  # every law folder
+    python -m app.ingest_law_code --verify loi_09_08_2009   # one folder
+
+--verify re-ingests the PDFs of knowledge_base/law_codes and checks that
+the articles of the existing JSON files come out with the same number,
+text and headings (whitespace-insensitive). It exits with status 1 when
+fewer than --min-match of them do.
+
+Only the laws (loi_09_08, loi_43_20) are reproduced. The codes are not:
+their footnotes get interleaved with the article text and pypdf splits
+some of their words, and the constitution is a scan without text.
+"""
+import argparse
+import difflib
+import json
+import os
+import re
+import shutil
+import sys
+import tempfile
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Dict, Iterable, Iterator, List, Optional
+
+from app.law_codes import LAW_CODES_DIR, normalize_article_no
+
+PAGES_PER_CHUNK = int(os.getenv("INGEST_PAGES_PER_CHUNK", "20"))
+
+HEADING_LEVELS = ("livre", "titre", "chapitre", "section")
+# Capitalized, so that a sentence wrapped before "chapitre II de la présente loi" stays in its article
+HEADING_PATTERNS = {
+    "livre": re.compile(r"^(?:Livre|LIVRE)\b"),
+    "titre": re.compile(r"^(?:Titre|TITRE)\b"),
+    "chapitre": re.compile(r"^(?:Chapitre|CHAPITRE)\b"),
+    "section": re.compile(r"^(?:Sous-section|SOUS-SECTION|Section|SECTION)\b"),
+}
+ARTICLE_PATTERN = re.compile(
+    r"^(?:Article|ARTICLE)\s+(premier|1er|\d+(?:\s*[-–]\s*\d+)*(?:\s*(?:bis|ter|quater))?)\b\s*[.:\-–]?\s*(.*)$"
+)
+PREAMBLE_PATTERN = re.compile(r"^pr[ée]ambule\s*$", re.IGNORECASE)
+# The gazette's note closing a translated text; what follows is the next text of the issue
+END_PATTERN = re.compile(r"^Le texte en langue arabe a été publié")
+# Page numbers and running footers left by the extraction
+NOISE_PATTERN = re.compile(r"^\s*(\d+|page \d+( sur \d+)?|-\s*\d+\s*-)\s*$", re.IGNORECASE)
+# Running header of the official gazette pages ("536 BULLETIN OFFICIEL Nº 6970 – ...")
+GAZETTE_HEADER_PATTERN = re.compile(r"^(\d+\s+)?BULLETIN OFFICIEL\s+N[º°o]\s*\d+|^N[º°o]\s*\d+\s*[–-].*BULLETIN OFFICIEL(\s+\d+)?$")
+
+# Similarity above which an article's text counts as reproduced
+TEXT_MATCH_RATIO = 0.9
+
+
+def extract_pages(pdf_path: str, start: int, end: int) -> List[str]:
+    """Extract the text of pages [start, end) (runs in a worker process)."""
+    from pypdf import PdfReader
+
+    reader = PdfReader(pdf_path)
+    return [reader.pages[i].extract_text() or "" for i in range(start, end)]
+
+
+def page_count(pdf_path: str) -> int:
+    from pypdf import PdfReader
+
+    return len(PdfReader(pdf_path).pages)
+
+
+def _chunk_path(checkpoint_dir: str, start: int, end: int) -> str:
+    return os.path.join(checkpoint_dir, f"pages_{start:05d}_{end:05d}.json")
+
+
+def _write_atomic(path: str, data):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+
+def extract_document(
+    pdf_path: str, checkpoint_dir: str, workers: Optional[int] = None, chunk_pages: int = PAGES_PER_CHUNK
+) -> List[str]:
+    """Extract every page of a PDF, reusing the page ranges already checkpointed."""
+    os.makedirs(checkpoint_dir, exist_ok=True)
+    total = page_count(pdf_path)
+    ranges = [(start, min(start + chunk_pages, total)) for start in range(0, total, chunk_pages)]
+    pending = [r for r in ranges if not os.path.exists(_chunk_path(checkpoint_dir, *r))]
+    print(f"{os.path.basename(pdf_path)}: {total} pages, {len(ranges) - len(pending)}/{len(ranges)} ranges checkpointed")
+
+    if pending:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = {pool.submit(extract_pages, pdf_path, start, end): (start, end) for start, end in pending}
+            for future in as_completed(futures):
+                start, end = futures[future]
+                _write_atomic(_chunk_path(checkpoint_dir, start, end), future.result())
+                print(f"  extracted pages {start + 1}-{end}")
+
+    pages = []
+    for start, end in ranges:
+        with open(_chunk_path(checkpoint_dir, start, end), encoding="utf-8") as f:
+            pages.extend(json.load(f))
+    return pages
+
+
+def _heading_level(line: str) -> Optional[str]:
+    for level in HEADING_LEVELS:
+        if HEADING_PATTERNS[level].match(line):
+            return level
+    return None
+
+
+def split_articles(pages: Iterable[str], code: str, code_field: str = "code") -> Iterator[Dict]:
+    """
+    Split extracted pages into articles.
+
+    Headings apply to every following article until a heading of the same
+    or a higher level replaces them; a heading's title continues on the
+    lines up to the next article or heading. Line breaks are kept as
+    extracted, like in the hand-made files. The text ends at the gazette's
+    note on the Arabic original.
+    """
+    headings = {level: None for level in HEADING_LEVELS}
+    heading_level = None
+    current = None
+
+    for page in pages:
+        for raw_line in page.splitlines():
+            line = raw_line.strip()
+            if not line or NOISE_PATTERN.match(line) or GAZETTE_HEADER_PATTERN.match(line):
+                continue
+            if END_PATTERN.match(line):
+                if current:
+                    yield _finish(current)
+                return
+
+            level = _heading_level(line)
+            article_match = ARTICLE_PATTERN.match(line)
+            if level == "titre" and code_field == "loi":
+                # Laws only have chapters and sections: a titre takes the chapter's place
+                level = "chapitre"
+            if level:
+                if current:
+                    yield _finish(current)
+                    current = None
+                headings[level] = raw_line
+                # A new heading closes the headings below it
+                for lower in HEADING_LEVELS[HEADING_LEVELS.index(level) + 1:]:
+                    headings[lower] = None
+                heading_level = level
+            elif article_match or PREAMBLE_PATTERN.match(line):
+                if current:
+                    yield _finish(current)
+                if article_match:
+                    number, rest = article_match.groups()
+                    article_no = "Article " + re.sub(r"\s+", " ", number)
+                else:
+                    article_no, rest = line, ""
+                current = {code_field: code}
+                for name in HEADING_LEVELS:
+                    # Laws ("loi") are only divided into chapters and sections
+                    if code_field != "loi" or name in ("chapitre", "section"):
+                        current[name] = headings[name].strip() if headings[name] else None
+                current["article_no"] = article_no
+                current["text"] = rest + "\n" if rest else ""
+                heading_level = None
+            elif heading_level:
+                headings[heading_level] += "\n" + raw_line
+            elif current:
+                current["text"] += raw_line + "\n"
+    if current:
+        yield _finish(current)
+
+
+def _finish(article: Dict) -> Dict:
+    article["text"] = article["text"].strip()
+    return article
+
+
+def write_articles(articles: Iterable[Dict], out_path: str) -> int:
+    """Stream articles to a JSON array (same layout as the hand-made files)."""
+    count = 0
+    tmp_path = f"{out_path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write("[")
+        for article in articles:
+            body = json.dumps(article, ensure_ascii=False, indent=2)
+            f.write(("," if count else "") + "\n  " + body.replace("\n", "\n  "))
+            count += 1
+        f.write("\n]\n" if count else "]\n")
+    os.replace(tmp_path, out_path)
+    return count
+
+
+def _normalize_text(value) -> str:
+    return re.sub(r"\s+", " ", value or "").strip().lower()
+
+
+def compare_articles(expected: List[Dict], produced: List[Dict]) -> Dict:
+    """Match articles by number (in order) and compare their text and headings."""
+    by_number = {}
+    for article in produced:
+        by_number.setdefault(normalize_article_no(article["article_no"]), []).append(article)
+
+    found = text_matches = heading_matches = 0
+    mismatches = []
+    for article in expected:
+        candidates = by_number.get(normalize_article_no(article["article_no"]))
+        if not candidates:
+            mismatches.append(f"missing {article['article_no']}")
+            continue
+        found += 1
+        candidate = candidates.pop(0)
+        ratio = difflib.SequenceMatcher(
+            None, _normalize_text(article["text"]), _normalize_text(candidate["text"]), autojunk=False
+        ).ratio()
+        if ratio >= TEXT_MATCH_RATIO:
+            text_matches += 1
+        else:
+            mismatches.append(f"text of {article['article_no']} differs (similarity {ratio:.2f})")
+        if all(_normalize_text(article.get(level)) == _normalize_text(candidate.get(level))
+               for level in HEADING_LEVELS if level in article):
+            heading_matches += 1
+
+    total = len(expected) or 1
+    return {
+        "expected": len(expected),
+        "produced": len(produced),
+        "found": found / total,
+        "text_match": text_matches / total,
+        "heading_match": heading_matches / total,
+        "mismatches": mismatches,
+    }
+
+
+def _folder_sources(folder_path: str):
+    names = sorted(os.listdir(folder_path))
+    pdfs = [name for name in names if name.lower().endswith(".pdf")]
+    jsons = [name for name in names if name.endswith(".json")]
+    if len(pdfs) == 1 and len(jsons) == 1:
+        return os.path.join(folder_path, pdfs[0]), os.path.join(folder_path, jsons[0])
+    return None
+
+
+def verify(folders: List[str], workers: Optional[int], min_match: float, root: str = LAW_CODES_DIR) -> bool:
+    """Re-ingest each law folder's PDF and compare it with the folder's JSON."""
+    folders = folders or sorted(
+        name for name in os.listdir(root) if os.path.isdir(os.path.join(root, name))
+    )
+    ok = True
+    for folder in folders:
+        sources = _folder_sources(os.path.join(root, folder))
+        if not sources:
+            print(f"{folder}: skipped (needs exactly one PDF and one JSON)")
+            continue
+        pdf_path, json_path = sources
+        with open(json_path, encoding="utf-8") as f:
+            expected = json.load(f)
+        if "loi" not in expected[0]:
+            print(f"{folder}: skipped (only laws are reproduced)")
+            continue
+
+        checkpoint_dir = tempfile.mkdtemp(prefix=f"ingest_{folder}_")
+        try:
+            pages = extract_document(pdf_path, checkpoint_dir, workers)
+        finally:
+            shutil.rmtree(checkpoint_dir, ignore_errors=True)
+        produced = list(split_articles(pages, expected[0]["loi"], "loi"))
+
+        report = compare_articles(expected, produced)
+        passed = report["text_match"] >= min_match
+        ok = ok and passed
+        print(
+            f"{folder}: {'OK' if passed else 'FAIL'} - {report['expected']} expected, {report['produced']} produced, "
+            f"found {report['found']:.1%}, text {report['text_match']:.1%}, headings {report['heading_match']:.1%}"
+        )
+        for mismatch in report["mismatches"][:10]:
+            print(f"    {mismatch}")
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Ingest a law PDF into article JSON")
+    parser.add_argument("sources", nargs="*", help="PDF to ingest, or law folders to check with --verify")
+    parser.add_argument("--loi", help="Name of the law stored in each article")
+    parser.add_argument("--out", help="Output JSON (default: next to the PDF)")
+    parser.add_argument("--checkpoint-dir", help="Where extracted page ranges are kept (default: <out>.pages)")
+    parser.add_argument("--workers", type=int, help="Extraction processes (default: CPU count)")
+    parser.add_argument("--chunk-pages", type=int, default=PAGES_PER_CHUNK, help="Pages per checkpointed range")
+    parser.add_argument("--keep-checkpoints", action="store_true")
+    parser.add_argument("--verify", action="store_true", help="Check the ingestion against the existing JSON files")
+    parser.add_argument("--min-match", type=float, default=0.95, help="Share of articles that must match in --verify")
+    args = parser.parse_args()
+
+    if args.verify:
+        sys.exit(0 if verify(args.sources, args.workers, args.min_match) else 1)
+
+    if len(args.sources) != 1 or not args.loi:
+        parser.error("ingestion needs exactly one PDF and --loi")
+    pdf_path = args.sources[0]
+    out_path = args.out or os.path.splitext(pdf_path)[0] + ".json"
+    checkpoint_dir = args.checkpoint_dir or f"{out_path}.pages"
+
+    pages = extract_document(pdf_path, checkpoint_dir, args.workers, args.chunk_pages)
+    count = write_articles(split_articles(pages, args.loi, "loi"), out_path)
+    print(f"Wrote {count} articles to {out_path}")
+    if not args.keep_checkpoints:
+        shutil.rmtree(checkpoint_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+import json
+import os
+import re
+from typing import Dict, List
+
+# Source JSON files: one folder per code under knowledge_base/law_codes
+LAW_CODES_DIR = os.getenv(
+    "LAW_CODES_DIR",
+    os.path.join(os.path.dirname(__file__), "..", "..", "..", "knowledge_base", "law_codes"),
+)
+
+# Articles shorter than this are headings or extraction noise (same rule as the corpus notebook)
+MIN_ARTICLE_LENGTH = 20
+
+
+def code_files(root: str = LAW_CODES_DIR) -> List[str]:
+    """Return the article JSON files, one per code folder, in a stable order."""
+    paths = []
+    for folder in sorted(os.listdir(root)):
+        folder_path = os.path.join(root, folder)
+        if not os.path.isdir(folder_path):
+            continue
+        for name in sorted(os.listdir(folder_path)):
+            if name.endswith(".json"):
+                paths.append(os.path.join(folder_path, name))
+    return paths
+
+
+def load_law_codes(root: str = LAW_CODES_DIR) -> List[Dict]:
+    """
+    Load every article of every code.
+
+    Each article keeps its original fields (livre, titre, chapitre, section,
+    article_no, text) plus `id` (stable across runs), `folder` and `code`.
+    The two "loi" files name their law in a `loi` field instead of `code`.
+    """
+    articles = []
+    for path in code_files(root):
+        folder = os.path.basename(os.path.dirname(path))
+        with open(path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        for i, article in enumerate(data):
+            text = article.get("text")
+            if not text or len(text.strip()) < MIN_ARTICLE_LENGTH:
+                continue
+            articles.append({
+                **article,
+                "id": f"{folder}_{i}",
+                "folder": folder,
+                "code": article.get("code") or article.get("loi"),
+            })
+    return articles
+
+
+def normalize_article_no(value) -> str:
+    """Normalize an article number: "Article premier" -> "1", "Article 2–1" -> "2-1"."""
+    text = str(value).lower().strip()
+    text = re.sub(r"^(articles?|art\.?)\s*", "", text)
+    text = text.replace("–", "-").replace("—", "-")
+    text = re.sub(r"^(premier|première|1er)\b", "1", text)
+    return re.sub(r"\s+", "", text)
@@ -1,16 +1,33 @@
-from fastapi import FastAPI, Request, Depends, HTTPException
+from fastapi import FastAPI, Request, Depends, HTTPException, Header, Query
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import StreamingResponse
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 from pydantic import BaseModel
-import json
-from bson import ObjectId
-from datetime import datetime
+from typing import List, Optional
+import asyncio
+import logging
+import os
+import time
 
-from .gemini_pipeline import GeminiLegalRAGPipeline, format_article_response
+from . import bulk_jobs, chat_tiering
+from .cancellation import CANCELLED, RequestCancelled
+from .generation import GenerationError, build_generation_backend
+from .rag_pipeline import RAGPipeline, format_article_response
 from .auth.router import router as auth_router
 from .auth.chat_history import router as chat_router
-from .auth.utils import get_current_active_user, users_collection
+from .auth import chat_store
+from .auth.utils import get_current_active_user
 from .auth.models import UserInDB
+from .executors import pipeline_executor
+from .metrics import (
+    REQUEST_SECONDS, current_timings, monitor_event_loop_lag, render_latest,
+    server_timing_header, start_request_timings, timed
+)
+from .profiling import is_admin_request, is_profile_requested, profile_capture
+from .scheduler import INTERACTIVE, SchedulerOverloaded, generation_scheduler
+from .single_flight import QUESTION_COALESCING, question_flights, question_key
+from .stream_store import STREAM_RESUMES, parse_last_event_id, replay_store
+
+logger = logging.getLogger(__name__)
 
 app = FastAPI()
 
@@ -21,6 +38,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "Server-Timing", "X-Stream-Id"],
 )
 
 # Include routers
@@ -31,32 +49,148 @@ class QuestionRequest(BaseModel):
     question: str
     chat_id: str = None
     stream: bool = False
+    # Reuse the session's articles when the question is a follow-up
+    reuse_context: bool = True
+
+class RetrieveRequest(BaseModel):
+    query: str
+    top_k: Optional[int] = None
+    include_text: bool = False
+
+class RetrieveBatchRequest(BaseModel):
+    queries: List[str]
+    top_k: Optional[int] = None
+    include_text: bool = False
+
+class BulkAskRequest(BaseModel):
+    questions: List[str]
+
+# Limits of the /retrieve endpoints
+RETRIEVE_MAX_TOP_K = int(os.getenv("RETRIEVE_MAX_TOP_K", "50"))
+RETRIEVE_MAX_BATCH = int(os.getenv("RETRIEVE_MAX_BATCH", "64"))
+
+# What happens to the answer of a stream abandoned by its client: "drop" it,
+# or save the "partial" text generated so far to the chat history
+CANCELLED_ANSWER_POLICY = os.getenv("CANCELLED_ANSWER_POLICY", "drop")
+
+# Initialize the RAG pipeline once at startup (GENERATION_BACKEND picks the model)
+pipeline = RAGPipeline(build_generation_backend())
+# Chat history stores article ids and resolves them against the pipeline's corpus
+chat_store.set_article_source(pipeline)
+
+# Streamed answers being generated (the event loop only keeps weak references to tasks)
+_stream_producers = set()
+
+_background_tasks = set()
+
+@app.on_event("startup")
+async def create_indexes():
+    await chat_store.ensure_indexes()
+    await bulk_jobs.ensure_indexes()
 
-# Initialize the RAG pipeline once at startup
-pipeline = GeminiLegalRAGPipeline()
+@app.on_event("startup")
+async def start_loop_lag_monitor():
+    task = asyncio.create_task(monitor_event_loop_lag())
+    _background_tasks.add(task)
+
+@app.on_event("startup")
+async def start_bulk_job_resumer():
+    task = asyncio.create_task(bulk_jobs.resume_jobs(pipeline))
+    _background_tasks.add(task)
+
+@app.on_event("startup")
+async def start_chat_tiering():
+    task = asyncio.create_task(chat_tiering.run_tiering())
+    _background_tasks.add(task)
+
+@app.middleware("http")
+async def stage_timing_middleware(request: Request, call_next):
+    """Collect per-stage timings and expose them as a Server-Timing header."""
+    timings = start_request_timings()
+    start = time.perf_counter()
+    response = await call_next(request)
+    route = request.scope.get("route")
+    REQUEST_SECONDS.observe(
+        time.perf_counter() - start,
+        method=request.method,
+        path=route.path if route else "unmatched",
+        status=response.status_code,
+    )
+    # Streaming responses send their headers before the pipeline runs
+    if timings:
+        response.headers["Server-Timing"] = server_timing_header(timings)
+    return response
+
+@app.exception_handler(SchedulerOverloaded)
+async def scheduler_overloaded_handler(request: Request, exc: SchedulerOverloaded):
+    return JSONResponse(
+        status_code=exc.status_code,
+        content={"detail": exc.detail},
+        headers={"Retry-After": str(exc.retry_after)}
+    )
+
+@app.exception_handler(RequestCancelled)
+async def request_cancelled_handler(request: Request, exc: RequestCancelled):
+    # The shared answer this request waited for was abandoned by the others
+    return JSONResponse(
+        status_code=503,
+        content={"detail": "The answer was cancelled, please retry"},
+        headers={"Retry-After": "1"}
+    )
+
+@app.exception_handler(GenerationError)
+async def generation_error_handler(request: Request, exc: GenerationError):
+    return JSONResponse(status_code=502, content={"detail": "The answer could not be generated, please retry"})
 
 @app.post("/ask")
 async def ask_question(
     request: QuestionRequest,
-    current_user: UserInDB = Depends(get_current_active_user)
+    http_request: Request,
+    current_user: UserInDB = Depends(get_current_active_user),
+    last_event_id: Optional[str] = Header(None)
 ):
+    if request.stream and last_event_id:
+        # A client retrying a dropped stream resumes it instead of asking again
+        stream_id, last_seq = parse_last_event_id(last_event_id)
+        stream = replay_store.get(stream_id, current_user.email) if stream_id else None
+        if stream:
+            STREAM_RESUMES.inc(outcome="resumed")
+            return stream_events_response(stream, last_seq)
+        STREAM_RESUMES.inc(outcome="expired")
+
+    if pipeline.backend.rate_limited:
+        # Wait for generation capacity (fails fast with 429/503 when overloaded)
+        await generation_scheduler.acquire(current_user.email, INTERACTIVE)
+
+    previous_doc_ids = None
+    if request.chat_id and request.reuse_context:
+        previous_doc_ids = await get_session_article_ids(current_user, request.chat_id)
+    force_profile = is_profile_requested(http_request.headers)
+
     if request.stream:
-        return StreamingResponse(
-            stream_response(request.question, current_user, request.chat_id),
-            media_type="text/event-stream"
-        )
+        stream = replay_store.create(current_user.email)
+        # Generation runs in its own task so that a client that reconnects finds it still going;
+        # it is cancelled once nobody has followed the stream for a grace period
+        task = asyncio.create_task(produce_stream(
+            stream, request.question, current_user, request.chat_id, previous_doc_ids, force_profile
+        ))
+        _stream_producers.add(task)
+        task.add_done_callback(_stream_producers.discard)
+        return stream_events_response(stream)
     else:
-        response, documents, _ = pipeline.answer_question(request.question, stream=False)
+        flight, joined = join_answer(request.question, previous_doc_ids, force_profile)
+        response, documents, _ = await wait_answer(flight, joined)
         articles = [format_article_response(doc) for doc in documents]
         
         # Handle chat storage
-        chat_id = await save_to_chat_history(
-            current_user,
-            request.question,
-            response,
-            articles,
-            request.chat_id
-        )
+        with timed("mongo_write"):
+            chat_id = await save_to_chat_history(
+                current_user,
+                request.question,
+                response,
+                articles,
+                request.chat_id
+            )
         
         return {
             "answer": response,
@@ -64,28 +198,219 @@ async def ask_question(
             "chat_id": chat_id
         }
 
-async def stream_response(query: str, user: UserInDB, chat_id: str = None):
-    """Stream the response token by token."""
-    response, documents, _ = pipeline.answer_question(query, stream=True)
-    articles = [format_article_response(doc) for doc in documents]
-    
-    # Save to user's chat history
-    chat_id = await save_to_chat_history(user, query, response, articles, chat_id)
-    
-    # First send the articles
-    yield f"data: {json.dumps({'type': 'articles', 'articles': articles, 'chat_id': chat_id})}\n\n"
-    
-    # Then stream the response
-    for char in response:
-        yield f"data: {json.dumps({'type': 'token', 'token': char})}\n\n"
-    
-    # Finally, send the complete response
-    yield f"data: {json.dumps({'type': 'complete', 'response': response, 'chat_id': chat_id})}\n\n"
+@app.post("/ask/batch", status_code=202)
+async def ask_batch(
+    request: BulkAskRequest,
+    current_user: UserInDB = Depends(get_current_active_user)
+):
+    """
+    Queue a bulk job answering every question. Poll GET /ask/batch/{job_id}
+    for its progress; answers are available as they complete.
+    """
+    questions = [question.strip() for question in request.questions]
+    if not 1 <= len(questions) <= bulk_jobs.BULK_MAX_QUESTIONS or not all(questions):
+        raise HTTPException(
+            status_code=400, detail=f"Send between 1 and {bulk_jobs.BULK_MAX_QUESTIONS} non-empty questions"
+        )
+    job = await bulk_jobs.create_job(current_user.email, questions)
+    await bulk_jobs.start_job(pipeline, job["_id"])
+    return {"job_id": job["_id"], "status": job["status"], "total": job["total"]}
+
+@app.get("/ask/batch/{job_id}")
+async def get_batch_job(
+    job_id: str,
+    current_user: UserInDB = Depends(get_current_active_user)
+):
+    """Status and progress of a bulk job."""
+    job = await bulk_jobs.get_job(current_user.email, job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Bulk job not found")
+    return {
+        "job_id": job["_id"],
+        "status": job["status"],
+        "total": job["total"],
+        "completed": job["completed"],
+        "failed": job["failed"],
+        "created_at": job["created_at"],
+        "updated_at": job["updated_at"],
+    }
+
+@app.get("/ask/batch/{job_id}/results")
+async def get_batch_results(
+    job_id: str,
+    after: int = Query(-1, ge=-1),
+    limit: int = Query(100, ge=1, le=500),
+    current_user: UserInDB = Depends(get_current_active_user)
+):
+    """Page through the results of a bulk job in question order (cursor = last seen row)."""
+    if not await bulk_jobs.get_job(current_user.email, job_id):
+        raise HTTPException(status_code=404, detail="Bulk job not found")
+    results, next_cursor = await bulk_jobs.get_results(job_id, after=after, limit=limit)
+    return {"results": results, "next_cursor": next_cursor}
 
-async def save_to_chat_history(user, question, answer, articles, existing_chat_id=None):
+@app.post("/retrieve")
+async def retrieve(
+    request: RetrieveRequest,
+    current_user: UserInDB = Depends(get_current_active_user)
+):
+    """Hybrid retrieval only (no generation, no chat history), with per-branch diagnostics."""
+    result = (await retrieve_batch_results([request.query], request.top_k, request.include_text))[0]
+    return {**result, "timings_ms": timings_ms()}
+
+@app.post("/retrieve/batch")
+async def retrieve_batch(
+    request: RetrieveBatchRequest,
+    current_user: UserInDB = Depends(get_current_active_user)
+):
+    """Retrieval for a batch of queries; each branch runs once for the whole batch."""
+    if not 1 <= len(request.queries) <= RETRIEVE_MAX_BATCH:
+        raise HTTPException(status_code=400, detail=f"Send between 1 and {RETRIEVE_MAX_BATCH} queries")
+    results = await retrieve_batch_results(request.queries, request.top_k, request.include_text)
+    return {"results": results, "timings_ms": timings_ms()}
+
+async def retrieve_batch_results(queries, top_k, include_text):
+    if top_k is not None and not 1 <= top_k <= RETRIEVE_MAX_TOP_K:
+        raise HTTPException(status_code=400, detail=f"top_k must be between 1 and {RETRIEVE_MAX_TOP_K}")
+    batch = await pipeline_executor.run(pipeline.retrieve_documents_batch, queries, top_k)
+    results = []
+    for query, documents in zip(queries, batch):
+        articles = []
+        for rank, doc in enumerate(documents, start=1):
+            article = format_article_response(doc)
+            if not include_text:
+                del article["text"]
+            articles.append({**article, "rank": rank, "score": doc["score"], "branches": doc["branches"]})
+        results.append({"query": query, "articles": articles})
+    return results
+
+def timings_ms():
+    return {stage: round(seconds * 1000, 1) for stage, seconds in current_timings().items()}
+
+def join_answer(query: str, previous_doc_ids=None, force_profile=False):
+    """
+    Start answering the question, or join the identical question already
+    being answered; returns the flight and whether it was joined.
+    """
+    # Profiled requests get a run of their own
+    key = None
+    if QUESTION_COALESCING and not force_profile:
+        key = question_key(query, pipeline.index_version, previous_doc_ids)
+    # The pipeline blocks (retrieval, encoding, generation call), so it runs off the event loop
+    flight, joined = question_flights.join(
+        key, pipeline_executor.run, answer_with_profiling, query, False, previous_doc_ids, force_profile
+    )
+    if joined and pipeline.backend.rate_limited:
+        # Only the request that started the flight spends a generation token
+        generation_scheduler.bucket.refund()
+    return flight, joined
+
+async def wait_answer(flight, joined: bool):
+    if not joined:
+        return await flight.wait()
+    with timed("coalesced_wait"):
+        return await flight.wait()
+
+def answer_with_profiling(query: str, stream: bool, previous_doc_ids=None, force_profile=False):
+    """Run the pipeline, profiling it when the request is sampled or forced."""
+    with profile_capture(force=force_profile) as capture:
+        result = pipeline.answer_question(query, stream=stream, previous_doc_ids=previous_doc_ids)
+    capture.save(
+        query=query,
+        doc_ids=[doc["id"] for doc in result[1]],
+        retrieval=result[2].get("retrieval"),
+        stages=dict(current_timings()),
+    )
+    return result
+
+@app.get("/ask/stream/{stream_id}")
+async def resume_stream(
+    stream_id: str,
+    last_event_id: Optional[str] = Header(None),
+    current_user: UserInDB = Depends(get_current_active_user)
+):
+    """Resume a streamed answer after the last event the client received."""
+    stream = replay_store.get(stream_id, current_user.email)
+    if not stream:
+        STREAM_RESUMES.inc(outcome="expired")
+        raise HTTPException(status_code=404, detail="Stream not found or expired")
+    STREAM_RESUMES.inc(outcome="resumed")
+    return stream_events_response(stream, parse_last_event_id(last_event_id)[1])
+
+def stream_events_response(stream, last_seq: int = -1):
+    return StreamingResponse(
+        stream.follow(last_seq),
+        media_type="text/event-stream",
+        headers={"X-Stream-Id": stream.id}
+    )
+
+async def produce_stream(
+    stream, query: str, user: UserInDB, chat_id: str = None, previous_doc_ids=None, force_profile=False
+):
+    """Generate the answer into the replay stream, token by token."""
+    try:
+        flight, joined = join_answer(query, previous_doc_ids, force_profile)
+        # An abandoned stream withdraws from the flight, which is cancelled once every subscriber left
+        stream.on_abandoned = flight.leave
+        try:
+            response, documents, _ = await wait_answer(flight, joined)
+        except RequestCancelled as cancelled:
+            await handle_cancelled(stream, query, user, chat_id, cancelled, refund=not joined)
+            return
+        except SchedulerOverloaded as exc:
+            # Headers are already sent, so report the overload as an event
+            stream.append({'type': 'error', 'status': exc.status_code, 'detail': exc.detail, 'retry_after': exc.retry_after})
+            return
+        except GenerationError:
+            stream.append({'type': 'error', 'status': 502, 'detail': 'The answer could not be generated, please retry'})
+            return
+        articles = [format_article_response(doc) for doc in documents]
+
+        # Save to user's chat history
+        with timed("mongo_write"):
+            chat_id = await save_to_chat_history(user, query, response, articles, chat_id)
+
+        # First send the articles
+        stream.append({'type': 'articles', 'articles': articles, 'chat_id': chat_id, 'stream_id': stream.id})
+
+        # Then stream the response
+        for char in response:
+            stream.append({'type': 'token', 'token': char})
+
+        # Finally, send the complete response
+        # Stage timings cannot go in a header once streaming has started
+        stream.append({'type': 'complete', 'response': response, 'chat_id': chat_id, 'timings_ms': timings_ms()})
+    except Exception:
+        logger.exception("Error streaming answer")
+        stream.append({'type': 'error', 'status': 500, 'detail': 'Internal error'})
+    finally:
+        # Followers stop waiting once the stream is finished
+        stream.finish()
+
+async def handle_cancelled(
+    stream, query: str, user: UserInDB, chat_id: str, cancelled: RequestCancelled, refund: bool = True
+):
+    """Account for a stream abandoned before its answer was generated, applying CANCELLED_ANSWER_POLICY."""
+    stage = "generation" if cancelled.generation_started else "retrieval"
+    CANCELLED.inc(stage=stage)
+    if not cancelled.generation_started:
+        if refund and pipeline.backend.rate_limited:
+            # No generation call was made, so the rate-limit token goes back to the bucket
+            generation_scheduler.bucket.refund()
+    elif CANCELLED_ANSWER_POLICY == "partial" and cancelled.partial:
+        articles = [format_article_response(doc) for doc in cancelled.documents]
+        with timed("mongo_write"):
+            await save_to_chat_history(user, query, cancelled.partial, articles, chat_id, partial=True)
+    stream.append({'type': 'error', 'status': 499, 'detail': 'Cancelled'})
+
+async def get_session_article_ids(user, chat_id):
+    """Return the IDs of the articles retrieved for the last turn of a chat session."""
+    return await chat_store.get_session_article_ids(user.email, chat_id) or None
+
+async def save_to_chat_history(user, question, answer, articles, existing_chat_id=None, partial=False):
     """
     Save the question and answer to the user's chat history.
     If chat_id is provided, append to that chat, otherwise create a new one.
+    A partial answer (cut short by a cancellation) is flagged as such.
     """
     # Create message objects
     user_message = {
@@ -98,68 +423,36 @@ async def save_to_chat_history(user, question, answer, articles, existing_chat_i
         "content": answer,
         "articles": articles
     }
+    if partial:
+        assistant_message["partial"] = True
     
     if existing_chat_id:
-        # Append messages to existing chat - with async
-        result = await users_collection.update_one(
-            {
-                "email": user.email,
-                "chat_sessions.id": existing_chat_id
-            },
-            {
-                "$push": {
-                    "chat_sessions.$.messages": {
-                        "$each": [user_message, assistant_message]
-                    }
-                },
-                "$set": {
-                    "chat_sessions.$.articles": articles
-                }
-            }
+        appended = await chat_store.append_messages(
+            user.email, existing_chat_id, [user_message, assistant_message], articles
         )
-        
-        if result.modified_count == 0:
-            # Chat not found, create new one
-            return await create_new_chat(user, question, answer, articles)
-        
-        return existing_chat_id
-    else:
-        # Create new chat
-        return await create_new_chat(user, question, answer, articles)
+        if appended:
+            return existing_chat_id
+        # Chat not found, create new one
 
-async def create_new_chat(user, question, answer, articles):
-    """Create a new chat session"""
-    chat_id = str(ObjectId())
-    
-    # Create title from first message (truncate if needed)
-    title = question[:30] + "..." if len(question) > 30 else question
-    
-    chat_session = {
-        "id": chat_id,
-        "title": title,
-        "date": datetime.utcnow(),
-        "messages": [
-            {
-                "role": "user",
-                "content": question
-            },
-            {
-                "role": "assistant", 
-                "content": answer,
-                "articles": articles
-            }
-        ],
-        "articles": articles
-    }
-    
-    # Use proper async
-    await users_collection.update_one(
-        {"email": user.email},
-        {"$push": {"chat_sessions": chat_session}}
+    return await chat_store.create_session(
+        user.email,
+        chat_store.make_title(question),
+        [user_message, assistant_message],
+        articles
     )
-    
-    return chat_id
 
 @app.get("/health")
 async def health_check():
-    return {"status": "ok", "message": "JuriDOC API is running"}
\ No newline at end of file
+    return {"status": "ok", "message": "JuriDOC API is running"}
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    """Expose process metrics in the Prometheus text format."""
+    return PlainTextResponse(render_latest(), media_type="text/plain; version=0.0.4")
+
+@app.get("/scheduler/stats")
+async def scheduler_stats(request: Request):
+    """Queue state of the generation scheduler (admin token in X-Admin-Token)."""
+    if not is_admin_request(request.headers):
+        raise HTTPException(status_code=403, detail="Admin token required")
+    return generation_scheduler.stats()
\ No newline at end of file
@@ -0,0 +1,75 @@
+"""
+Move chat sessions embedded in user documents (`users.chat_sessions`) into
+the `chat_sessions` and `chat_messages` collections.
+
+The migration is idempotent: sessions are upserted by id and their messages
+rewritten, and the embedded array is only removed once a user's sessions
+have all been copied. Run from the backend directory:
+
+    python -m app.migrate_chat_sessions [--dry-run]
+"""
+import argparse
+from datetime import datetime
+
+from pymongo import ReplaceOne
+
+from .db_init import db, init_db
+
+
+def migrate_user(user: dict, dry_run: bool = False) -> int:
+    """Copy one user's embedded sessions; returns the number of sessions migrated."""
+    sessions = user.get("chat_sessions") or []
+    for session in sessions:
+        session_id = session["id"]
+        messages = session.get("messages") or []
+        date = session.get("date") or datetime.utcnow()
+        if dry_run:
+            continue
+
+        db.chat_sessions.replace_one(
+            {"_id": session_id},
+            {
+                "_id": session_id,
+                "user": user["email"],
+                "title": session.get("title", ""),
+                "date": date,
+                "updated_at": date,
+                "seq": len(messages),
+                "articles": session.get("articles") or [],
+            },
+            upsert=True,
+        )
+        if messages:
+            db.chat_messages.bulk_write([
+                ReplaceOne(
+                    {"session_id": session_id, "seq": seq},
+                    {"session_id": session_id, "seq": seq, "date": date, **message},
+                    upsert=True,
+                )
+                for seq, message in enumerate(messages, start=1)
+            ])
+
+    if not dry_run:
+        db.users.update_one({"_id": user["_id"]}, {"$unset": {"chat_sessions": ""}})
+    return len(sessions)
+
+
+def migrate(dry_run: bool = False):
+    init_db()
+    users = db.users.find(
+        {"chat_sessions.0": {"$exists": True}},
+        {"email": 1, "chat_sessions": 1},
+    )
+    migrated_users = migrated_sessions = 0
+    for user in users:
+        migrated_sessions += migrate_user(user, dry_run=dry_run)
+        migrated_users += 1
+    action = "Would migrate" if dry_run else "Migrated"
+    print(f"{action} {migrated_sessions} chat sessions from {migrated_users} users")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--dry-run", action="store_true", help="Only count the sessions to migrate")
+    args = parser.parse_args()
+    migrate(dry_run=args.dry_run)
@@ -0,0 +1,179 @@
+import hmac
+import json
+import os
+import random
+import sys
+import threading
+import time
+import tracemalloc
+import uuid
+from collections import Counter
+from contextlib import contextmanager
+
+# Opt-in request profiling. A request is sampled when it carries the admin
+# header or, at PROFILE_SAMPLE_RATE, at random; a sampled request is only
+# kept if it was forced or ended up slower than PROFILE_LATENCY_THRESHOLD.
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+PROFILE_LATENCY_THRESHOLD = float(os.getenv("PROFILE_LATENCY_THRESHOLD", "5"))
+PROFILE_ADMIN_TOKEN = os.getenv("PROFILE_ADMIN_TOKEN")
+PROFILE_HEADER = "X-Profile"
+# Operational endpoints (scheduler state) take the same token in this header
+ADMIN_HEADER = "X-Admin-Token"
+PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+PROFILE_RING_SIZE = int(os.getenv("PROFILE_RING_SIZE", "50"))
+PROFILE_INTERVAL = float(os.getenv("PROFILE_INTERVAL", "0.005"))
+PROFILE_TOP_N = 25
+
+_tracemalloc_lock = threading.Lock()
+_tracemalloc_users = 0
+
+
+def _is_admin_token(value) -> bool:
+    return bool(PROFILE_ADMIN_TOKEN) and hmac.compare_digest((value or "").encode(), PROFILE_ADMIN_TOKEN.encode())
+
+
+def is_profile_requested(headers) -> bool:
+    """True when the request carries the admin profiling header."""
+    return _is_admin_token(headers.get(PROFILE_HEADER))
+
+
+def is_admin_request(headers) -> bool:
+    """True when the request carries the admin token (unset token: nobody is admin)."""
+    return _is_admin_token(headers.get(ADMIN_HEADER))
+
+
+class SamplingProfiler(threading.Thread):
+    """Statistical profiler sampling the stack of one thread at a fixed interval."""
+
+    def __init__(self, thread_id: int, interval: float = PROFILE_INTERVAL):
+        super().__init__(name="request-profiler", daemon=True)
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self.samples = 0
+        self._done = threading.Event()
+
+    def run(self):
+        while not self._done.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                frame = frame.f_back
+            if stack:
+                self.stacks[";".join(reversed(stack))] += 1
+                self.samples += 1
+
+    def finish(self):
+        self._done.set()
+        self.join()
+
+    def top_functions(self, n: int = PROFILE_TOP_N):
+        """Functions on top of the stack (self time) by number of samples."""
+        leaves = Counter()
+        for stack, count in self.stacks.items():
+            leaves[stack.rsplit(";", 1)[-1]] += count
+        return [{"function": name, "samples": count} for name, count in leaves.most_common(n)]
+
+
+def _start_tracemalloc():
+    global _tracemalloc_users
+    with _tracemalloc_lock:
+        if _tracemalloc_users == 0 and not tracemalloc.is_tracing():
+            tracemalloc.start(10)
+        _tracemalloc_users += 1
+
+
+def _stop_tracemalloc():
+    global _tracemalloc_users
+    with _tracemalloc_lock:
+        _tracemalloc_users -= 1
+        if _tracemalloc_users == 0:
+            tracemalloc.stop()
+
+
+class ProfileCapture:
+    """Holds the profiler state of one request between start and save."""
+
+    def __init__(self, active: bool, forced: bool):
+        self.active = active
+        self.forced = forced
+        self.elapsed = 0.0
+        self.profiler = None
+        self.top_allocations = []
+        self._start_snapshot = None
+
+    def start(self):
+        _start_tracemalloc()
+        self._start_snapshot = tracemalloc.take_snapshot()
+        self.profiler = SamplingProfiler(threading.get_ident())
+        self.profiler.start()
+
+    def stop(self):
+        self.profiler.finish()
+        snapshot = tracemalloc.take_snapshot()
+        _stop_tracemalloc()
+        stats = snapshot.compare_to(self._start_snapshot, "lineno")
+        self.top_allocations = [
+            {"location": str(stat.traceback[0]), "size_diff_kb": stat.size_diff / 1024, "count_diff": stat.count_diff}
+            for stat in stats[:PROFILE_TOP_N]
+        ]
+        self._start_snapshot = None
+
+    def save(self, **details):
+        """Write the profile to the on-disk ring if the request qualifies."""
+        if not self.active or self.profiler is None:
+            return None
+        if not self.forced and self.elapsed < PROFILE_LATENCY_THRESHOLD:
+            return None
+
+        profile = {
+            "timestamp": time.time(),
+            "elapsed_seconds": self.elapsed,
+            "forced": self.forced,
+            **details,
+            "samples": self.profiler.samples,
+            "interval_seconds": self.profiler.interval,
+            "top_functions": self.profiler.top_functions(),
+            "top_allocations": self.top_allocations,
+            # Folded stacks, ready for flamegraph tools
+            "stacks": dict(self.profiler.stacks.most_common()),
+        }
+        return write_profile(profile)
+
+
+def write_profile(profile: dict) -> str:
+    """Store a profile, dropping the oldest ones beyond PROFILE_RING_SIZE."""
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    path = os.path.join(PROFILE_DIR, f"{time.time_ns()}_{uuid.uuid4().hex[:8]}.json")
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(profile, f, ensure_ascii=False, default=str)
+
+    profiles = sorted(name for name in os.listdir(PROFILE_DIR) if name.endswith(".json"))
+    for name in profiles[:-PROFILE_RING_SIZE]:
+        try:
+            os.remove(os.path.join(PROFILE_DIR, name))
+        except FileNotFoundError:
+            pass
+    return path
+
+
+@contextmanager
+def profile_capture(force: bool = False):
+    """
+    Profile the enclosed block in the current thread if the request is sampled.
+
+    Unsampled requests only pay for one random() call.
+    """
+    active = force or (PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE)
+    capture = ProfileCapture(active, force)
+    start = time.perf_counter()
+    if active:
+        capture.start()
+    try:
+        yield capture
+    finally:
+        capture.elapsed = time.perf_counter() - start
+        if active:
+            capture.stop()
@@ -0,0 +1,426 @@
+import os
+import json
+import hashlib
+from typing import List, Dict, Optional, Tuple
+from .cancellation import RequestCancelled, check_cancelled
+from .article_refs import ArticleIndex, parse_references
+from .generation import GenerationBackend
+from .retrievers import BM25PlusRetriever, DenseRetriever, ReciprocalRankFusionRetriever
+from .metrics import timed
+
+# Follow-up detection for conversation-aware retrieval: phrases that can only
+# refer to the previous answer. Any other question (including "pourquoi ...",
+# "et ...") is a follow-up only if BM25 ranks one of the previous articles
+# within its first FOLLOWUP_SPARSE_DEPTH results.
+FOLLOWUP_ANAPHORA = [
+    "cet article", "ces articles", "cette disposition", "ces dispositions", "ce texte",
+    "ce délai", "cette règle", "ce cas", "ci-dessus", "précédemment",
+    "vous avez dit", "vous avez mentionné",
+]
+FOLLOWUP_SPARSE_DEPTH = int(os.getenv("FOLLOWUP_SPARSE_DEPTH", "10"))
+FOLLOWUP_REFRESH_K = int(os.getenv("FOLLOWUP_REFRESH_K", "1"))
+
+# Shards built by app.sharded_retrieval; empty to use the monolithic indexes
+RETRIEVAL_SHARDS_DIR = os.getenv("RETRIEVAL_SHARDS_DIR", "")
+RETRIEVAL_SHARD_WORKERS = int(os.getenv("RETRIEVAL_SHARD_WORKERS", "0")) or None
+# Worker processes scoring the monolithic BM25 index; 0 scores it in the calling thread
+BM25_PROCESSES = int(os.getenv("BM25_PROCESSES", "0"))
+
+
+class RAGPipeline:
+    """Retrieval, prompting and answer formatting shared by every generation backend."""
+
+    def __init__(
+        self,
+        backend: GenerationBackend,
+        sparse_model_path: str = "../../knowledge_base/vector_store/sparse/bm25_plus.pkl",
+        dense_model_path: str = "../../knowledge_base/vector_store/dense/legal_dense_index",
+        hybrid_config_path: str = "../../hybrid-retrieval/hybrid_config.json",
+        corpus_lookup_path: str = "../../knowledge_base/vector_store/corpus_lookup.pkl",
+        top_k: int = 3
+    ):
+        self.top_k = top_k
+        self._positions = None
+        self.backend = backend
+
+        print(f"Initializing Legal RAG Pipeline ({backend.name} generation)...")
+        self._load_corpus(corpus_lookup_path)
+        self.article_index = ArticleIndex.from_corpus(self.corpus_data)
+        print(f"Indexed {len(self.article_index)} article references")
+        self._load_retrieval_models(sparse_model_path, dense_model_path, hybrid_config_path)
+        print("Legal RAG Pipeline initialized successfully!")
+
+    def _load_corpus(self, corpus_lookup_path):
+        import pickle
+        with open(corpus_lookup_path, 'rb') as f:
+            data = f.read()
+        self.corpus_data = pickle.loads(data)
+        # Chat history stores article ids; the version tells which corpus they refer to
+        self.index_version = corpus_version(data)
+        print(f"Loaded corpus with {len(self.corpus_data['doc_ids'])} documents (version {self.index_version})")
+
+    def _load_retrieval_models(self, sparse_model_path, dense_model_path, hybrid_config_path):
+        if RETRIEVAL_SHARDS_DIR:
+            self._load_sharded_models(dense_model_path)
+        else:
+            print("Loading BM25+ retriever...")
+            if BM25_PROCESSES:
+                from .bm25_process import ProcessPoolBM25Retriever
+                self.sparse_model = ProcessPoolBM25Retriever(sparse_model_path, BM25_PROCESSES)
+            else:
+                self.sparse_model = BM25PlusRetriever.load(sparse_model_path)
+            print("Loading dense retriever...")
+            self.dense_model = DenseRetriever.load(dense_model_path)
+        with open(hybrid_config_path, 'r') as f:
+            hybrid_config = json.load(f)
+        self.hybrid_retriever = ReciprocalRankFusionRetriever(
+            self.sparse_model, self.dense_model
+        )
+
+    def _load_sharded_models(self, dense_model_path):
+        from .sharded_retrieval import ShardPool, ShardedBM25Retriever, ShardedDenseRetriever
+
+        print(f"Loading retrieval shards from {RETRIEVAL_SHARDS_DIR}...")
+        self.shard_pool = ShardPool(RETRIEVAL_SHARDS_DIR, RETRIEVAL_SHARD_WORKERS)
+        self.sparse_model = ShardedBM25Retriever(self.shard_pool)
+        if all(shard["dense"] for shard in self.shard_pool.manifest["shards"]):
+            self.dense_model = ShardedDenseRetriever(self.shard_pool)
+        else:
+            print("Shards have no dense vectors, loading the monolithic dense retriever...")
+            self.dense_model = DenseRetriever.load(dense_model_path)
+
+    def _create_legal_system_prompt(self):
+        return ("""Tu es LegalBot, un conseiller juridique marocain expérimenté (comme un avocat ou un juge).
+                Ton rôle est de répondre à des questions juridiques en te basant uniquement sur le **contexte légal disponible dans ma base de données**. Ne fais **aucune hypothèse** et ne t'appuie jamais sur ta propre connaissance.
+
+                Ta réponse doit respecter les consignes suivantes :
+
+                1. ✅ Utilise **uniquement** les articles de loi du contexte disponible.
+                2. 📜 Si un article est cité, mentionne son **numéro** et le **code de loi** d'où il vient (ex. *Article 32 du Code de la Famille*).
+                3. ❓ Si le contexte disponible ne contient pas assez d'informations pour répondre précisément, réponds avec l'une de ces phrases professionnelles :
+                - "D'après les textes de loi disponibles dans ma base de données, je ne trouve pas suffisamment d'informations pour répondre complètement à votre question."
+                - "Les dispositions légales actuellement disponibles ne me permettent pas de vous donner une réponse précise sur ce point."
+                - "Cette question nécessite une consultation des textes de loi qui ne sont pas disponibles dans ma base de données actuelle."
+                - "Je vous recommande de consulter un avocat pour obtenir des informations complètes sur ce sujet, car les textes disponibles ne couvrent pas suffisamment cette question."
+                4. 🗣️ Parle comme un avocat marocain : professionnel, clair, humain et direct. Pas de langage robotique ou compliqué.
+                5. 📌 Sois **bref, utile et facile à comprendre** pour une personne non juriste.
+                6. 🔢 Si la réponse est complexe, utilise une **liste numérotée**.
+                7. 🚫 Ne dis JAMAIS "les articles que vous m'avez fournis" ou "les documents que vous avez fournis" - c'est MOI qui récupère automatiquement les textes pertinents.
+                
+                IMPORTANT : Répondez uniquement en utilisant les textes de loi disponibles dans le contexte ci-dessous. 
+                Si aucune réponse claire ne peut être déduite des dispositions disponibles, utilisez les phrases professionnelles suggérées ci-dessus.
+                """)
+
+
+    def _needs_legal_context(self, query: str) -> bool:
+        """Determine if the query requires legal context."""
+        # List of common non-legal queries
+        non_legal_phrases = [
+            "bonjour", "hello", "salut", "hi", "hey",
+            "comment ça va", "how are you",
+            "merci", "thank you", "thanks",
+            "au revoir", "goodbye", "bye",
+            "aide", "help", "aider",
+            "que peux-tu faire", "what can you do",
+            "qui es-tu", "who are you"
+        ]
+        
+        # Check if query is a simple greeting or non-legal question
+        query_lower = query.lower().strip()
+        if any(phrase in query_lower for phrase in non_legal_phrases):
+            return False
+            
+        # Check if query contains legal-related keywords
+        legal_keywords = [
+            # General legal domains
+            "droit", "loi", "juridique", "légal", "illégal",
+            "code", "article", "texte de loi", "disposition", "texte législatif",
+            # Family Law (Code de la Famille)
+            "mariage", "divorce", "garde", "enfant", "pension", "naissance", "filiation",
+            "adoption", "kafala", "polygamie", "mahr", "idda", "talaq", "khula",
+            # Criminal Law
+            "crime", "délit", "infraction", "sanction", "peine", "tribunal", "plainte", "détention",
+            "amende", "prison", "viol", "vol", "agression", "condamnation", "punition",
+            # Civil/Commercial
+            "contrat", "bail", "location", "propriété", "succession", "héritage", "cession",
+            "entreprise", "commerce", "registre", "immatriculation", "dépôt",
+            # Labor
+            "travail", "licenciement", "salaire", "congé", "indemnité", "employeur", "employé",
+            # Procedure / litigation
+            "procédure", "recours", "appel", "jugement", "audience", "justice",
+            "avocat", "juridiction", "ministère public",
+            # Arabic romanized (frequent Moroccan queries)
+            "moudawana", "talak", "mouda", "kafala", "zawaj", "maher", "mirath", "faskh", "mahkama",
+            "zakat", "nikah", "iddah", "shahada"
+        ]
+        
+        return any(keyword in query_lower for keyword in legal_keywords)
+
+    def _format_response(self, response: str) -> str:
+        """Format the response to improve readability."""
+        # Remove any prefixes
+        response = response.replace("assistant:", "").replace("assistant :", "").strip()
+        response = response.replace("Answer:", "").replace("Réponse:", "").strip()
+        
+        # Format lists
+        lines = response.split('\n')
+        formatted_lines = []
+        in_list = False
+        
+        for line in lines:
+            line = line.strip()
+            if not line:
+                formatted_lines.append('')
+                continue
+                
+            # Detect list items
+            if line.startswith(('- ', '• ', '* ')):
+                if not in_list:
+                    formatted_lines.append('')  # Add space before list
+                formatted_lines.append(line)
+                in_list = True
+            elif line[0].isdigit() and '. ' in line[:5]:
+                if not in_list:
+                    formatted_lines.append('')  # Add space before list
+                formatted_lines.append(line)
+                in_list = True
+            else:
+                if in_list:
+                    formatted_lines.append('')  # Add space after list
+                formatted_lines.append(line)
+                in_list = False
+        
+        return '\n'.join(formatted_lines)
+
+    def _create_general_system_prompt(self):
+        return ("Vous êtes LegalAssistant, un conseiller juridique professionnel spécialisé en droit marocain. "
+                "Répondez de manière professionnelle et concise.")
+
+    def answer_question(
+        self, query: str, stream: bool = False, previous_doc_ids: List[str] = None
+    ) -> Tuple[str, List[Dict], dict]:
+        check_cancelled()
+        # Questions that cite articles ("article 147 du Code du Travail") fetch them directly
+        documents = self.retrieve_referenced_documents(query)
+        retrieval_mode = "exact" if documents is not None else None
+        # In a conversation, a follow-up about the same articles reuses them
+        if documents is None and previous_doc_ids:
+            documents = self.retrieve_followup_documents(query, previous_doc_ids)
+            retrieval_mode = "followup" if documents is not None else None
+
+        with timed("query_analysis"):
+            needs_context = documents is not None or self._needs_legal_context(query)
+
+        if needs_context and documents is None:
+            retrieval_mode = "hybrid"
+            documents = self.retrieve_documents(query)
+        return self.answer_with_context(query, documents if needs_context else None, retrieval_mode)
+
+    def answer_with_context(
+        self, query: str, documents: Optional[List[Dict]], retrieval_mode: str = None
+    ) -> Tuple[str, List[Dict], dict]:
+        """Generate the answer from retrieved documents (None: a general, non-legal question)."""
+        # A client gone during retrieval costs no generation call
+        check_cancelled()
+        if documents is None:
+            # Handle non-legal queries directly
+            response = self._generate(self._create_general_system_prompt(), query, [], legal=False)
+            return self._format_response(response), [], {"retrieval": "none"}
+
+        # Handle legal queries with context
+        with timed("prompt_build"):
+            context = self.format_context(documents)
+            system_prompt = self._create_legal_system_prompt()
+
+            prompt = (
+                f"# Question: {query}\n\n"
+                f"# Contexte juridique pertinent:\n{context}\n\n"
+                "IMPORTANT: Répondez UNIQUEMENT en utilisant le contexte juridique fourni ci-dessus. "
+                "N'utilisez aucune autre connaissance. Si le contexte ne contient pas d'informations pertinentes, "
+                "indiquez que vous n'avez pas assez d'informations pour répondre complètement."
+            )
+
+        response = self._generate(system_prompt, prompt, documents, legal=True)
+        return self._format_response(response), documents, {"retrieval": retrieval_mode}
+
+    def retrieve_contexts_batch(self, queries: List[str]) -> List[Tuple[Optional[List[Dict]], str]]:
+        """
+        The documents and retrieval mode of each question, for
+        answer_with_context. Questions citing articles fetch them directly;
+        the other legal questions share one hybrid retrieval for the batch.
+        """
+        contexts, pending = [], []
+        for i, query in enumerate(queries):
+            documents = self.retrieve_referenced_documents(query)
+            if documents is not None:
+                contexts.append((documents, "exact"))
+                continue
+            with timed("query_analysis"):
+                needs_context = self._needs_legal_context(query)
+            contexts.append((None, "none"))
+            if needs_context:
+                pending.append(i)
+
+        if pending:
+            batch = self.hybrid_retriever.retrieve_batch([queries[i] for i in pending], top_k=self.top_k)
+            with timed("document_lookup"):
+                for i, results in zip(pending, batch):
+                    contexts[i] = ([self._lookup_document(doc_id, score) for doc_id, score in results], "hybrid")
+        return contexts
+
+    def _generate(self, system_prompt: str, prompt: str, documents: List[Dict], legal: bool) -> str:
+        try:
+            return self.backend.generate(system_prompt, prompt, legal=legal)
+        except RequestCancelled as cancelled:
+            # The caller may keep the partial answer with the articles it was based on
+            cancelled.generation_started = True
+            cancelled.partial = self._format_response(cancelled.partial or "")
+            cancelled.documents = documents
+            raise
+
+    def retrieve_documents(self, query: str) -> List[Dict]:
+        results = self.hybrid_retriever.retrieve(query, top_k=self.top_k)
+        with timed("document_lookup"):
+            return [self._lookup_document(doc_id, score) for doc_id, score in results]
+
+    def retrieve_documents_batch(self, queries: List[str], top_k: int = None) -> List[List[Dict]]:
+        """
+        Hybrid retrieval of several queries, with each branch's view of the
+        results.
+
+        Each branch runs once for the whole batch. Every document carries a
+        `branches` entry giving its 1-based rank and raw score in the BM25
+        and dense rankings (None when the branch did not return it).
+        """
+        top_k = top_k or self.top_k
+        depth = self.hybrid_retriever.depth
+        sparse_batch = self.sparse_model.retrieve_batch(queries, top_k=depth)
+        dense_batch = self.dense_model.retrieve_batch(queries, top_k=depth)
+
+        batch = []
+        for sparse_results, dense_results in zip(sparse_batch, dense_batch):
+            fused = self.hybrid_retriever.fuse(sparse_results, dense_results, top_k)
+            branches = {"bm25": _branch_ranks(sparse_results), "dense": _branch_ranks(dense_results)}
+            with timed("document_lookup"):
+                documents = [self._lookup_document(doc_id, score) for doc_id, score in fused]
+            for document in documents:
+                document["branches"] = {name: ranks.get(document["id"]) for name, ranks in branches.items()}
+            batch.append(documents)
+        return batch
+
+    def retrieve_referenced_documents(self, query: str):
+        """
+        Fetch the articles a question cites explicitly.
+
+        Returns None when it cites none that the index knows, in which case
+        the caller runs the usual retrieval. When fewer than top_k articles
+        are cited, the remaining slots come from BM25 alone; the dense
+        encoder is skipped either way.
+        """
+        with timed("reference_lookup"):
+            doc_ids = self.article_index.lookup(parse_references(query))
+        if not doc_ids:
+            return None
+        documents = [self._lookup_document(doc_id, None) for doc_id in doc_ids]
+        missing = self.top_k - len(documents)
+        if missing > 0:
+            sparse_results = self.sparse_model.retrieve(query, top_k=self.top_k + len(doc_ids))
+            fill = [(doc_id, score) for doc_id, score in sparse_results if doc_id not in doc_ids]
+            documents.extend(self._lookup_document(doc_id, score) for doc_id, score in fill[:missing])
+        return documents
+
+    def _is_followup(self, query: str, previous_doc_ids: List[str], sparse_ids: List[str]) -> bool:
+        """Decide whether a question continues the discussion of the previous articles."""
+        query_lower = query.lower().strip()
+        if any(marker in query_lower for marker in FOLLOWUP_ANAPHORA):
+            return True
+        # Otherwise require the cheap sparse ranking to agree with the cached articles
+        return any(doc_id in previous_doc_ids for doc_id in sparse_ids[:FOLLOWUP_SPARSE_DEPTH])
+
+    def retrieve_followup_documents(self, query: str, previous_doc_ids: List[str]):
+        """
+        Reuse the articles of the previous turn for a follow-up question.
+
+        Returns None when the question is not a follow-up, in which case the
+        caller runs the full hybrid retrieval. Only BM25 is evaluated here; its
+        best new hits are merged after the cached articles.
+        """
+        known_ids = [doc_id for doc_id in previous_doc_ids if doc_id in self._doc_positions]
+        if not known_ids:
+            return None
+        sparse_results = self.sparse_model.retrieve(query, top_k=FOLLOWUP_SPARSE_DEPTH)
+        sparse_ids = [doc_id for doc_id, _ in sparse_results]
+        if not self._is_followup(query, known_ids, sparse_ids):
+            return None
+
+        documents = [self._lookup_document(doc_id, None) for doc_id in known_ids]
+        refresh = [(doc_id, score) for doc_id, score in sparse_results if doc_id not in known_ids]
+        documents.extend(self._lookup_document(doc_id, score) for doc_id, score in refresh[:FOLLOWUP_REFRESH_K])
+        return documents
+
+    @property
+    def _doc_positions(self) -> Dict[str, int]:
+        if self._positions is None:
+            self._positions = {doc_id: i for i, doc_id in enumerate(self.corpus_data['doc_ids'])}
+        return self._positions
+
+    def _lookup_document(self, doc_id: str, score) -> Dict:
+        document_text = self.corpus_data['corpus_lookup'].get(doc_id, "")
+        doc_idx = self._doc_positions.get(doc_id, -1)
+        if doc_idx >= 0 and doc_idx < len(self.corpus_data['documents']):
+            metadata = self.corpus_data['documents'][doc_idx].metadata
+        else:
+            metadata = {'id': doc_id}
+        return {
+            'id': doc_id,
+            'text': document_text,
+            'score': score,
+            'metadata': metadata
+        }
+
+    def get_articles(self, doc_ids: List[str]) -> Dict[str, Dict]:
+        """Articles (as returned by the API) of the ids the corpus knows, keyed by id."""
+        return {
+            doc_id: format_article_response(self._lookup_document(doc_id, None))
+            for doc_id in dict.fromkeys(doc_ids) if doc_id in self._doc_positions
+        }
+
+    def format_context(self, documents: List[Dict]) -> str:
+        context_parts = []
+        for i, doc in enumerate(documents):
+            article_ref = self._format_article_reference(doc['metadata'])
+            context_parts.append(f"[Document {i+1}] {article_ref}\n{doc['text']}")
+        return "\n\n" + "\n\n".join(context_parts)
+
+    def _format_article_reference(self, metadata: Dict) -> str:
+        parts = []
+        if 'code_display' in metadata:
+            parts.append(metadata['code_display'])
+        elif 'code' in metadata:
+            parts.append(metadata['code'].replace('_', ' ').title())
+        if 'article_number' in metadata:
+            parts.append(f"Article {metadata['article_number']}")
+        elif 'article_id' in metadata:
+            parts.append(f"Article {metadata['article_id']}")
+        elif 'reference' in metadata:
+            parts.append(metadata['reference'])
+        return " - ".join(parts) if parts else "Unknown Reference"
+
+def _branch_ranks(results) -> Dict[str, Dict]:
+    return {doc_id: {"rank": rank, "score": float(score)} for rank, (doc_id, score) in enumerate(results, start=1)}
+
+
+def corpus_version(data: bytes) -> str:
+    """Short content hash identifying a corpus_lookup pickle."""
+    return hashlib.sha1(data).hexdigest()[:12]
+
+
+# Helper function to format article responses for the frontend
+def format_article_response(doc: Dict) -> Dict:
+    meta = doc['metadata']
+    return {
+        "id": doc["id"],
+        "article_number": meta.get("article_number") or meta.get("article_id") or meta.get("reference"),
+        "code": meta.get("code_display") or (meta.get("code").replace('_', ' ').title() if meta.get("code") else None),
+        "text": doc["text"]
+    }
\ No newline at end of file
@@ -2,35 +2,49 @@ import pickle
 import os
 from tqdm import tqdm
 import numpy as np
+import threading
 import time
-import torch
 
 # For sparse retrieval
-import nltk
-from nltk.tokenize import word_tokenize
-from nltk.corpus import stopwords
 from rank_bm25 import BM25Plus
 
 # For dense retrieval
-from llama_index.core import VectorStoreIndex, SimpleDirectoryReader, Document
-from llama_index.core import Settings
+from llama_index.core import VectorStoreIndex, SimpleDirectoryReader, Document, MockEmbedding
 from llama_index.embeddings.huggingface import HuggingFaceEmbedding
 from llama_index.core.vector_stores import SimpleVectorStore
+from llama_index.core.schema import QueryBundle
 
+from .embedding_service import load_query_encoder
+from .metrics import timed
+from .text_processing import preprocess_text
 
-def preprocess_text(text, language='french'):
-    """Preprocess text for sparse retrieval"""
-    # Lowercase
-    text = text.lower()
 
-    # Tokenize
-    tokens = word_tokenize(text, language=language)
+def embed_queries(embed_model, queries):
+    """Query embeddings of several queries in one forward pass (batched get_query_embedding)."""
+    # llama-index has no public batched *query* embedding: get_text_embedding_batch
+    # would apply the passage prompt instead of the query one. HuggingFaceEmbedding's
+    # _embed takes the prompt name, and requirements.txt pins the versions it has
+    # this signature in; other embedding models fall back to one query at a time.
+    if not isinstance(embed_model, HuggingFaceEmbedding):
+        return [embed_model.get_query_embedding(query) for query in queries]
+    return embed_model._embed(list(queries), prompt_name="query")
 
-    # Remove stopwords and punctuation
-    french_stopwords = set(stopwords.words(language))
-    tokens = [token for token in tokens if token.isalnum() and token not in french_stopwords]
 
-    return tokens
+def index_embeddings(index):
+    """Document ids and normalized embedding matrix of a LlamaIndex vector index."""
+    doc_ids, vectors = [], []
+    for node_id, embedding in index.vector_store.data.embedding_dict.items():
+        doc_ids.append(index.docstore.docs[node_id].metadata["id"])
+        vectors.append(embedding)
+    matrix = np.asarray(vectors, dtype=np.float32)
+    matrix /= np.maximum(np.linalg.norm(matrix, axis=1, keepdims=True), 1e-12)
+    return doc_ids, matrix
+
+
+def _top_results(scores, doc_ids, top_k):
+    top_indices = np.argsort(scores)[::-1][:top_k]
+    return [(doc_ids[idx], scores[idx]) for idx in top_indices]
+
 
 class BM25PlusRetriever:
     """BM25 Plus based retrieval model."""
@@ -51,13 +65,22 @@ class BM25PlusRetriever:
 
     def retrieve(self, query, top_k=5):
         """Retrieve top-k relevant documents."""
-        query_tokens = preprocess_text(query)
-        scores = self.bm25.get_scores(query_tokens)
-        top_indices = np.argsort(scores)[::-1][:top_k]
+        with timed("bm25"):
+            query_tokens = preprocess_text(query)
+            scores = self.bm25.get_scores(query_tokens)
+            top_indices = np.argsort(scores)[::-1][:top_k]
 
         results = [(self.doc_ids[idx], scores[idx]) for idx in top_indices]
         return results
 
+    def retrieve_batch(self, queries, top_k=5):
+        """Retrieve top-k relevant documents for each query."""
+        with timed("bm25"):
+            return [
+                _top_results(self.bm25.get_scores(preprocess_text(query)), self.doc_ids, top_k)
+                for query in queries
+            ]
+
     def save(self, path):
         """Save the model to disk."""
         os.makedirs(os.path.dirname(path), exist_ok=True)
@@ -83,20 +106,20 @@ class DenseRetriever:
     """Dense retrieval model using LlamaIndex."""
     def __init__(self, embed_model_name="intfloat/multilingual-e5-large"):
         """Initialize with a multilingual embedding model that works well for French"""
-        # Check if GPU is available
-        device = "cuda" if torch.cuda.is_available() else "cpu"
-        print(f"Using device: {device} for embeddings")
-
-        self.embed_model = HuggingFaceEmbedding(
-            model_name=embed_model_name,
-            device=device
-        )
-        Settings.embed_model = self.embed_model
+        # Queries are encoded in batches gathered across threads (or by the host's embedding service)
+        self.embed_model, self.query_encoder = load_query_encoder(embed_model_name)
+        # The model is passed to the index explicitly instead of through the global
+        # Settings, so that several retrievers can coexist in one process
         self.index = None
         self.doc_ids = None
+        # Document embeddings as one matrix, for batched search (built on first use)
+        self._matrix = None
+        self._matrix_lock = threading.Lock()
 
     def fit(self, documents):
         """Build the vector index from documents."""
+        if self.embed_model is None:
+            raise RuntimeError("Building an index needs the embedding model: unset EMBEDDING_SERVICE_SOCKET")
         print("Building dense vector index...")
         start_time = time.time()
 
@@ -108,6 +131,7 @@ class DenseRetriever:
         self.index = VectorStoreIndex.from_documents(
             documents,
             vector_store=vector_store,
+            embed_model=self.embed_model,
             show_progress=True
         )
 
@@ -115,8 +139,11 @@ class DenseRetriever:
 
     def retrieve(self, query, top_k=5):
         """Retrieve top-k relevant documents."""
-        retriever = self.index.as_retriever(similarity_top_k=top_k)
-        results = retriever.retrieve(query)
+        with timed("query_embedding"):
+            embedding = self.query_encoder([query])[0].tolist()
+        with timed("dense_search"):
+            retriever = self.index.as_retriever(similarity_top_k=top_k)
+            results = retriever.retrieve(QueryBundle(query_str=query, embedding=embedding))
 
         retrieved_docs = []
         for node in results:
@@ -126,6 +153,20 @@ class DenseRetriever:
 
         return retrieved_docs
 
+    def retrieve_batch(self, queries, top_k=5):
+        """Retrieve top-k relevant documents for each query with one embedding pass and one matrix product."""
+        with timed("query_embedding"):
+            embeddings = self.query_encoder(queries)
+            embeddings = embeddings / np.maximum(np.linalg.norm(embeddings, axis=1, keepdims=True), 1e-12)
+        with timed("dense_search"):
+            with self._matrix_lock:
+                if self._matrix is None:
+                    self._matrix = index_embeddings(self.index)
+            doc_ids, matrix = self._matrix
+            # Cosine similarity, as the vector store computes it
+            scores = embeddings @ matrix.T
+            return [[(doc_id, float(score)) for doc_id, score in _top_results(row, doc_ids, top_k)] for row in scores]
+
     def save(self, path):
         """Save the index to disk."""
         os.makedirs(path, exist_ok=True)
@@ -148,7 +189,9 @@ class DenseRetriever:
 
         model = cls(embed_model_name=embed_model_name)
         storage_context = StorageContext.from_defaults(persist_dir=path)
-        model.index = load_index_from_storage(storage_context)
+        # Query embeddings are always passed in, so without a local model the index gets a placeholder
+        embed_model = model.embed_model or MockEmbedding(embed_dim=1)
+        model.index = load_index_from_storage(storage_context, embed_model=embed_model)
 
         # Load doc_ids
         with open(os.path.join(path, "doc_ids.pkl"), "rb") as f:
@@ -173,23 +216,35 @@ class ReciprocalRankFusionRetriever:
         self.dense_model = dense_model
         self.k = k
         self.name = f"rrf_k{k}"
+        # Results taken from each branch before fusion
+        self.depth = 100
 
     def retrieve(self, query, top_k=5):
         # Get results from both models
-        sparse_results = self.sparse_model.retrieve(query, top_k=100)
-        dense_results = self.dense_model.retrieve(query, top_k=100)
-
-        # Calculate RRF scores
-        rrf_scores = {}
-
-        # Add sparse rankings
-        for rank, (doc_id, _) in enumerate(sparse_results):
-            rrf_scores[doc_id] = rrf_scores.get(doc_id, 0) + 1 / (self.k + rank + 1)
-
-        # Add dense rankings
-        for rank, (doc_id, _) in enumerate(dense_results):
-            rrf_scores[doc_id] = rrf_scores.get(doc_id, 0) + 1 / (self.k + rank + 1)
-
-        # Sort and return top-k
-        sorted_results = sorted(rrf_scores.items(), key=lambda x: x[1], reverse=True)
-        return sorted_results[:top_k]
\ No newline at end of file
+        sparse_results = self.sparse_model.retrieve(query, top_k=self.depth)
+        dense_results = self.dense_model.retrieve(query, top_k=self.depth)
+        return self.fuse(sparse_results, dense_results, top_k)
+
+    def retrieve_batch(self, queries, top_k=5):
+        """Retrieve top-k documents for each query, running each branch once for the whole batch."""
+        sparse_results = self.sparse_model.retrieve_batch(queries, top_k=self.depth)
+        dense_results = self.dense_model.retrieve_batch(queries, top_k=self.depth)
+        return [self.fuse(sparse, dense, top_k) for sparse, dense in zip(sparse_results, dense_results)]
+
+    def fuse(self, sparse_results, dense_results, top_k=5):
+        """Fuse the rankings of both branches."""
+        with timed("fusion"):
+            # Calculate RRF scores
+            rrf_scores = {}
+
+            # Add sparse rankings
+            for rank, (doc_id, _) in enumerate(sparse_results):
+                rrf_scores[doc_id] = rrf_scores.get(doc_id, 0) + 1 / (self.k + rank + 1)
+
+            # Add dense rankings
+            for rank, (doc_id, _) in enumerate(dense_results):
+                rrf_scores[doc_id] = rrf_scores.get(doc_id, 0) + 1 / (self.k + rank + 1)
+
+            # Sort and return top-k
+            sorted_results = sorted(rrf_scores.items(), key=lambda x: x[1], reverse=True)
+        return sorted_results[:top_k]
@@ -0,0 +1,225 @@
+import asyncio
+import math
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+
+from .metrics import Counter, Gauge, Histogram
+
+# Priority classes, served strictly in this order
+INTERACTIVE = 0
+BULK = 1
+PRIORITY_NAMES = {INTERACTIVE: "interactive", BULK: "bulk"}
+
+# Quota configuration (defaults match the Gemini free tier for flash models)
+GEMINI_RPM = float(os.getenv("GEMINI_RPM", "15"))
+GEMINI_BURST = int(os.getenv("GEMINI_BURST", "5"))
+SCHEDULER_MAX_QUEUE = int(os.getenv("SCHEDULER_MAX_QUEUE", "100"))
+SCHEDULER_MAX_QUEUE_PER_USER = int(os.getenv("SCHEDULER_MAX_QUEUE_PER_USER", "3"))
+SCHEDULER_MAX_WAIT = float(os.getenv("SCHEDULER_MAX_WAIT", "30"))
+
+QUEUE_DEPTH = Gauge(
+    "juridoc_generation_queue_depth",
+    "Generation calls waiting for a rate-limit token",
+    ["priority"],
+)
+QUEUE_WAIT = Histogram(
+    "juridoc_generation_queue_wait_seconds",
+    "Time spent queued before a generation call was dispatched",
+    ["priority"],
+)
+REJECTED = Counter(
+    "juridoc_generation_rejected",
+    "Generation calls rejected by admission control",
+    ["priority", "reason"],
+)
+
+
+class SchedulerOverloaded(Exception):
+    """Raised when a generation call cannot be admitted (or upstream quota is exhausted)."""
+    def __init__(self, detail: str, retry_after: float, status_code: int = 503):
+        super().__init__(detail)
+        self.detail = detail
+        self.retry_after = max(1, math.ceil(retry_after))
+        self.status_code = status_code
+
+
+class TokenBucket:
+    """
+    Classic token bucket refilled continuously at `rate` tokens per second.
+
+    Thread-safe: besides the scheduler's dispatcher, generation threads
+    take tokens (hedges) and drain it (upstream 429s).
+    """
+    def __init__(self, rate: float, capacity: int):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def try_acquire(self) -> float:
+        """Take a token; return 0 on success or the seconds until one is available."""
+        with self._lock:
+            self._refill()
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return 0.0
+            return (1 - self.tokens) / self.rate
+
+    def refund(self):
+        with self._lock:
+            self.tokens = min(self.capacity, self.tokens + 1)
+
+    def time_until(self, count: int) -> float:
+        """Estimate the seconds until `count` more tokens can be taken."""
+        with self._lock:
+            self._refill()
+            missing = count - self.tokens
+        return max(0.0, missing / self.rate)
+
+    def drain(self, seconds: float):
+        """Empty the bucket so that no token is handed out for `seconds`."""
+        with self._lock:
+            self._refill()
+            self.tokens = -seconds * self.rate
+
+
+class GenerationScheduler:
+    """
+    Paces outgoing LLM calls to the provider quota.
+
+    Waiters are grouped by priority class and, inside a class, by user. Users
+    are served round-robin so that one heavy user cannot starve the others,
+    and interactive calls always go before bulk work.
+    """
+
+    def __init__(
+        self,
+        rate_per_minute: float = GEMINI_RPM,
+        burst: int = GEMINI_BURST,
+        max_queue: int = SCHEDULER_MAX_QUEUE,
+        max_queue_per_user: int = SCHEDULER_MAX_QUEUE_PER_USER,
+        max_wait: float = SCHEDULER_MAX_WAIT,
+    ):
+        self.bucket = TokenBucket(rate_per_minute / 60.0, burst)
+        self.max_queue = max_queue
+        self.max_queue_per_user = max_queue_per_user
+        self.max_wait = max_wait
+        self._queues = {priority: OrderedDict() for priority in PRIORITY_NAMES}
+        self._depth = {priority: 0 for priority in PRIORITY_NAMES}
+        self._wakeup = None
+        self._dispatcher = None
+
+    @property
+    def depth(self) -> int:
+        return sum(self._depth.values())
+
+    def _ahead_of(self, priority: int) -> int:
+        return sum(depth for p, depth in self._depth.items() if p <= priority)
+
+    def _reject(self, priority, reason, detail, retry_after, status_code):
+        REJECTED.inc(priority=PRIORITY_NAMES[priority], reason=reason)
+        raise SchedulerOverloaded(detail, retry_after, status_code)
+
+    def _admit(self, user_id: str, priority: int):
+        per_token = 1 / self.bucket.rate
+        user_queue = self._queues[priority].get(user_id)
+        if user_queue is not None and len(user_queue) >= self.max_queue_per_user:
+            self._reject(priority, "user_queue_full", "Too many pending requests for this user",
+                         per_token * len(user_queue), 429)
+        if self.depth >= self.max_queue:
+            self._reject(priority, "queue_full", "Generation queue is full",
+                         per_token * self.depth, 503)
+        estimated_wait = self.bucket.time_until(self._ahead_of(priority) + 1)
+        if estimated_wait > self.max_wait:
+            self._reject(priority, "wait_too_long", "Generation capacity exhausted, retry later",
+                         estimated_wait, 503)
+
+    def _ensure_dispatcher(self):
+        loop = asyncio.get_running_loop()
+        if self._dispatcher is None or self._dispatcher.done() or self._dispatcher.get_loop() is not loop:
+            self._wakeup = asyncio.Event()
+            self._dispatcher = loop.create_task(self._dispatch())
+
+    def _set_depth(self, priority: int, delta: int):
+        self._depth[priority] += delta
+        QUEUE_DEPTH.set(self._depth[priority], priority=PRIORITY_NAMES[priority])
+
+    def _next_waiter(self):
+        for priority, users in self._queues.items():
+            while users:
+                user_id, queue = next(iter(users.items()))
+                waiter = queue.popleft()
+                self._set_depth(priority, -1)
+                # Rotate the user to the back of the round-robin
+                del users[user_id]
+                if queue:
+                    users[user_id] = queue
+                if not waiter.done():
+                    return waiter
+        return None
+
+    async def _dispatch(self):
+        while True:
+            if not self.depth:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+                continue
+            delay = self.bucket.try_acquire()
+            if delay:
+                await asyncio.sleep(delay)
+                continue
+            waiter = self._next_waiter()
+            if waiter is None:
+                self.bucket.refund()
+                continue
+            waiter.set_result(None)
+
+    def _discard(self, priority: int, user_id: str, waiter):
+        queue = self._queues[priority].get(user_id)
+        if queue is None or waiter not in queue:
+            return
+        queue.remove(waiter)
+        self._set_depth(priority, -1)
+        if not queue:
+            del self._queues[priority][user_id]
+
+    async def acquire(self, user_id: str, priority: int = INTERACTIVE):
+        """Wait for a rate-limit token. Raises SchedulerOverloaded instead of queueing forever."""
+        self._admit(user_id, priority)
+        self._ensure_dispatcher()
+        waiter = asyncio.get_running_loop().create_future()
+        self._queues[priority].setdefault(user_id, deque()).append(waiter)
+        self._set_depth(priority, 1)
+        self._wakeup.set()
+
+        enqueued = time.monotonic()
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            self._discard(priority, user_id, waiter)
+            raise
+        QUEUE_WAIT.observe(time.monotonic() - enqueued, priority=PRIORITY_NAMES[priority])
+
+    def pause(self, seconds: float):
+        """Back off after the provider reported that the quota is exhausted."""
+        self.bucket.drain(seconds)
+
+    def stats(self) -> dict:
+        return {
+            "queue_depth": {PRIORITY_NAMES[p]: d for p, d in self._depth.items()},
+            "active_users": {PRIORITY_NAMES[p]: len(users) for p, users in self._queues.items()},
+            "tokens_available": max(0.0, self.bucket.tokens),
+            "rate_per_minute": self.bucket.rate * 60,
+        }
+
+
+# Shared scheduler for every generation call made by this process
+generation_scheduler = GenerationScheduler()
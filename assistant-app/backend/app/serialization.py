@@ -0,0 +1,52 @@
+from typing import Iterable
+
+import orjson
+from fastapi.responses import Response, StreamingResponse
+
+# Numpy scores (retrieval) and datetimes (Mongo) are encoded natively
+_OPTIONS = orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS
+
+# Items per chunk of a streamed JSON array
+STREAM_CHUNK_ITEMS = 100
+
+
+def dumps(value) -> bytes:
+    """Encode a value as compact UTF-8 JSON."""
+    return orjson.dumps(value, option=_OPTIONS)
+
+
+class FastJSONResponse(Response):
+    """
+    JSON response for data the server already trusts (read from Mongo and
+    shaped by the handler): returned directly, it skips the response_model
+    validation and the jsonable_encoder pass. The handler must only include
+    the fields of its declared response model.
+    """
+    media_type = "application/json"
+
+    def render(self, content) -> bytes:
+        return dumps(content)
+
+
+def _iter_object(head: dict, key: str, items: Iterable[dict]):
+    # `head` without its closing brace, then the array item by item
+    prefix = dumps(head)[:-1]
+    yield prefix + (b',"' if head else b'"') + key.encode() + b'":['
+    chunk = []
+    first = True
+    for item in items:
+        chunk.append(dumps(item))
+        if len(chunk) >= STREAM_CHUNK_ITEMS:
+            yield (b"" if first else b",") + b",".join(chunk)
+            chunk, first = [], False
+    if chunk:
+        yield (b"" if first else b",") + b",".join(chunk)
+    yield b"]}"
+
+
+def streamed_json_object(head: dict, key: str, items: Iterable[dict], **kwargs) -> StreamingResponse:
+    """
+    The JSON object `head` plus the array `items` under `key`, encoded and
+    sent a chunk of items at a time rather than as one buffered body.
+    """
+    return StreamingResponse(_iter_object(head, key, items), media_type="application/json", **kwargs)
@@ -0,0 +1,315 @@
+"""
+Scatter-gather retrieval over per-code shards.
+
+The corpus is split into shards (one per code, or per group of codes), each
+holding the BM25+ postings and the dense vectors of its articles. Worker
+processes own a subset of the shards; a query is sent to every worker and
+their top-k results are merged. BM25+ statistics (idf, average document
+length) are computed over the whole corpus when the shards are built and
+sent with each query, so shard scores are directly comparable and the
+merged ranking is the one a single index would give.
+
+Build the shards from the monolithic indexes, then point the API at them:
+
+    python -m app.sharded_retrieval --out ../../knowledge_base/vector_store/shards
+    python -m app.sharded_retrieval --out ... --groups "travail,famille;penal"   # group codes
+    RETRIEVAL_SHARDS_DIR=../../knowledge_base/vector_store/shards uvicorn app.main:app
+"""
+import argparse
+import heapq
+import json
+import math
+import multiprocessing
+import os
+import pickle
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from .article_refs import canonical_code
+from .metrics import timed
+
+MANIFEST_FILE = "shards.json"
+IDF_FILE = "bm25_idf.pkl"
+SPARSE_FILE = "sparse.pkl"
+DENSE_FILE = "dense.npz"
+# Shard of the documents whose code is not recognized
+OTHER_SHARD = "other"
+
+# Shards owned by this worker process (set by _init_worker)
+_worker_shards = []
+_bm25_params = {}
+
+
+def _init_worker(shard_dirs: List[str], bm25_params: Dict):
+    global _bm25_params
+    _bm25_params = bm25_params
+    for shard_dir in shard_dirs:
+        with open(os.path.join(shard_dir, SPARSE_FILE), "rb") as f:
+            shard = pickle.load(f)
+        # Length normalization only depends on the global average length, so it is computed once
+        shard["norm"] = bm25_params["k1"] * (
+            1 - bm25_params["b"] + bm25_params["b"] * shard["doc_len"] / bm25_params["avgdl"]
+        )
+        dense_path = os.path.join(shard_dir, DENSE_FILE)
+        if os.path.exists(dense_path):
+            dense = np.load(dense_path)
+            shard["embeddings"] = dense["embeddings"]
+        _worker_shards.append(shard)
+
+
+def _worker_size() -> int:
+    return sum(len(shard["doc_ids"]) for shard in _worker_shards)
+
+
+def _top_k(scores: np.ndarray, doc_ids: List[str], top_k: int) -> List[Tuple[float, str]]:
+    k = min(top_k, len(scores))
+    if k == 0:
+        return []
+    top = np.argpartition(-scores, k - 1)[:k]
+    top = top[np.argsort(-scores[top], kind="stable")]
+    return [(float(scores[i]), doc_ids[i]) for i in top]
+
+
+def _merge(results: List[List[Tuple[float, str]]], top_k: int) -> List[Tuple[float, str]]:
+    return heapq.nlargest(top_k, (hit for hits in results for hit in hits), key=lambda hit: hit[0])
+
+
+def _search_sparse(queries: List[List[str]], idf: Dict[str, float], top_k: int) -> List[List[Tuple[float, str]]]:
+    """BM25+ top-k of this worker's shards for each tokenized query, scored with the global idf."""
+    k1, delta = _bm25_params["k1"], _bm25_params["delta"]
+    results = []
+    for tokens in queries:
+        # Every query term adds idf * delta to every document, present or not (as in rank_bm25)
+        base = delta * sum(idf.get(token, 0.0) for token in tokens)
+        shard_results = []
+        for shard in _worker_shards:
+            scores = np.full(len(shard["doc_ids"]), base)
+            for token in tokens:
+                posting = shard["postings"].get(token)
+                if posting is None or not idf.get(token):
+                    continue
+                positions, freqs = posting
+                scores[positions] += idf[token] * freqs * (k1 + 1) / (shard["norm"][positions] + freqs)
+            shard_results.append(_top_k(scores, shard["doc_ids"], top_k))
+        results.append(_merge(shard_results, top_k))
+    return results
+
+
+def _search_dense(embeddings: np.ndarray, top_k: int) -> List[List[Tuple[float, str]]]:
+    """Cosine-similarity top-k of this worker's shards for each (normalized) query embedding."""
+    shard_scores = [
+        (shard["embeddings"] @ embeddings.T, shard["doc_ids"]) for shard in _worker_shards if "embeddings" in shard
+    ]
+    return [
+        _merge([_top_k(scores[:, i], doc_ids, top_k) for scores, doc_ids in shard_scores], top_k)
+        for i in range(len(embeddings))
+    ]
+
+
+class ShardPool:
+    """Worker processes serving the shards of a shards directory."""
+
+    def __init__(self, shards_dir: str, workers: Optional[int] = None):
+        with open(os.path.join(shards_dir, MANIFEST_FILE), "r", encoding="utf-8") as f:
+            self.manifest = json.load(f)
+        with open(os.path.join(shards_dir, IDF_FILE), "rb") as f:
+            self.idf = pickle.load(f)
+        shards = self.manifest["shards"]
+        workers = max(1, min(workers or len(shards), len(shards)))
+
+        # Largest shards first, each to the least loaded worker
+        assignments = [[] for _ in range(workers)]
+        loads = [0] * workers
+        for shard in sorted(shards, key=lambda s: s["docs"], reverse=True):
+            worker = loads.index(min(loads))
+            assignments[worker].append(os.path.join(shards_dir, shard["name"]))
+            loads[worker] += shard["docs"]
+
+        # One single-process executor per worker so that each one keeps its own shards;
+        # spawned so that children never inherit the parent's model threads
+        context = multiprocessing.get_context("spawn")
+        self.executors = [
+            ProcessPoolExecutor(
+                max_workers=1, mp_context=context,
+                initializer=_init_worker, initargs=(shard_dirs, self.manifest["bm25"]),
+            )
+            for shard_dirs in assignments
+        ]
+        # Load the shards now rather than on the first query
+        sizes = [executor.submit(_worker_size).result() for executor in self.executors]
+        print(f"Loaded {len(shards)} retrieval shards in {workers} workers ({sum(sizes)} documents)")
+
+    def scatter(self, fn, *args, top_k: int) -> List[List[Tuple[str, float]]]:
+        """
+        Run a batch search on every worker and merge their top-k into
+        (doc_id, score) pairs, one list per query.
+        """
+        futures = [executor.submit(fn, *args, top_k) for executor in self.executors]
+        per_worker = [future.result() for future in futures]
+        return [
+            [(doc_id, score) for score, doc_id in _merge(list(worker_hits), top_k)]
+            for worker_hits in zip(*per_worker)
+        ]
+
+    def close(self):
+        for executor in self.executors:
+            executor.shutdown()
+
+
+class ShardedBM25Retriever:
+    """BM25+ over the shards of a ShardPool (same interface as BM25PlusRetriever)."""
+
+    def __init__(self, pool: ShardPool):
+        self.pool = pool
+
+    def retrieve(self, query, top_k=5):
+        return self.retrieve_batch([query], top_k)[0]
+
+    def retrieve_batch(self, queries, top_k=5):
+        """Top-k documents of each query, in one round trip to each worker."""
+        from .text_processing import preprocess_text
+
+        with timed("bm25"):
+            tokens = [preprocess_text(query) for query in queries]
+            idf = {token: self.pool.idf[token] for query in tokens for token in query if token in self.pool.idf}
+            return self.pool.scatter(_search_sparse, tokens, idf, top_k=top_k)
+
+
+class ShardedDenseRetriever:
+    """Dense retrieval over the shards of a ShardPool (same interface as DenseRetriever)."""
+
+    def __init__(self, pool: ShardPool, embed_model_name="intfloat/multilingual-e5-large"):
+        from .embedding_service import load_query_encoder
+
+        self.embed_model, self.query_encoder = load_query_encoder(embed_model_name)
+        self.pool = pool
+
+    def retrieve(self, query, top_k=5):
+        return self.retrieve_batch([query], top_k)[0]
+
+    def retrieve_batch(self, queries, top_k=5):
+        """Top-k documents of each query; the queries are embedded in one forward pass."""
+        with timed("query_embedding"):
+            embeddings = self.query_encoder(queries)
+            embeddings = embeddings / np.maximum(np.linalg.norm(embeddings, axis=1, keepdims=True), 1e-12)
+        with timed("dense_search"):
+            return self.pool.scatter(_search_dense, embeddings, top_k=top_k)
+
+
+def parse_groups(value: str) -> List[List[str]]:
+    """ "travail,famille;penal" -> [["travail", "famille"], ["penal"]] """
+    return [[code.strip() for code in group.split(",") if code.strip()] for group in value.split(";") if group.strip()]
+
+
+def shard_names(corpus_data: Dict, groups: List[List[str]]) -> Dict[str, str]:
+    """Shard of each document: its code's group, else its code, else the catch-all shard."""
+    group_of = {code: "+".join(group) for group in groups for code in group}
+    names = {}
+    for doc_id, document in zip(corpus_data["doc_ids"], corpus_data["documents"]):
+        metadata = document.metadata
+        code = canonical_code(
+            metadata.get("code") or metadata.get("loi") or metadata.get("code_display")
+            or metadata.get("source_file") or ""
+        )
+        names[doc_id] = group_of.get(code, code or OTHER_SHARD)
+    return names
+
+
+def _postings(doc_freqs: List[Dict[str, int]]) -> Dict[str, Tuple[np.ndarray, np.ndarray]]:
+    postings = {}
+    for position, freqs in enumerate(doc_freqs):
+        for token, freq in freqs.items():
+            postings.setdefault(token, ([], []))
+            postings[token][0].append(position)
+            postings[token][1].append(freq)
+    return {
+        token: (np.array(positions, dtype=np.int32), np.array(freqs, dtype=np.float64))
+        for token, (positions, freqs) in postings.items()
+    }
+
+
+def _dense_embeddings(dense_model_path: str) -> Dict[str, np.ndarray]:
+    """Normalized embedding of each document of a persisted LlamaIndex index."""
+    from llama_index.core import StorageContext, load_index_from_storage
+    from .retrievers import index_embeddings
+
+    index = load_index_from_storage(StorageContext.from_defaults(persist_dir=dense_model_path))
+    doc_ids, matrix = index_embeddings(index)
+    return dict(zip(doc_ids, matrix))
+
+
+def build_shards(
+    out_dir: str, sparse_model_path: str, corpus_lookup_path: str,
+    dense_model_path: Optional[str] = None, groups: Optional[List[List[str]]] = None,
+):
+    """Split the monolithic BM25+ (and dense) index into shards with global BM25 statistics."""
+    with open(corpus_lookup_path, "rb") as f:
+        corpus_data = pickle.load(f)
+    with open(sparse_model_path, "rb") as f:
+        sparse = pickle.load(f)
+    bm25 = sparse["bm25"]
+    names = shard_names(corpus_data, groups or [])
+    embeddings = _dense_embeddings(dense_model_path) if dense_model_path else {}
+
+    positions = {}
+    for position, doc_id in enumerate(sparse["doc_ids"]):
+        positions.setdefault(names.get(doc_id, OTHER_SHARD), []).append(position)
+
+    doc_freq = {}
+    total_length = 0
+    manifest = []
+    for name, members in sorted(positions.items()):
+        shard_dir = os.path.join(out_dir, name)
+        os.makedirs(shard_dir, exist_ok=True)
+        doc_ids = [sparse["doc_ids"][i] for i in members]
+        doc_len = np.array([bm25.doc_len[i] for i in members], dtype=np.float64)
+        postings = _postings([bm25.doc_freqs[i] for i in members])
+        with open(os.path.join(shard_dir, SPARSE_FILE), "wb") as f:
+            pickle.dump({"doc_ids": doc_ids, "doc_len": doc_len, "postings": postings}, f)
+        for token, (token_positions, _) in postings.items():
+            doc_freq[token] = doc_freq.get(token, 0) + len(token_positions)
+        total_length += doc_len.sum()
+
+        has_dense = bool(embeddings) and all(doc_id in embeddings for doc_id in doc_ids)
+        if has_dense:
+            np.savez(os.path.join(shard_dir, DENSE_FILE), embeddings=np.stack([embeddings[d] for d in doc_ids]))
+        elif embeddings:
+            print(f"Shard {name}: some documents have no embedding, dense search skips it")
+        manifest.append({"name": name, "docs": len(doc_ids), "dense": has_dense})
+        print(f"Shard {name}: {len(doc_ids)} documents")
+
+    # Corpus-wide statistics, as BM25Plus computes them for a single index
+    corpus_size = sum(shard["docs"] for shard in manifest)
+    idf = {token: math.log((corpus_size + 1) / freq) for token, freq in doc_freq.items()}
+    with open(os.path.join(out_dir, IDF_FILE), "wb") as f:
+        pickle.dump(idf, f)
+    with open(os.path.join(out_dir, MANIFEST_FILE), "w", encoding="utf-8") as f:
+        json.dump({
+            "shards": manifest,
+            "bm25": {
+                "corpus_size": corpus_size, "avgdl": total_length / corpus_size,
+                "k1": bm25.k1, "b": bm25.b, "delta": bm25.delta,
+            },
+        }, f, indent=2)
+    print(f"Wrote {len(manifest)} shards ({corpus_size} documents) to {out_dir}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Split the retrieval indexes into per-code shards")
+    parser.add_argument("--out", required=True, help="Shards directory")
+    parser.add_argument("--sparse", default="../../knowledge_base/vector_store/sparse/bm25_plus.pkl")
+    parser.add_argument("--dense", default="../../knowledge_base/vector_store/dense/legal_dense_index")
+    parser.add_argument("--corpus", default="../../knowledge_base/vector_store/corpus_lookup.pkl")
+    parser.add_argument("--no-dense", action="store_true", help="Only shard the BM25+ index")
+    parser.add_argument("--groups", default="", help='Codes sharing a shard, e.g. "travail,famille;penal"')
+    args = parser.parse_args()
+    build_shards(
+        args.out, args.sparse, args.corpus,
+        dense_model_path=None if args.no_dense else args.dense, groups=parse_groups(args.groups),
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,114 @@
+import asyncio
+import os
+import re
+import threading
+import unicodedata
+from typing import Optional, Sequence
+
+from .cancellation import check_cancelled, start_cancellation_scope
+from .metrics import Counter, Gauge
+
+# Identical questions asked while one is being answered share its answer
+QUESTION_COALESCING = os.getenv("QUESTION_COALESCING", "true").lower() == "true"
+
+COALESCED = Counter(
+    "juridoc_requests_coalesced",
+    "Requests answered by an identical request already in flight",
+)
+FLIGHTS_IN_PROGRESS = Gauge(
+    "juridoc_coalescing_flights",
+    "Distinct questions being answered for one or more requests",
+)
+
+
+def question_key(question: str, index_version: str, previous_doc_ids: Optional[Sequence[str]] = None):
+    """
+    Coalescing key of a question: its normalized text (Unicode form, case,
+    spacing and trailing punctuation ignored), the index it is answered
+    from and the articles of the conversation it follows up on.
+    """
+    text = unicodedata.normalize("NFKC", question).casefold()
+    text = re.sub(r"\s+", " ", text).strip().rstrip(" ?!.")
+    return index_version, text, tuple(previous_doc_ids or ())
+
+
+class Flight:
+    """One execution shared by every request that asked the same question."""
+
+    def __init__(self, key):
+        self.key = key
+        self.subscribers = 0
+        self.task = None
+        # Created up front: subscribers may leave before the task has started
+        self._cancel = threading.Event()
+
+    async def _execute(self, fn, *args):
+        # The task runs in its own context: only the flight's cancellation reaches the pipeline
+        start_cancellation_scope(self._cancel)
+        check_cancelled()
+        return await fn(*args)
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancel.is_set()
+
+    def leave(self):
+        """A subscriber lost interest; the execution is cancelled once nobody is left."""
+        self.subscribers -= 1
+        if self.subscribers <= 0 and not self.task.done():
+            self._cancel.set()
+
+    async def wait(self):
+        try:
+            # Shielded so that one request being cancelled does not cancel the others
+            return await asyncio.shield(self.task)
+        except asyncio.CancelledError:
+            self.leave()
+            raise
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls with the same key into a single execution.
+
+    The first caller starts `fn` in a task of its own; callers arriving
+    before it finishes subscribe to the same flight and receive the same
+    result (or exception). Nothing is cached once the flight lands.
+    """
+
+    def __init__(self):
+        self._flights = {}
+
+    def join(self, key, fn, *args):
+        """
+        The flight for `key` (started with `fn(*args)` if none is in
+        progress, or if the one in progress was cancelled) and whether it
+        was already running. A None key is never shared.
+        """
+        flight = self._flights.get(key) if key is not None else None
+        if flight is not None and flight.cancelled:
+            # Everybody left it and it is only winding down: start over (replacing it)
+            flight = None
+        joined = flight is not None
+        if not joined:
+            flight = Flight(key)
+            flight.task = asyncio.create_task(flight._execute(fn, *args))
+            flight.task.add_done_callback(lambda _: self._land(flight))
+            if key is not None:
+                self._flights[key] = flight
+                FLIGHTS_IN_PROGRESS.set(len(self._flights))
+        else:
+            COALESCED.inc()
+        flight.subscribers += 1
+        return flight, joined
+
+    def _land(self, flight: Flight):
+        if not flight.task.cancelled():
+            # Retrieved here so that a failure nobody waited for is not reported as unhandled
+            flight.task.exception()
+        if flight.key is not None and self._flights.get(flight.key) is flight:
+            del self._flights[flight.key]
+            FLIGHTS_IN_PROGRESS.set(len(self._flights))
+
+
+question_flights = SingleFlight()
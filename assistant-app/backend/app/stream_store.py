@@ -0,0 +1,143 @@
+import asyncio
+import os
+import time
+import uuid
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+from .metrics import Counter, Gauge
+from .serialization import dumps
+
+# How long a finished stream stays available to reconnecting clients
+STREAM_REPLAY_TTL = float(os.getenv("STREAM_REPLAY_TTL", "300"))
+STREAM_REPLAY_MAX_STREAMS = int(os.getenv("STREAM_REPLAY_MAX_STREAMS", "1000"))
+# How long an unfinished stream may go without any connection before its generation is cancelled
+STREAM_ABANDON_GRACE = float(os.getenv("STREAM_ABANDON_GRACE", "5"))
+
+REPLAY_STREAMS = Gauge(
+    "juridoc_stream_replay_buffers",
+    "Streamed answers buffered for reconnecting clients",
+)
+STREAM_RESUMES = Counter(
+    "juridoc_stream_resumes",
+    "Reconnections to a streamed answer",
+    ["outcome"],
+)
+
+
+class ReplayStream:
+    """
+    The events of one streamed answer.
+
+    The producer appends events while any number of connections follow
+    them, each from its own position, so a client that reconnects picks up
+    the events it missed while generation carries on. If no connection
+    comes back within `STREAM_ABANDON_GRACE` seconds, `on_abandoned` is
+    called so the producer can stop.
+    """
+
+    def __init__(self, owner: str):
+        self.id = uuid.uuid4().hex
+        self.owner = owner
+        self.events = []
+        self.done = False
+        self.finished_at = None
+        self.followers = 0
+        self.on_abandoned = None
+        self._changed = asyncio.Event()
+
+    def append(self, payload: dict):
+        self.events.append(dumps(payload))
+        self._notify()
+
+    def finish(self):
+        if not self.done:
+            self.done = True
+            self.finished_at = time.monotonic()
+            self._notify()
+
+    def _notify(self):
+        # Wake the current followers; later ones wait on a fresh event
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    def format_event(self, seq: int) -> bytes:
+        return b"id: %s:%d\ndata: %s\n\n" % (self.id.encode(), seq, self.events[seq])
+
+    async def follow(self, last_seq: int = -1):
+        """Yield the SSE events after `last_seq`, waiting for new ones until the stream finishes."""
+        seq = last_seq + 1
+        self.followers += 1
+        try:
+            while True:
+                if seq < len(self.events):
+                    # Events buffered since the last send (or missed while disconnected) go out as one chunk
+                    end = len(self.events)
+                    yield b"".join(self.format_event(i) for i in range(seq, end))
+                    seq = end
+                if self.done:
+                    return
+                await self._changed.wait()
+        finally:
+            self.followers -= 1
+            if not self.followers and not self.done:
+                asyncio.get_running_loop().call_later(STREAM_ABANDON_GRACE, self._check_abandoned)
+
+    def _check_abandoned(self):
+        if not self.followers and not self.done and self.on_abandoned is not None:
+            # Called once: a stream is abandoned at most once
+            callback, self.on_abandoned = self.on_abandoned, None
+            callback()
+
+
+class StreamReplayStore:
+    """Short-lived in-process buffer of the answers being (or just) streamed."""
+
+    def __init__(self, ttl: float = STREAM_REPLAY_TTL, max_streams: int = STREAM_REPLAY_MAX_STREAMS):
+        self.ttl = ttl
+        self.max_streams = max_streams
+        self._streams = OrderedDict()
+
+    def create(self, owner: str) -> ReplayStream:
+        self._purge()
+        while len(self._streams) >= self.max_streams:
+            self._streams.popitem(last=False)
+        stream = ReplayStream(owner)
+        self._streams[stream.id] = stream
+        REPLAY_STREAMS.set(len(self._streams))
+        return stream
+
+    def get(self, stream_id: str, owner: str) -> Optional[ReplayStream]:
+        """The buffered stream, if it has not expired and belongs to `owner`."""
+        self._purge()
+        stream = self._streams.get(stream_id)
+        if stream is None or stream.owner != owner:
+            return None
+        return stream
+
+    def _purge(self):
+        now = time.monotonic()
+        expired = [
+            stream_id for stream_id, stream in self._streams.items()
+            if stream.done and now - stream.finished_at > self.ttl
+        ]
+        for stream_id in expired:
+            del self._streams[stream_id]
+        REPLAY_STREAMS.set(len(self._streams))
+
+
+def parse_last_event_id(value: Optional[str]) -> Tuple[Optional[str], int]:
+    """
+    Split a Last-Event-ID ("<stream id>:<seq>", or a bare sequence number)
+    into the stream id and the last event received (-1 when unknown).
+    """
+    if not value:
+        return None, -1
+    stream_id, _, seq = value.strip().rpartition(":")
+    try:
+        return stream_id or None, int(seq)
+    except ValueError:
+        return None, -1
+
+
+replay_store = StreamReplayStore()
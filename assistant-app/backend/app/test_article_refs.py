@@ -0,0 +1,63 @@
+from types import SimpleNamespace
+
+import pytest
+
+from app.article_refs import ArticleIndex, canonical_code, parse_references
+
+
+@pytest.mark.parametrize("query, expected", [
+    ("Que dit l'article 147 du Code du Travail ?", [("travail", "147")]),
+    ("Articles 12 et 13 de la Moudawana", [("famille", "12"), ("famille", "13")]),
+    ("Dans le code pénal, que prévoit l'article premier ?", [("penal", "1")]),
+    ("L'article 53 de la loi n° 09-08 et l'article 2 du code de commerce", [("loi_09_08", "53"), ("commerce", "2")]),
+    ("Article 6-1 bis", [(None, "6-1bis")]),
+    ("Que prévoit le DOC à l'article 230 ?", [("obligations", "230")]),
+    ("l'article 77 du doc", [("obligations", "77")]),
+    # "doc" and "coc" in lowercase are ordinary words unless an article reference precedes them
+    ("Le doc que j'ai reçu mentionne article 5", [(None, "5")]),
+    ("J'ai un coc à signer, article 3 du code du travail", [("travail", "3")]),
+    ("Comment rompre un contrat de travail ?", []),
+])
+def test_parse_references(query, expected):
+    assert parse_references(query) == expected
+
+
+@pytest.mark.parametrize("name, expected", [
+    ("Code du Travail", "travail"),
+    ("DAHIR FORMANT CODE DES OBLIGATIONS ET DES CONTRATS", "obligations"),
+    ("Loi n° 43-20 relative aux services de confiance", "loi_43_20"),
+    ("Constitution du Maroc 2011", "constitution"),
+    # Corpus folder and file names
+    ("code_travail", "travail"),
+    ("loi_09_08", "loi_09_08"),
+    ("code_obligation_contrats_2019", "obligations"),
+    ("code_comerce_2019", "commerce"),
+    ("code_penale_2018", "penal"),
+    ("Loi_09_08_2009_full.json", "loi_09_08"),
+    ("Documents divers", None),
+    ("", None),
+])
+def test_canonical_code(name, expected):
+    assert canonical_code(name) == expected
+
+
+def corpus(*metadata):
+    return {
+        "doc_ids": [f"doc-{i}" for i in range(len(metadata))],
+        "documents": [SimpleNamespace(metadata=meta) for meta in metadata],
+    }
+
+
+def test_article_index_resolves_named_references_in_query_order():
+    index = ArticleIndex.from_corpus(corpus(
+        {"code": "Code du Travail", "article_no": "Article premier"},
+        {"loi": "Loi n° 09-08 relative à la protection des données", "article_no": "Article 53"},
+        {"source_file": "code_comerce_2019", "article_number": "2"},
+        {"code": "Recueil inconnu", "article_no": "Article 4"},
+        {"code": "Code du Travail"},
+    ))
+    assert len(index) == 3
+    references = parse_references("Article 2 du code de commerce, article 53 de la loi 09-08 et article 1er du code du travail")
+    assert index.lookup(references) == ["doc-2", "doc-1", "doc-0"]
+    # A reference without a code is never guessed
+    assert index.lookup([(None, "53")]) == []
@@ -0,0 +1,118 @@
+import asyncio
+import json
+import os
+
+import pytest
+
+bulk = pytest.importorskip("app.bulk")
+os.environ.setdefault("MONGODB_URI", "mongomock://")
+
+from app.bulk import JsonlResults, run_bulk
+from app.executors import ExecutorBusy
+from app.scheduler import SchedulerOverloaded
+
+
+class Backend:
+    rate_limited = True
+
+
+class Pipeline:
+    """Answers every question with its own text; `failures` are raised by the first calls."""
+
+    def __init__(self, *failures):
+        self.backend = Backend()
+        self.failures = list(failures)
+        self.asked = []
+
+    def retrieve_contexts_batch(self, questions):
+        return [([{"id": "a", "metadata": {"article_number": "1", "code": "code_travail"}, "text": "..."}], "hybrid")
+                for _ in questions]
+
+    def answer_with_context(self, question, documents, retrieval_mode):
+        self.asked.append(question)
+        if self.failures:
+            raise self.failures.pop(0)
+        return f"Réponse à {question}", documents, None
+
+
+class Scheduler:
+    def __init__(self):
+        self.tokens = 0
+
+    async def acquire(self, user_id, priority):
+        self.tokens += 1
+
+
+@pytest.fixture
+def scheduler(monkeypatch):
+    scheduler = Scheduler()
+    monkeypatch.setattr(bulk, "generation_scheduler", scheduler)
+    return scheduler
+
+
+def rows(*questions):
+    return [{"row": row, "id": None, "question": question} for row, question in enumerate(questions)]
+
+
+def test_rerun_resumes_after_the_answered_rows(tmp_path, scheduler):
+    path = tmp_path / "answers.jsonl"
+    path.write_text(
+        json.dumps({"row": 0, "answer": "Déjà répondu"}) + "\n"
+        + json.dumps({"row": 1, "error": "Gemini API HTTP error"}) + "\n"
+        + '{"row": 2, "answ',
+        encoding="utf-8",
+    )
+    pipeline = Pipeline()
+    processed = asyncio.run(run_bulk(pipeline, rows("q0", "q1", "q2"), JsonlResults(str(path)), "bulk", batch_size=1))
+    # The failed row and the one cut short are answered again, the answered one is not
+    assert processed == 2 and pipeline.asked == ["q1", "q2"]
+    assert asyncio.run(JsonlResults(str(path)).completed_rows()) == {0, 1, 2}
+    assert scheduler.tokens == 2
+
+
+def test_every_generation_attempt_takes_a_bulk_token(tmp_path, scheduler):
+    quota = SchedulerOverloaded("Gemini quota exceeded, retry later", 0, 429)
+    pipeline = Pipeline(quota, quota)
+    asyncio.run(run_bulk(pipeline, rows("q0"), JsonlResults(str(tmp_path / "answers.jsonl")), "bulk"))
+    assert pipeline.asked == ["q0"] * 3
+    assert scheduler.tokens == 3
+
+
+def test_calls_turned_away_by_the_executor_keep_their_token(tmp_path, monkeypatch, scheduler):
+    turned_away = []
+
+    async def run(fn, *args):
+        if fn.__name__ == "answer_with_context" and not turned_away:
+            turned_away.append(fn)
+            raise ExecutorBusy("The server is busy, please retry shortly", retry_after=0)
+        return fn(*args)
+
+    monkeypatch.setattr(bulk.pipeline_executor, "run", run)
+    pipeline = Pipeline()
+    asyncio.run(run_bulk(pipeline, rows("q0"), JsonlResults(str(tmp_path / "answers.jsonl")), "bulk"))
+    assert turned_away and pipeline.asked == ["q0"]
+    assert scheduler.tokens == 1
+
+
+def test_job_counters_follow_the_latest_result_of_each_row():
+    pytest.importorskip("mongomock_motor")
+    from app import bulk_jobs
+
+    async def scenario():
+        await bulk_jobs.bulk_results_collection.delete_many({})
+        job = await bulk_jobs.create_job("bulk@example.com", ["q0", "q1"])
+        results = bulk_jobs.MongoResults(job["_id"])
+        await results.write({"row": 0, "error": "Gemini API HTTP error"})
+        await results.write({"row": 1, "answer": "Réponse"})
+        stored = await bulk_jobs.bulk_jobs_collection.find_one({"_id": job["_id"]})
+        assert (stored["completed"], stored["failed"]) == (1, 1)
+        assert await results.completed_rows() == {1}
+
+        # Retrying the failed row replaces its error
+        await results.write({"row": 0, "answer": "Réponse"})
+        stored = await bulk_jobs.bulk_jobs_collection.find_one({"_id": job["_id"]})
+        assert (stored["completed"], stored["failed"]) == (2, 0)
+        assert await results.completed_rows() == {0, 1}
+        assert await bulk_jobs.bulk_results_collection.count_documents({"job_id": job["_id"]}) == 2
+
+    asyncio.run(scenario())
@@ -0,0 +1,156 @@
+import asyncio
+import os
+from datetime import datetime, timedelta
+
+import pytest
+
+pytest.importorskip("mongomock_motor")
+os.environ.setdefault("MONGODB_URI", "mongomock://")
+
+from app.auth import chat_store
+from app.auth.utils import chat_archive_collection, chat_messages_collection, chat_sessions_collection
+
+USER = "archive@example.com"
+MESSAGES = [
+    {"role": "user", "content": "Quelle est la durée du préavis ?"},
+    {"role": "assistant", "content": "Elle dépend de l'ancienneté du salarié."},
+]
+
+
+@pytest.fixture(autouse=True)
+def empty_collections():
+    async def drop():
+        for collection in (chat_sessions_collection, chat_messages_collection, chat_archive_collection):
+            await collection.delete_many({})
+
+    asyncio.run(drop())
+
+
+async def inactive_session() -> str:
+    session_id = await chat_store.create_session(USER, "Préavis", MESSAGES, [])
+    await chat_sessions_collection.update_one(
+        {"_id": session_id}, {"$set": {"updated_at": datetime.utcnow() - timedelta(days=365)}}
+    )
+    return session_id
+
+
+async def hot_messages(session_id: str):
+    return await chat_messages_collection.count_documents({"session_id": session_id})
+
+
+def test_archive_and_restore_round_trip():
+    async def scenario():
+        session_id = await inactive_session()
+        assert await chat_store.archive_inactive_sessions(datetime.utcnow() - timedelta(days=90), 10) == 1
+        assert await chat_sessions_collection.count_documents({}) == 0
+        assert await hot_messages(session_id) == 0
+        archived = await chat_archive_collection.find_one({"_id": session_id})
+        assert "pending_since" not in archived and archived["seq"] == 2
+
+        summaries, _ = await chat_store.list_sessions(USER, 10)
+        assert [summary["id"] for summary in summaries] == [session_id]
+
+        session = await chat_store.get_session(USER, session_id)
+        assert session["title"] == "Préavis"
+        messages, _ = await chat_store.get_messages(session_id)
+        assert [message["content"] for message in messages] == [message["content"] for message in MESSAGES]
+        assert await chat_archive_collection.count_documents({}) == 0
+
+    asyncio.run(scenario())
+
+
+def test_session_written_after_it_was_read_stays_hot():
+    async def scenario():
+        session_id = await inactive_session()
+        stale = await chat_sessions_collection.find_one({"_id": session_id})
+        await chat_store.append_messages(USER, session_id, [{"role": "user", "content": "Et en CDD ?"}], [])
+        assert not await chat_store.archive_session(stale)
+        assert await chat_archive_collection.count_documents({}) == 0
+        assert await hot_messages(session_id) == 3
+
+    asyncio.run(scenario())
+
+
+def test_restore_waits_for_a_pending_archive():
+    async def scenario():
+        session_id = await inactive_session()
+        session = await chat_sessions_collection.find_one({"_id": session_id})
+        assert await chat_store.archive_session(session)
+        # As if the archiver had removed the session row but not yet its messages
+        await chat_archive_collection.update_one({"_id": session_id}, {"$set": {"pending_since": datetime.utcnow()}})
+        restore = asyncio.create_task(chat_store.restore_session(USER, session_id))
+        await asyncio.sleep(0.2)
+        assert not restore.done()
+        await chat_archive_collection.update_one({"_id": session_id}, {"$unset": {"pending_since": ""}})
+        assert await restore
+        assert await hot_messages(session_id) == 2
+
+    asyncio.run(scenario())
+
+
+def test_archive_left_pending_by_a_stopped_archiver_is_restored():
+    async def scenario():
+        session_id = await inactive_session()
+        session = await chat_sessions_collection.find_one({"_id": session_id})
+        assert await chat_store.archive_session(session)
+        stopped = datetime.utcnow() - timedelta(seconds=chat_store.ARCHIVE_PENDING_TIMEOUT + 1)
+        await chat_archive_collection.update_one({"_id": session_id}, {"$set": {"pending_since": stopped}})
+        assert await chat_store.restore_session(USER, session_id)
+        assert await hot_messages(session_id) == 2
+
+    asyncio.run(scenario())
+
+
+class ArticleSource:
+    index_version = "v2"
+
+    def get_articles(self, doc_ids):
+        return {doc_id: {"id": doc_id, "text": f"Texte de {doc_id}"} for doc_id in doc_ids}
+
+
+@pytest.fixture
+def article_source():
+    chat_store.set_article_source(ArticleSource())
+    yield
+    chat_store.set_article_source(None)
+
+
+def test_articles_of_another_index_version_are_not_resolved(article_source):
+    current = {"article_ids": ["a"], "index_version": "v2"}
+    older = {"article_ids": ["a"], "index_version": "v1"}
+    chat_store.hydrate_articles([current, older])
+    assert current == {"articles": [{"id": "a", "text": "Texte de a"}]}
+    assert older == {"articles": [{"id": "a", "stale": True}]}
+
+
+def test_follow_ups_do_not_reuse_articles_of_another_index_version(article_source):
+    async def scenario():
+        session_id = await chat_store.create_session(USER, "Préavis", MESSAGES, [{"id": "a"}])
+        assert await chat_store.get_session_article_ids(USER, session_id) == ["a"]
+        await chat_sessions_collection.update_one({"_id": session_id}, {"$set": {"index_version": "v1"}})
+        assert await chat_store.get_session_article_ids(USER, session_id) == []
+
+    asyncio.run(scenario())
+
+
+def test_compaction_round_trip(article_source):
+    from pymongo import UpdateOne
+
+    from app.compact_chat_articles import compact_collection, compaction, db
+
+    articles = [{"id": "a", "text": "Texte de a"}, {"id": "b", "text": "Texte de b"}]
+    sessions = db.chat_sessions
+    sessions.delete_many({})
+    sessions.insert_many([
+        {"_id": "compacted", "articles": [dict(article) for article in articles]},
+        {"_id": "without ids", "articles": [{"text": "Article sans identifiant"}]},
+    ])
+    # (mongomock cannot run the migration's bulk_write with current pymongo, hence the dry run)
+    assert compact_collection(sessions, {"articles": {"$exists": True}}, "v2", dry_run=True) == (1, 1)
+    assert compaction(sessions.find_one({"_id": "without ids"}), "v2") is None
+
+    update = {"$set": {"article_ids": ["a", "b"], "index_version": "v2"}, "$unset": {"articles": ""}}
+    assert compaction(sessions.find_one({"_id": "compacted"}), "v2") == UpdateOne({"_id": "compacted"}, update)
+    sessions.update_one({"_id": "compacted"}, update)
+    stored = sessions.find_one({"_id": "compacted"})
+    assert chat_store.hydrate_articles([stored])[0]["articles"] == articles
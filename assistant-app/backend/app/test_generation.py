@@ -0,0 +1,113 @@
+import io
+import json
+
+import pytest
+
+generation = pytest.importorskip("app.generation")
+
+from app.generation import GeminiBackend, GenerationError
+from app.scheduler import GenerationScheduler, SchedulerOverloaded
+
+
+class Response(generation.requests.Response):
+    closed = False
+
+    def close(self):
+        self.closed = True
+        super().close()
+
+
+def gemini_response(status_code: int, body: bytes, headers: dict = None):
+    response = Response()
+    response.status_code = status_code
+    response.headers.update(headers or {})
+    response.raw = io.BytesIO(body)
+    return response
+
+
+@pytest.fixture
+def gemini(monkeypatch):
+    """A GeminiBackend whose calls get the responses appended to the returned list."""
+    responses, calls = [], []
+
+    def post(url, **kwargs):
+        calls.append(kwargs)
+        return responses.pop(0)
+
+    monkeypatch.setattr(generation.requests, "post", post)
+    monkeypatch.setattr(generation.generation_scheduler, "pause", lambda seconds: None)
+    return GeminiBackend(api_key="test"), responses, calls
+
+
+def test_gemini_call_has_connect_and_read_timeouts(gemini):
+    backend, responses, calls = gemini
+    chunk = {"candidates": [{"content": {"parts": [{"text": "Réponse"}]}}]}
+    responses.append(gemini_response(200, b"data: " + json.dumps(chunk).encode() + b"\n\n"))
+    assert backend.generate("système", "question") == "Réponse"
+    assert calls[0]["timeout"] == (generation.GEMINI_CONNECT_TIMEOUT, generation.GEMINI_READ_TIMEOUT)
+
+
+@pytest.mark.parametrize("status_code, error", [(429, SchedulerOverloaded), (500, GenerationError)])
+def test_failed_gemini_response_is_closed(gemini, status_code, error):
+    backend, responses, _ = gemini
+    response = gemini_response(status_code, b'{"error": {}}', {"Retry-After": "7"})
+    responses.append(response)
+    with pytest.raises(error):
+        backend.generate("système", "question")
+    assert response.closed
+
+
+class Backend(generation.GenerationBackend):
+    """Answers with its name after `delay` seconds, or raises `error`."""
+
+    def __init__(self, name: str, delay: float = 0, error: Exception = None, rate_limited: bool = False):
+        self.name = name
+        self.delay = delay
+        self.error = error
+        self.rate_limited = rate_limited
+        self.calls = 0
+
+    def generate(self, system_prompt: str, prompt: str, legal: bool = True) -> str:
+        self.calls += 1
+        generation.time.sleep(self.delay)
+        if self.error:
+            raise self.error
+        return self.name
+
+
+@pytest.fixture
+def hedge_after(monkeypatch):
+    monkeypatch.setattr(generation, "GENERATION_HEDGE_INITIAL_DELAY", 0.05)
+    scheduler = GenerationScheduler(rate_per_minute=60, burst=1)
+    monkeypatch.setattr(generation, "generation_scheduler", scheduler)
+    return scheduler
+
+
+def test_fallback_answers_when_the_primary_fails(hedge_after):
+    secondary = Backend("secondary")
+    backend = generation.FallbackBackend(Backend("primary", error=GenerationError("down")), secondary)
+    assert backend.generate("système", "question") == "secondary"
+    assert secondary.calls == 1
+
+
+def test_slow_primary_is_hedged_and_the_first_answer_wins(hedge_after):
+    backend = generation.FallbackBackend(Backend("primary", delay=1), Backend("secondary"))
+    assert backend.generate("système", "question") == "secondary"
+
+
+def test_hedge_to_a_rate_limited_backend_only_uses_a_free_token(hedge_after):
+    secondary = Backend("secondary", rate_limited=True)
+    backend = generation.FallbackBackend(Backend("primary", delay=0.2), secondary)
+    assert backend.generate("système", "question") == "secondary"
+    # The only token is spent: the next slow call waits for the primary
+    assert backend.generate("système", "question") == "primary"
+    assert secondary.calls == 1
+
+
+def test_quota_error_is_not_retried_on_a_rate_limited_fallback(hedge_after):
+    quota = SchedulerOverloaded("Gemini quota exceeded, retry later", 60, 429)
+    secondary = Backend("secondary", rate_limited=True)
+    backend = generation.FallbackBackend(Backend("primary", error=quota), secondary, hedge=False)
+    with pytest.raises(SchedulerOverloaded):
+        backend.generate("système", "question")
+    assert secondary.calls == 0
@@ -0,0 +1,36 @@
+import json
+import os
+
+import pytest
+
+pytest.importorskip("pypdf")
+
+from app.ingest_law_code import _folder_sources, compare_articles, extract_document, split_articles
+from app.law_codes import LAW_CODES_DIR
+
+# The documents the ingestion reproduces (the codes and the constitution are out of its scope)
+LAWS = ["loi_09_08_2009", "loi_43_20_2020"]
+
+
+@pytest.fixture(scope="module", params=LAWS)
+def articles(request, tmp_path_factory):
+    folder = os.path.join(LAW_CODES_DIR, request.param)
+    if not os.path.isdir(folder):
+        pytest.skip("knowledge_base/law_codes is not available")
+    pdf_path, json_path = _folder_sources(folder)
+    with open(json_path, encoding="utf-8") as f:
+        expected = json.load(f)
+    pages = extract_document(pdf_path, str(tmp_path_factory.mktemp("pages")), workers=1)
+    return expected, list(split_articles(pages, expected[0]["loi"], "loi"))
+
+
+def test_article_numbers_are_reproduced_in_order(articles):
+    expected, produced = articles
+    assert [article["article_no"] for article in produced] == [article["article_no"] for article in expected]
+
+
+def test_article_texts_are_reproduced(articles):
+    expected, produced = articles
+    report = compare_articles(expected, produced)
+    assert report["mismatches"] == []
+    assert report["found"] == report["text_match"] == 1
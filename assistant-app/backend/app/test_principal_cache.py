@@ -0,0 +1,75 @@
+import asyncio
+import os
+
+import pytest
+
+pytest.importorskip("mongomock_motor")
+os.environ.setdefault("MONGODB_URI", "mongomock://")
+
+from app.auth import utils
+from app.auth.models import UserInDB
+
+EMAIL = "cache@example.com"
+
+
+@pytest.fixture(autouse=True)
+def empty_cache():
+    utils._principal_cache.clear()
+    asyncio.run(utils.users_collection.delete_many({}))
+    yield
+    utils._principal_cache.clear()
+
+
+async def add_user(email: str = EMAIL, full_name: str = "Amina"):
+    user = UserInDB(email=email, full_name=full_name, hashed_password="hash")
+    await utils.users_collection.insert_one(user.dict(by_alias=True))
+
+
+def test_cached_user_is_served_without_a_lookup():
+    async def scenario():
+        await add_user()
+        assert (await utils.get_cached_user(EMAIL)).full_name == "Amina"
+        await utils.users_collection.update_one({"email": EMAIL}, {"$set": {"full_name": "Amina B."}})
+        assert (await utils.get_cached_user(EMAIL)).full_name == "Amina"
+
+    asyncio.run(scenario())
+
+
+def test_cached_user_is_looked_up_again_after_the_ttl(monkeypatch):
+    monkeypatch.setattr(utils, "PRINCIPAL_CACHE_TTL", 0.05)
+
+    async def scenario():
+        await add_user()
+        assert await utils.get_cached_user(EMAIL)
+        await utils.users_collection.delete_many({"email": EMAIL})
+        await asyncio.sleep(0.1)
+        assert await utils.get_cached_user(EMAIL) is None
+        assert EMAIL not in utils._principal_cache
+
+    asyncio.run(scenario())
+
+
+def test_unknown_user_is_not_cached():
+    async def scenario():
+        assert await utils.get_cached_user(EMAIL) is None
+        # Registering right after a failed lookup is seen at once
+        await add_user()
+        assert (await utils.get_cached_user(EMAIL)).email == EMAIL
+
+    asyncio.run(scenario())
+
+
+def test_least_recently_used_user_is_evicted(monkeypatch):
+    monkeypatch.setattr(utils, "PRINCIPAL_CACHE_SIZE", 2)
+
+    async def scenario():
+        emails = ["a@example.com", "b@example.com", "c@example.com"]
+        for email in emails:
+            await add_user(email)
+        await utils.get_cached_user(emails[0])
+        await utils.get_cached_user(emails[1])
+        await utils.get_cached_user(emails[0])
+        await utils.get_cached_user(emails[2])
+        assert list(utils._principal_cache) == [emails[0], emails[2]]
+
+    asyncio.run(scenario())
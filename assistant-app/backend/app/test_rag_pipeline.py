@@ -0,0 +1,32 @@
+import pytest
+
+rag_pipeline = pytest.importorskip("app.rag_pipeline")
+
+PREVIOUS = ["travail-L1234-1", "travail-L1234-5"]
+
+
+@pytest.fixture
+def pipeline():
+    # _is_followup needs none of the indexes
+    return object.__new__(rag_pipeline.RAGPipeline)
+
+
+@pytest.mark.parametrize("question", [
+    "Que prévoit cet article pour les cadres ?",
+    "Ces dispositions s'appliquent-elles aux CDD ?",
+    "Vous avez dit trois mois, est-ce un minimum ?",
+])
+def test_anaphora_is_a_follow_up_whatever_the_ranking(pipeline, question):
+    assert pipeline._is_followup(question, PREVIOUS, ["civil-1240"])
+
+
+@pytest.mark.parametrize("question", [
+    "Pourquoi le bail commercial dure-t-il neuf ans ?",
+    "Et la garde à vue d'un mineur ?",
+    "Alors, quelles sont les conditions du divorce ?",
+    "Expliquez la prescription acquisitive",
+    "Plus de détails sur le permis de construire",
+])
+def test_other_questions_need_the_sparse_ranking(pipeline, question):
+    assert not pipeline._is_followup(question, PREVIOUS, ["civil-1240", "civil-2272"])
+    assert pipeline._is_followup(question, PREVIOUS, ["civil-1240", "travail-L1234-5"])
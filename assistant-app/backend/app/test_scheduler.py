@@ -0,0 +1,104 @@
+import asyncio
+
+import pytest
+
+from app.scheduler import BULK, INTERACTIVE, GenerationScheduler, SchedulerOverloaded, TokenBucket
+
+
+async def served_in_order(scheduler, requests):
+    """Queue (user, priority) requests all at once and return them in the order they got a token."""
+    order = []
+
+    async def request(user_id, priority):
+        await scheduler.acquire(user_id, priority)
+        order.append((user_id, priority))
+
+    await asyncio.gather(*(request(user_id, priority) for user_id, priority in requests))
+    return order
+
+
+def test_users_are_served_round_robin():
+    async def scenario():
+        scheduler = GenerationScheduler(rate_per_minute=6000, burst=1)
+        order = await served_in_order(scheduler, [
+            ("heavy", INTERACTIVE), ("heavy", INTERACTIVE), ("heavy", INTERACTIVE), ("light", INTERACTIVE),
+        ])
+        assert [user_id for user_id, _ in order] == ["heavy", "light", "heavy", "heavy"]
+
+    asyncio.run(scenario())
+
+
+def test_interactive_calls_go_before_bulk_work():
+    async def scenario():
+        scheduler = GenerationScheduler(rate_per_minute=6000, burst=1)
+        order = await served_in_order(scheduler, [("bulk", BULK), ("bulk", BULK), ("user", INTERACTIVE)])
+        assert order == [("user", INTERACTIVE), ("bulk", BULK), ("bulk", BULK)]
+
+    asyncio.run(scenario())
+
+
+async def rejection(scheduler, user_id, priority=INTERACTIVE) -> SchedulerOverloaded:
+    with pytest.raises(SchedulerOverloaded) as excinfo:
+        await scheduler.acquire(user_id, priority)
+    return excinfo.value
+
+
+def test_user_over_their_queue_share_gets_429():
+    async def scenario():
+        scheduler = GenerationScheduler(rate_per_minute=60, burst=1, max_queue_per_user=1)
+        scheduler.pause(2)
+        pending = asyncio.create_task(scheduler.acquire("alice"))
+        await asyncio.sleep(0)
+        error = await rejection(scheduler, "alice")
+        assert error.status_code == 429 and error.retry_after >= 1
+        # Other users are still admitted
+        other = asyncio.create_task(scheduler.acquire("bob"))
+        await asyncio.sleep(0)
+        assert scheduler.depth == 2
+        for task in (pending, other):
+            task.cancel()
+        await asyncio.gather(pending, other, return_exceptions=True)
+        assert scheduler.depth == 0
+
+    asyncio.run(scenario())
+
+
+def test_full_queue_gets_503():
+    async def scenario():
+        scheduler = GenerationScheduler(rate_per_minute=60, burst=1, max_queue=1)
+        scheduler.pause(2)
+        pending = asyncio.create_task(scheduler.acquire("alice"))
+        await asyncio.sleep(0)
+        error = await rejection(scheduler, "bob")
+        assert error.status_code == 503 and error.detail == "Generation queue is full"
+        pending.cancel()
+        await asyncio.gather(pending, return_exceptions=True)
+
+    asyncio.run(scenario())
+
+
+def test_wait_beyond_the_limit_gets_503():
+    async def scenario():
+        scheduler = GenerationScheduler(rate_per_minute=60, burst=1, max_wait=1)
+        scheduler.pause(5)
+        error = await rejection(scheduler, "alice")
+        assert error.status_code == 503 and error.retry_after >= 5
+        assert scheduler.depth == 0
+
+    asyncio.run(scenario())
+
+
+def test_bucket_hands_out_each_token_once_across_threads():
+    import sys
+    from concurrent.futures import ThreadPoolExecutor
+
+    # Switch threads as often as possible to expose unguarded read-modify-writes
+    interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)
+    try:
+        bucket = TokenBucket(rate=1e-6, capacity=20000)
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            taken = list(pool.map(lambda _: bucket.try_acquire() == 0, range(40000)))
+    finally:
+        sys.setswitchinterval(interval)
+    assert sum(taken) == 20000
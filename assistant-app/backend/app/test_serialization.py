@@ -0,0 +1,46 @@
+import asyncio
+import json
+import os
+
+import pytest
+
+pytest.importorskip("orjson")
+
+from app import serialization
+from app.serialization import FastJSONResponse, streamed_json_object
+
+
+def messages(count: int):
+    return [
+        {"role": "user" if seq % 2 == 0 else "assistant", "content": f"Délai de préavis n° {seq} — «ok» ✓ مدونة",
+         "articles": [] if seq % 3 else [{"id": f"travail-{seq}", "code": "Code du Travail"}], "seq": seq}
+        for seq in range(count)
+    ]
+
+
+async def body_of(response) -> bytes:
+    return b"".join([chunk async for chunk in response.body_iterator])
+
+
+@pytest.mark.parametrize("head", [{}, {"id": "s1", "title": "Préavis — durée", "next_cursor": None}])
+@pytest.mark.parametrize("count", [0, 1, serialization.STREAM_CHUNK_ITEMS, 2 * serialization.STREAM_CHUNK_ITEMS + 1])
+def test_streamed_object_equals_the_buffered_response(head, count):
+    items = messages(count)
+    streamed = asyncio.run(body_of(streamed_json_object(head, "messages", iter(items))))
+    buffered = FastJSONResponse({**head, "messages": items}).body
+    assert json.loads(streamed) == json.loads(buffered) == {**head, "messages": items}
+    assert streamed == buffered
+
+
+def test_history_page_is_the_same_streamed_or_not(monkeypatch):
+    pytest.importorskip("mongomock_motor")
+    os.environ.setdefault("MONGODB_URI", "mongomock://")
+    from app.auth import chat_history
+
+    head = {"id": "s1", "title": "Préavis", "created_at": "2026-10-19T00:00:00", "next_cursor": 12}
+    stored = [{**message, "session_id": "s1"} for message in messages(12)]
+    buffered = chat_history._messages_response(head, stored)
+    monkeypatch.setattr(chat_history, "HISTORY_STREAM_MIN_MESSAGES", 1)
+    streamed = chat_history._messages_response(head, stored)
+    assert isinstance(streamed, serialization.StreamingResponse)
+    assert asyncio.run(body_of(streamed)) == buffered.body
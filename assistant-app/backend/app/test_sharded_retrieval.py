@@ -0,0 +1,60 @@
+import pickle
+from types import SimpleNamespace
+
+import pytest
+
+rank_bm25 = pytest.importorskip("rank_bm25")
+
+from app.sharded_retrieval import ShardPool, _search_sparse, build_shards
+
+# (code, tokens): documents of three codes, with uneven lengths and shared terms
+DOCUMENTS = [
+    ("Code du Travail", "contrat travail preavis licenciement salarie"),
+    ("Code du Travail", "salarie conge annuel paye duree travail effectif"),
+    ("Code du Travail", "licenciement faute grave salarie indemnite"),
+    ("Code de la Famille", "mariage contrat consentement epoux"),
+    ("Code de la Famille", "divorce garde enfant pension epoux epouse"),
+    ("Code Penal", "peine amende emprisonnement infraction"),
+    ("Code Penal", "vol peine emprisonnement amende recidive infraction grave"),
+    ("Code Penal", "faute"),
+]
+QUERIES = [
+    "licenciement faute grave".split(),
+    "contrat epoux".split(),
+    "peine amende amende".split(),
+    "salarie inconnu".split(),
+]
+
+
+@pytest.fixture(scope="module")
+def corpus(tmp_path_factory):
+    tmp = tmp_path_factory.mktemp("retrieval")
+    doc_ids = [f"doc-{i}" for i in range(len(DOCUMENTS))]
+    tokenized = [text.split() for _, text in DOCUMENTS]
+    bm25 = rank_bm25.BM25Plus(tokenized)
+    with open(tmp / "bm25_plus.pkl", "wb") as f:
+        pickle.dump({"bm25": bm25, "doc_ids": doc_ids}, f)
+    with open(tmp / "corpus_lookup.pkl", "wb") as f:
+        pickle.dump({
+            "doc_ids": doc_ids,
+            "documents": [SimpleNamespace(metadata={"code": code}) for code, _ in DOCUMENTS],
+        }, f)
+    build_shards(str(tmp / "shards"), str(tmp / "bm25_plus.pkl"), str(tmp / "corpus_lookup.pkl"))
+    pool = ShardPool(str(tmp / "shards"), workers=2)
+    yield bm25, doc_ids, pool
+    pool.close()
+
+
+def test_scatter_gather_equals_a_single_bm25plus_index(corpus):
+    bm25, doc_ids, pool = corpus
+    assert len(pool.manifest["shards"]) == 3
+    top_k = 4
+    idf = {token: pool.idf[token] for query in QUERIES for token in query if token in pool.idf}
+    sharded = pool.scatter(_search_sparse, QUERIES, idf, top_k=top_k)
+    for query, hits in zip(QUERIES, sharded):
+        scores = dict(zip(doc_ids, bm25.get_scores(query)))
+        # Same global idf (and BM25+ delta on every document), hence the same scores...
+        assert [score for _, score in hits] == pytest.approx([scores[doc_id] for doc_id, _ in hits])
+        # ...and the same top-k (documents with equal scores may come in either order)
+        assert [score for _, score in hits] == pytest.approx(sorted(scores.values(), reverse=True)[:top_k])
+        assert len({doc_id for doc_id, _ in hits}) == top_k
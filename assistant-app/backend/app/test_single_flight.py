@@ -0,0 +1,98 @@
+import asyncio
+
+import pytest
+
+from app.cancellation import RequestCancelled, check_cancelled
+from app.single_flight import SingleFlight, question_key
+
+
+async def slow_double(value, calls, delay=0.05):
+    calls.append(value)
+    for _ in range(10):
+        await asyncio.sleep(delay / 10)
+        check_cancelled()
+    return value * 2
+
+
+def test_question_key_ignores_case_spacing_and_punctuation():
+    assert question_key("Quel est  l'Article 5 ?", "v1") == question_key("quel est l'article 5", "v1")
+    assert question_key("article 5", "v1") != question_key("article 5", "v2")
+    assert question_key("article 5", "v1", ["a"]) != question_key("article 5", "v1")
+
+
+def test_concurrent_callers_share_one_execution():
+    async def scenario():
+        flights, calls = SingleFlight(), []
+        first, joined_first = flights.join("k", slow_double, 21, calls)
+        second, joined_second = flights.join("k", slow_double, 21, calls)
+        assert (joined_first, joined_second) == (False, True)
+        assert first is second
+        assert await first.wait() == await second.wait() == 42
+        assert calls == [21]
+        # Nothing is cached once the flight has landed
+        third, joined_third = flights.join("k", slow_double, 21, calls)
+        assert not joined_third
+        await third.wait()
+        assert calls == [21, 21]
+
+    asyncio.run(scenario())
+
+
+def test_none_key_is_never_shared():
+    async def scenario():
+        flights, calls = SingleFlight(), []
+        first, _ = flights.join(None, slow_double, 1, calls)
+        second, joined = flights.join(None, slow_double, 1, calls)
+        assert not joined and first is not second
+        await asyncio.gather(first.wait(), second.wait())
+        assert calls == [1, 1]
+
+    asyncio.run(scenario())
+
+
+def test_execution_is_cancelled_only_when_every_subscriber_left():
+    async def scenario():
+        flights, calls = SingleFlight(), []
+        flight, _ = flights.join("k", slow_double, 1, calls)
+        flights.join("k", slow_double, 1, calls)
+        flight.leave()
+        await asyncio.sleep(0.02)
+        assert not flight.task.done()
+        flight.leave()
+        with pytest.raises(RequestCancelled):
+            await flight.task
+
+    asyncio.run(scenario())
+
+
+def test_subscriber_leaving_before_the_task_starts():
+    async def scenario():
+        flights, calls = SingleFlight(), []
+        flight, _ = flights.join("k", slow_double, 1, calls)
+        # The flight's task has not run a single step yet
+        flight.leave()
+        with pytest.raises(RequestCancelled):
+            await flight.task
+        assert calls == []
+
+    asyncio.run(scenario())
+
+
+def test_question_asked_again_after_everybody_left_starts_a_new_flight():
+    async def scenario():
+        flights, calls = SingleFlight(), []
+        abandoned, _ = flights.join("k", slow_double, 21, calls)
+        await asyncio.sleep(0.01)
+        abandoned.leave()
+        # The abandoned flight has not landed yet
+        assert not abandoned.task.done()
+        fresh, joined = flights.join("k", slow_double, 21, calls)
+        assert not joined and fresh is not abandoned
+        with pytest.raises(RequestCancelled):
+            await abandoned.task
+        # The abandoned flight landing does not evict its replacement
+        again, joined = flights.join("k", slow_double, 21, calls)
+        assert joined and again is fresh
+        assert await fresh.wait() == 42
+
+    asyncio.run(scenario())
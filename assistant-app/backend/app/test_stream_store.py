@@ -0,0 +1,109 @@
+import asyncio
+
+import pytest
+
+stream_store = pytest.importorskip("app.stream_store")
+
+from app.stream_store import ReplayStream, StreamReplayStore, parse_last_event_id
+
+
+@pytest.mark.parametrize("value, expected", [
+    ("0123abcd:7", ("0123abcd", 7)),
+    ("7", (None, 7)),
+    (" 0123abcd:0 ", ("0123abcd", 0)),
+    ("0123abcd:x", (None, -1)),
+    ("", (None, -1)),
+    (None, (None, -1)),
+])
+def test_parse_last_event_id(value, expected):
+    assert parse_last_event_id(value) == expected
+
+
+async def read_all(stream: ReplayStream, last_seq: int = -1) -> bytes:
+    return b"".join([chunk async for chunk in stream.follow(last_seq)])
+
+
+def test_reconnecting_client_gets_the_events_it_missed():
+    async def scenario():
+        stream = ReplayStream("alice")
+        for token in ("Le", " délai", " est"):
+            stream.append({"type": "token", "token": token})
+        stream.finish()
+        assert await read_all(stream) == b"".join(stream.format_event(seq) for seq in range(3))
+        # Resuming after the first event replays the other two only
+        resumed = await read_all(stream, last_seq=0)
+        assert resumed == stream.format_event(1) + stream.format_event(2)
+        assert resumed.startswith(b"id: %s:1\n" % stream.id.encode())
+
+    asyncio.run(scenario())
+
+
+def test_follower_receives_events_appended_while_it_waits():
+    async def scenario():
+        stream = ReplayStream("alice")
+        reader = asyncio.create_task(read_all(stream))
+        await asyncio.sleep(0)
+        stream.append({"type": "token", "token": "a"})
+        await asyncio.sleep(0)
+        stream.append({"type": "done"})
+        stream.finish()
+        assert (await reader).count(b"data: ") == 2
+
+    asyncio.run(scenario())
+
+
+def test_stream_without_followers_is_abandoned_once(monkeypatch):
+    monkeypatch.setattr(stream_store, "STREAM_ABANDON_GRACE", 0.01)
+
+    async def scenario():
+        stream = ReplayStream("alice")
+        abandoned = []
+        stream.on_abandoned = lambda: abandoned.append(stream.id)
+        stream.append({"type": "token", "token": "a"})
+        for _ in range(2):
+            # The client disconnects after the first event, twice
+            follower = stream.follow()
+            await follower.__anext__()
+            await follower.aclose()
+            await asyncio.sleep(0.05)
+        assert abandoned == [stream.id]
+
+    asyncio.run(scenario())
+
+
+def test_client_reconnecting_within_the_grace_period_keeps_the_stream(monkeypatch):
+    monkeypatch.setattr(stream_store, "STREAM_ABANDON_GRACE", 0.05)
+
+    async def scenario():
+        stream = ReplayStream("alice")
+        abandoned = []
+        stream.on_abandoned = lambda: abandoned.append(stream.id)
+        stream.append({"type": "token", "token": "a"})
+        follower = stream.follow()
+        await follower.__anext__()
+        await follower.aclose()
+        reconnected = asyncio.create_task(read_all(stream, last_seq=0))
+        await asyncio.sleep(0.1)
+        stream.finish()
+        await reconnected
+        assert abandoned == []
+
+    asyncio.run(scenario())
+
+
+def test_store_only_returns_the_owners_unexpired_streams():
+    async def scenario():
+        store = StreamReplayStore(ttl=0, max_streams=2)
+        stream = store.create("alice")
+        assert store.get(stream.id, "alice") is stream
+        assert store.get(stream.id, "bob") is None
+        # Unfinished streams never expire; finished ones go after the TTL
+        stream.finish()
+        await asyncio.sleep(0.01)
+        assert store.get(stream.id, "alice") is None
+        # The oldest stream makes room for new ones
+        first, _, third = (store.create("alice") for _ in range(3))
+        assert store.get(first.id, "alice") is None
+        assert store.get(third.id, "alice") is third
+
+    asyncio.run(scenario())
@@ -0,0 +1,24 @@
+from functools import lru_cache
+
+from nltk.tokenize import word_tokenize
+from nltk.corpus import stopwords
+
+
+@lru_cache(maxsize=None)
+def stopword_set(language='french'):
+    return frozenset(stopwords.words(language))
+
+
+def preprocess_text(text, language='french'):
+    """Preprocess text for sparse retrieval"""
+    # Lowercase
+    text = text.lower()
+
+    # Tokenize
+    tokens = word_tokenize(text, language=language)
+
+    # Remove stopwords and punctuation (the stopword list is read once per language)
+    french_stopwords = stopword_set(language)
+    tokens = [token for token in tokens if token.isalnum() and token not in french_stopwords]
+
+    return tokens
@@ -0,0 +1,147 @@
+"""
+Answer-quality metrics of Notebooks/Finetuning&model_evaluation.ipynb.
+
+The lexical metrics (ROUGE, BLEU, word F1, faithfulness, citations) are
+plain functions of one example so that they can run in a process pool;
+BERTScore is computed separately in batches because it loads a model.
+"""
+import re
+from typing import Dict, List
+
+import nltk
+from nltk.translate.bleu_score import SmoothingFunction, sentence_bleu
+from rouge_score import rouge_scorer
+
+CITATION_PATTERNS = [
+    r"article \d+",
+    r"art\. \d+",
+    r"l'article \d+",
+    r"articles? \d+[-,\s]",
+    r"code [a-z]+",
+]
+
+# Thresholds of classify_response_quality in the notebook
+QUALITY_THRESHOLDS = {
+    "High": {"rougeL_fmeasure": 0.5, "faithfulness": 0.7, "word_f1": 0.4},
+    "Medium": {"rougeL_fmeasure": 0.3, "faithfulness": 0.5, "word_f1": 0.25},
+}
+
+BERT_SCORE_LANG = "fr"
+
+_scorer = None
+
+
+def ensure_nltk_data():
+    for resource in ("punkt", "punkt_tab"):
+        nltk.download(resource, quiet=True)
+
+
+def calculate_bleu(reference: str, candidate: str) -> float:
+    reference_tokens = nltk.word_tokenize(reference.lower())
+    candidate_tokens = nltk.word_tokenize(candidate.lower())
+    try:
+        return sentence_bleu([reference_tokens], candidate_tokens, smoothing_function=SmoothingFunction().method1)
+    except Exception as e:
+        print(f"Error calculating BLEU: {e}")
+        return 0.0
+
+
+def calculate_word_f1(reference: str, candidate: str) -> Dict[str, float]:
+    reference_words = set(nltk.word_tokenize(reference.lower()))
+    candidate_words = set(nltk.word_tokenize(candidate.lower()))
+    common = len(reference_words & candidate_words)
+    precision = common / len(candidate_words) if candidate_words else 0.0
+    recall = common / len(reference_words) if reference_words else 0.0
+    f1 = 2 * precision * recall / (precision + recall) if precision + recall else 0.0
+    return {"precision": precision, "recall": recall, "f1": f1}
+
+
+def estimate_faithfulness(response: str, context: str) -> float:
+    """Share of response sentences sharing more than 3 words with the context."""
+    response_sents = nltk.sent_tokenize(response.lower())
+    context_words = set()
+    for sent in nltk.sent_tokenize(context.lower()):
+        context_words.update(nltk.word_tokenize(sent))
+
+    supported = sum(1 for sent in response_sents if len(set(nltk.word_tokenize(sent)) & context_words) > 3)
+    return supported / len(response_sents) if response_sents else 0.0
+
+
+def count_citations(response: str) -> int:
+    return sum(len(re.findall(pattern, response.lower())) for pattern in CITATION_PATTERNS)
+
+
+def lexical_metrics(example: Dict) -> Dict:
+    """Every metric except BERTScore for one example (runs in worker processes)."""
+    global _scorer
+    if _scorer is None:
+        _scorer = rouge_scorer.RougeScorer(["rouge1", "rouge2", "rougeL"], use_stemmer=True)
+
+    reference, response, context = example["reference"], example["response"], example["context"]
+    rouge = _scorer.score(reference, response)
+    word_f1 = calculate_word_f1(reference, response)
+    citation_count = count_citations(response)
+
+    metrics = {}
+    for name in ("rouge1", "rouge2", "rougeL"):
+        metrics[f"{name}_precision"] = rouge[name].precision
+        metrics[f"{name}_recall"] = rouge[name].recall
+        metrics[f"{name}_fmeasure"] = rouge[name].fmeasure
+    metrics.update({
+        "bleu": calculate_bleu(reference, response),
+        "word_f1_precision": word_f1["precision"],
+        "word_f1_recall": word_f1["recall"],
+        "word_f1": word_f1["f1"],
+        "faithfulness": estimate_faithfulness(response, context),
+        "has_citations": int(citation_count > 0),
+        "citation_count": citation_count,
+    })
+    return metrics
+
+
+def classify_quality(metrics: Dict) -> str:
+    for quality, thresholds in QUALITY_THRESHOLDS.items():
+        if all(metrics[name] >= value for name, value in thresholds.items()):
+            return quality
+    return "Low"
+
+
+def bert_scores(candidates: List[str], references: List[str], batch_size: int = 32) -> List[float]:
+    """Baseline-rescaled BERTScore F1 of each candidate, computed in batches."""
+    from bert_score import score
+
+    _, _, f1 = score(
+        candidates, references, lang=BERT_SCORE_LANG,
+        rescale_with_baseline=True, batch_size=batch_size, verbose=False,
+    )
+    return f1.tolist()
+
+
+def summarize(rows: List[Dict]) -> Dict[str, float]:
+    """The summary_stats.json of the notebook, computed from per-example rows."""
+    n = len(rows)
+    if not n:
+        return {}
+
+    def mean(name):
+        return sum(float(row[name]) for row in rows) / n
+
+    def share(quality):
+        return sum(1 for row in rows if row["quality_class"] == quality) / n * 100
+
+    return {
+        "rouge1_f1": mean("rouge1_fmeasure"),
+        "rouge2_f1": mean("rouge2_fmeasure"),
+        "rougeL_f1": mean("rougeL_fmeasure"),
+        "bleu": mean("bleu"),
+        "bert_score": mean("bert_score"),
+        "word_f1": mean("word_f1"),
+        "faithfulness": mean("faithfulness"),
+        "citations_percentage": mean("has_citations") * 100,
+        "avg_citation_count": mean("citation_count"),
+        "avg_gen_time": mean("generation_time"),
+        "avg_tokens": mean("response_tokens"),
+        "high_quality_percentage": share("High"),
+        "medium_quality_percentage": share("Medium"),
+        "low_quality_percentage": share("Low"),
+    }
@@ -0,0 +1,213 @@
+"""
+Generation-quality evaluation of the RAG pipelines.
+
+Drives GeminiLegalRAGPipeline (or the local vLLM LegalRAGPipeline) over a
+question/reference set and scores the answers with the metrics of
+Notebooks/final-results/generation2. Generation runs with bounded
+concurrency, the lexical metrics in a process pool and BERTScore in
+batches. Every generated answer and every scored example is appended to a
+checkpoint in --out-dir, so an interrupted run resumes where it stopped.
+
+    python -m benchmarks.generation.run --out-dir eval/gemini --concurrency 4
+    python -m benchmarks.generation.run --pipeline local --limit 50 --out-dir eval/qwen
+
+Run it from the directory the API is started from so that the pipeline
+finds its indexes. The output directory ends up with
+model_evaluation_results.csv and summary_stats.json in the notebook format.
+"""
+import argparse
+import csv
+import json
+import os
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+
+from app.scheduler import SchedulerOverloaded
+
+from .metrics import bert_scores, classify_quality, ensure_nltk_data, lexical_metrics, summarize
+
+DEFAULT_DATASET = os.path.join(
+    os.path.dirname(__file__), "..", "..", "..", "..",
+    "Notebooks", "final-results", "generation2", "model_evaluation_results.csv",
+)
+GENERATIONS_FILE = "generations.jsonl"
+SCORES_FILE = "scores.jsonl"
+MAX_ATTEMPTS = 5
+
+RESULT_COLUMNS = [
+    "example_id", "question", "reference", "response", "context", "code",
+    "generation_time", "response_tokens", "quality_class",
+    "rouge1_precision", "rouge1_recall", "rouge1_fmeasure",
+    "rouge2_precision", "rouge2_recall", "rouge2_fmeasure",
+    "rougeL_precision", "rougeL_recall", "rougeL_fmeasure",
+    "bleu", "bert_score", "word_f1_precision", "word_f1_recall", "word_f1",
+    "faithfulness", "has_citations", "citation_count",
+]
+
+
+def load_dataset(path: str):
+    """Read question/reference pairs from a CSV (notebook results) or JSON/JSONL (eval_legal_data) file."""
+    if path.endswith(".csv"):
+        with open(path, newline="", encoding="utf-8") as f:
+            rows = list(csv.DictReader(f))
+    elif path.endswith(".jsonl"):
+        with open(path, encoding="utf-8") as f:
+            rows = [json.loads(line) for line in f if line.strip()]
+    else:
+        with open(path, encoding="utf-8") as f:
+            rows = json.load(f)
+
+    return [{
+        "example_id": str(row.get("example_id", i)),
+        "question": row["question"],
+        "reference": row.get("reference") or row["answer"],
+        "code": row.get("code", ""),
+    } for i, row in enumerate(rows)]
+
+
+def read_checkpoint(path: str):
+    if not os.path.exists(path):
+        return {}
+    records = {}
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            # A line cut short by an interruption is simply redone
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            records[record["example_id"]] = record
+    return records
+
+
+def append_checkpoint(f, record):
+    f.write(json.dumps(record, ensure_ascii=False) + "\n")
+    f.flush()
+    os.fsync(f.fileno())
+
+
+def load_pipeline(name: str):
+    if name == "local":
+        from app.pipeline import LegalRAGPipeline
+        return LegalRAGPipeline()
+    from app.gemini_pipeline import GeminiLegalRAGPipeline
+    return GeminiLegalRAGPipeline()
+
+
+def count_tokens(pipeline, text: str) -> int:
+    # The local pipeline has the model's tokenizer; Gemini answers are counted in words
+    tokenizer = getattr(pipeline, "tokenizer", None)
+    return len(tokenizer.encode(text)) if tokenizer else len(text.split())
+
+
+def generate(pipeline, example):
+    for attempt in range(MAX_ATTEMPTS):
+        start = time.perf_counter()
+        try:
+            response, documents, _ = pipeline.answer_question(example["question"])
+        except SchedulerOverloaded as e:
+            if attempt == MAX_ATTEMPTS - 1:
+                raise
+            time.sleep(e.retry_after)
+            continue
+        generation_time = time.perf_counter() - start
+        return {
+            **example,
+            "response": response,
+            "context": pipeline.format_context(documents) if documents else "",
+            "generation_time": generation_time,
+            "response_tokens": count_tokens(pipeline, response),
+        }
+
+
+def run_generation(pipeline, examples, path: str, concurrency: int):
+    done = read_checkpoint(path)
+    pending = [example for example in examples if example["example_id"] not in done]
+    print(f"Generation: {len(done)} checkpointed, {len(pending)} to go (concurrency {concurrency})")
+
+    with open(path, "a", encoding="utf-8") as f, ThreadPoolExecutor(max_workers=concurrency) as executor:
+        futures = {executor.submit(generate, pipeline, example): example for example in pending}
+        for i, future in enumerate(as_completed(futures), start=1):
+            example = futures[future]
+            try:
+                record = future.result()
+            except Exception as e:
+                # Left out of the checkpoint so that the next run retries it
+                print(f"Error generating example {example['example_id']}: {e}")
+                continue
+            append_checkpoint(f, record)
+            done[record["example_id"]] = record
+            if i % 10 == 0:
+                print(f"  generated {i}/{len(pending)}")
+    return done
+
+
+def run_scoring(generations, path: str, workers: int, batch_size: int):
+    done = read_checkpoint(path)
+    pending = [record for example_id, record in generations.items() if example_id not in done]
+    print(f"Scoring: {len(done)} checkpointed, {len(pending)} to go")
+    if not pending:
+        return done
+
+    ensure_nltk_data()
+    with open(path, "a", encoding="utf-8") as f, ProcessPoolExecutor(max_workers=workers) as pool:
+        for start in range(0, len(pending), batch_size):
+            batch = pending[start:start + batch_size]
+            # Lexical metrics run in the pool while BERTScore scores the same batch
+            lexical = pool.map(lexical_metrics, batch, chunksize=4)
+            semantic = bert_scores([r["response"] for r in batch], [r["reference"] for r in batch], batch_size)
+            for record, metrics, bert in zip(batch, lexical, semantic):
+                scored = {**record, **metrics, "bert_score": bert}
+                scored["quality_class"] = classify_quality(scored)
+                append_checkpoint(f, scored)
+                done[scored["example_id"]] = scored
+            print(f"  scored {min(start + batch_size, len(pending))}/{len(pending)}")
+    return done
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generation-quality evaluation with checkpointing")
+    parser.add_argument("--pipeline", choices=("gemini", "local"), default="gemini")
+    parser.add_argument("--dataset", default=DEFAULT_DATASET, help="CSV, JSON or JSONL with question and reference/answer")
+    parser.add_argument("--out-dir", required=True, help="Checkpoints and results are written here")
+    parser.add_argument("--limit", type=int, help="Evaluate a random sample of this many examples")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--concurrency", type=int, default=4, help="Concurrent generations")
+    parser.add_argument("--workers", type=int, help="Metric worker processes (default: CPU count)")
+    parser.add_argument("--batch-size", type=int, default=32, help="Examples per BERTScore batch")
+    args = parser.parse_args()
+
+    examples = load_dataset(args.dataset)
+    if args.limit and args.limit < len(examples):
+        examples = random.Random(args.seed).sample(examples, args.limit)
+    os.makedirs(args.out_dir, exist_ok=True)
+
+    generations = read_checkpoint(os.path.join(args.out_dir, GENERATIONS_FILE))
+    if any(example["example_id"] not in generations for example in examples):
+        pipeline = load_pipeline(args.pipeline)
+        # The vLLM engine serves one generate call at a time
+        concurrency = 1 if args.pipeline == "local" else args.concurrency
+        generations = run_generation(pipeline, examples, os.path.join(args.out_dir, GENERATIONS_FILE), concurrency)
+
+    wanted = {example["example_id"] for example in examples}
+    generations = {example_id: record for example_id, record in generations.items() if example_id in wanted}
+    scores = run_scoring(generations, os.path.join(args.out_dir, SCORES_FILE), args.workers, args.batch_size)
+
+    rows = [scores[example["example_id"]] for example in examples if example["example_id"] in scores]
+    with open(os.path.join(args.out_dir, "model_evaluation_results.csv"), "w", newline="", encoding="utf-8") as f:
+        writer = csv.DictWriter(f, fieldnames=RESULT_COLUMNS, extrasaction="ignore")
+        writer.writeheader()
+        writer.writerows(rows)
+
+    summary = summarize(rows)
+    with open(os.path.join(args.out_dir, "summary_stats.json"), "w") as f:
+        json.dump(summary, f, indent=2)
+
+    print(f"Evaluated {len(rows)}/{len(examples)} examples")
+    for name, value in summary.items():
+        print(f"  {name}: {value:.4f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,111 @@
+"""
+Compare the cost of serializing a large chat history and SSE events.
+
+A synthetic session with thousands of messages (each assistant answer
+citing a few articles) is encoded the way FastAPI did before (response_model
+validation, jsonable_encoder, json.dumps), with the fast path of
+app/serialization.py, and streamed in chunks. The SSE part encodes one event
+per token with json.dumps and with the fast encoder.
+
+Run from the backend directory:
+
+    python -m benchmarks.history_serialization --messages 5000
+"""
+import argparse
+import json
+import statistics
+import time
+from datetime import datetime
+
+from fastapi.encoders import jsonable_encoder
+
+from app.auth.chat_history import ChatSession, _message_out
+from app.serialization import _iter_object, dumps
+
+ARTICLE_TEXT = (
+    "Le contrat de travail à durée indéterminée peut être rompu à l'initiative de l'employeur "
+    "ou du salarié, dans les conditions prévues par les dispositions du présent titre. "
+) * 6
+
+
+def make_session(messages: int, articles_per_answer: int) -> dict:
+    """A hydrated session as chat_history reads it from the store."""
+    items = []
+    for seq in range(1, messages + 1):
+        message = {"seq": seq, "date": datetime.utcnow(), "role": "user", "content": f"Question numéro {seq} ?"}
+        if seq % 2 == 0:
+            message["role"] = "assistant"
+            message["content"] = "Selon le Code du travail, la réponse est la suivante. " * 8
+            message["articles"] = [
+                {"id": f"travail-{seq}-{i}", "article": f"L.{seq}-{i}", "code": "Code du travail", "text": ARTICLE_TEXT}
+                for i in range(articles_per_answer)
+            ]
+            message["index_version"] = "0123456789ab"
+        items.append(message)
+    head = {"id": "6650f0c2a1b2c3d4e5f60718", "title": "Rupture du contrat", "date": datetime.utcnow(),
+            "articles": items[-1].get("articles", []), "next_cursor": None}
+    return {"head": head, "messages": items}
+
+
+def validated(session: dict) -> bytes:
+    # What FastAPI does for a response_model: validate, jsonable_encoder, json.dumps
+    model = ChatSession(**session["head"], messages=session["messages"])
+    return json.dumps(jsonable_encoder(model), ensure_ascii=False, separators=(",", ":")).encode()
+
+
+def fast(session: dict) -> bytes:
+    return dumps({**session["head"], "messages": [_message_out(m) for m in session["messages"]]})
+
+
+def streamed(session: dict) -> bytes:
+    return b"".join(_iter_object(session["head"], "messages", map(_message_out, session["messages"])))
+
+
+def first_chunk(session: dict) -> bytes:
+    chunks = _iter_object(session["head"], "messages", map(_message_out, session["messages"]))
+    next(chunks)
+    return next(chunks)
+
+
+def measure(fn, arg, repeats: int) -> dict:
+    durations, size = [], 0
+    for _ in range(repeats):
+        start = time.perf_counter()
+        size = len(fn(arg))
+        durations.append(time.perf_counter() - start)
+    return {"median_ms": statistics.median(durations) * 1000, "min_ms": min(durations) * 1000, "bytes": size}
+
+
+def sse_events(tokens: int):
+    return [{"type": "token", "token": "é"} for _ in range(tokens)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Chat history and SSE serialization cost")
+    parser.add_argument("--messages", type=int, default=5000, help="Messages in the session")
+    parser.add_argument("--articles", type=int, default=5, help="Articles cited per answer")
+    parser.add_argument("--tokens", type=int, default=2000, help="SSE token events")
+    parser.add_argument("--repeats", type=int, default=5)
+    args = parser.parse_args()
+
+    session = make_session(args.messages, args.articles)
+    print(f"{args.messages} messages, {args.articles} articles per answer, {args.repeats} repeats")
+    print(f"{'path':<22} {'median ms':>10} {'min ms':>9} {'MB':>7}")
+    for name, fn in (
+        ("validated (before)", validated),
+        ("fast", fast),
+        ("streamed", streamed),
+        ("streamed first chunk", first_chunk),
+    ):
+        result = measure(fn, session, args.repeats)
+        print(f"{name:<22} {result['median_ms']:>10.1f} {result['min_ms']:>9.1f} {result['bytes'] / 1e6:>7.2f}")
+
+    events = sse_events(args.tokens)
+    print(f"\n{args.tokens} SSE token events")
+    for name, encode in (("json.dumps (before)", json.dumps), ("fast", dumps)):
+        result = measure(lambda items: [encode(item) for item in items], events, args.repeats)
+        print(f"{name:<22} {result['median_ms']:>10.1f} {result['min_ms']:>9.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,325 @@
+"""
+Asyncio load generator for the JuriDOC API.
+
+By default it starts the stub Gemini server and the API (in-memory Mongo,
+optional stub retrieval) as subprocesses, then drives each scenario with a
+fixed number of concurrent clients for a fixed duration and reports
+throughput and latency percentiles. While a scenario runs, a probe polls
+/health and the server's event-loop lag histogram is sampled, which shows
+how much the scenario blocks every other request. The report is also
+written as JSON so that it can be diffed against a previous baseline:
+
+    python -m benchmarks.loadtest.run --stub-retrieval --out baseline.json
+    python -m benchmarks.loadtest.run --stub-retrieval --compare baseline.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import time
+
+import httpx
+
+BACKEND_DIR = os.path.join(os.path.dirname(__file__), "..", "..")
+SCENARIOS = ("ask", "ask_stream", "token", "history", "session", "retrieve", "retrieve_batch")
+# Queries per /retrieve/batch request
+RETRIEVE_BATCH_SIZE = 8
+PASSWORD = "loadtest-password"
+# /health is polled this often during each scenario
+PROBE_INTERVAL = 0.05
+LAG_METRIC = "juridoc_event_loop_lag_seconds"
+# Event-loop stalls longer than this count as blocking
+LAG_THRESHOLD_BUCKET = '0.1'
+
+QUESTIONS = [
+    "Quelles sont les conditions pour obtenir un divorce au Maroc ?",
+    "Un employeur peut-il licencier un salarié pendant son congé de maternité ?",
+    "Quelle est la durée légale du travail hebdomadaire selon le Code du Travail ?",
+    "Quelles sont les sanctions prévues pour le vol dans le Code Pénal ?",
+    "Quelles sont les obligations du commerçant en matière de registre de commerce ?",
+    "Quel est l'âge minimum pour travailler au Maroc ?",
+    "Comment est calculée l'indemnité de licenciement ?",
+    "Quels droits la Constitution garantit-elle en matière de liberté d'expression ?",
+    "Quelles sont les conditions de validité d'un contrat ?",
+    "La garde des enfants revient-elle à la mère après un divorce ?",
+]
+
+
+def percentile(values, p):
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def summarize(name, latencies, first_bytes, errors, seconds):
+    summary = {
+        "requests": len(latencies) + sum(errors.values()),
+        "ok": len(latencies),
+        "errors": errors,
+        "throughput_rps": len(latencies) / seconds if seconds else 0.0,
+    }
+    for p in (50, 95, 99):
+        value = percentile(latencies, p)
+        summary[f"p{p}_ms"] = value * 1000 if value is not None else None
+    if first_bytes:
+        for p in (50, 95, 99):
+            summary[f"ttfb_p{p}_ms"] = percentile(first_bytes, p) * 1000
+    return summary
+
+
+class LoadClient:
+    """One simulated user with its own token and chat session."""
+
+    def __init__(self, http: httpx.AsyncClient, index: int, seed: int):
+        self.http = http
+        self.email = f"loadtest-{index}@example.com"
+        self.rng = random.Random(seed + index)
+        self.token = None
+        self.chat_id = None
+
+    @property
+    def headers(self):
+        return {"Authorization": f"Bearer {self.token}"}
+
+    async def setup(self):
+        await self.http.post("/auth/register", json={
+            "email": self.email, "full_name": "Load Test", "password": PASSWORD,
+        })
+        response = await self.http.post("/auth/token", data={"username": self.email, "password": PASSWORD})
+        response.raise_for_status()
+        self.token = response.json()["access_token"]
+        # Seed one session so that the history scenarios have something to read
+        response = await self.http.post("/ask", json={"question": QUESTIONS[0]}, headers=self.headers)
+        response.raise_for_status()
+        self.chat_id = response.json()["chat_id"]
+
+    async def ask(self):
+        response = await self.http.post(
+            "/ask", json={"question": self.rng.choice(QUESTIONS), "chat_id": self.chat_id},
+            headers=self.headers,
+        )
+        return response.status_code, None
+
+    async def ask_stream(self):
+        start = time.perf_counter()
+        first_byte = None
+        async with self.http.stream(
+            "POST", "/ask", json={"question": self.rng.choice(QUESTIONS), "stream": True},
+            headers=self.headers,
+        ) as response:
+            async for _ in response.aiter_bytes():
+                if first_byte is None:
+                    first_byte = time.perf_counter() - start
+        return response.status_code, first_byte
+
+    async def retrieve(self):
+        response = await self.http.post(
+            "/retrieve", json={"query": self.rng.choice(QUESTIONS)}, headers=self.headers,
+        )
+        return response.status_code, None
+
+    async def retrieve_batch(self):
+        response = await self.http.post(
+            "/retrieve/batch", json={"queries": self.rng.sample(QUESTIONS, RETRIEVE_BATCH_SIZE)},
+            headers=self.headers,
+        )
+        return response.status_code, None
+
+    async def token(self):
+        response = await self.http.post("/auth/token", data={"username": self.email, "password": PASSWORD})
+        return response.status_code, None
+
+    async def history(self):
+        response = await self.http.get("/chat/history", headers=self.headers)
+        return response.status_code, None
+
+    async def session(self):
+        response = await self.http.get(f"/chat/history/{self.chat_id}", headers=self.headers)
+        return response.status_code, None
+
+
+async def loop_lag_samples(http):
+    """Cumulative samples of the server's event-loop lag histogram."""
+    samples = {}
+    for line in (await http.get("/metrics")).text.splitlines():
+        if line.startswith(LAG_METRIC):
+            name, value = line.rsplit(" ", 1)
+            samples[name] = float(value)
+    return samples
+
+
+def loop_lag_summary(before, after):
+    def delta(name):
+        return after.get(name, 0.0) - before.get(name, 0.0)
+
+    count = delta(f"{LAG_METRIC}_count")
+    fast = delta(f'{LAG_METRIC}_bucket{{le="{LAG_THRESHOLD_BUCKET}"}}')
+    return {
+        "loop_lag_mean_ms": delta(f"{LAG_METRIC}_sum") / count * 1000 if count else None,
+        "loop_lag_over_100ms": (count - fast) / count if count else None,
+    }
+
+
+async def probe_health(http, deadline, latencies):
+    while time.perf_counter() < deadline:
+        start = time.perf_counter()
+        try:
+            await http.get("/health")
+            latencies.append(time.perf_counter() - start)
+        except httpx.HTTPError:
+            pass
+        await asyncio.sleep(PROBE_INTERVAL)
+
+
+async def run_scenario(clients, name, duration):
+    latencies, first_bytes, errors, health = [], [], {}, []
+    deadline = time.perf_counter() + duration
+    http = clients[0].http
+    lag_before = await loop_lag_samples(http)
+
+    async def worker(client):
+        action = getattr(client, name)
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            try:
+                status, first_byte = await action()
+            except httpx.HTTPError as exc:
+                status, first_byte = type(exc).__name__, None
+            if status == 200:
+                latencies.append(time.perf_counter() - start)
+                if first_byte is not None:
+                    first_bytes.append(first_byte)
+            else:
+                errors[str(status)] = errors.get(str(status), 0) + 1
+
+    start = time.perf_counter()
+    await asyncio.gather(probe_health(http, deadline, health), *(worker(client) for client in clients))
+    summary = summarize(name, latencies, first_bytes, errors, time.perf_counter() - start)
+    for p in (50, 99):
+        value = percentile(health, p)
+        summary[f"health_p{p}_ms"] = value * 1000 if value is not None else None
+    summary.update(loop_lag_summary(lag_before, await loop_lag_samples(http)))
+    return summary
+
+
+async def wait_ready(url, timeout=300):
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient() as http:
+        while time.monotonic() < deadline:
+            try:
+                if (await http.get(url)).status_code < 500:
+                    return
+            except httpx.HTTPError:
+                pass
+            await asyncio.sleep(0.5)
+    raise RuntimeError(f"{url} did not become ready")
+
+
+def spawn_servers(args):
+    gemini_url = f"http://127.0.0.1:{args.gemini_port}"
+    stub = subprocess.Popen([
+        sys.executable, "-m", "benchmarks.loadtest.stub_gemini", "--port", str(args.gemini_port),
+        "--first-token-ms", str(args.gemini_first_token_ms), "--token-ms", str(args.gemini_token_ms),
+        "--seed", str(args.seed),
+    ], cwd=BACKEND_DIR)
+    command = [sys.executable, "-m", "benchmarks.loadtest.serve", "--port", str(args.port), "--gemini-url", gemini_url]
+    if args.stub_retrieval:
+        command.append("--stub-retrieval")
+    api = subprocess.Popen(command, cwd=BACKEND_DIR)
+    return [stub, api]
+
+
+async def run(args):
+    base_url = args.base_url or f"http://127.0.0.1:{args.port}"
+    await wait_ready(f"{base_url}/health")
+
+    limits = httpx.Limits(max_connections=args.concurrency * 2)
+    async with httpx.AsyncClient(base_url=base_url, timeout=args.timeout, limits=limits) as http:
+        clients = [LoadClient(http, i, args.seed) for i in range(args.concurrency)]
+        await asyncio.gather(*(client.setup() for client in clients))
+
+        results = {}
+        for name in args.scenarios:
+            print(f"Running {name} ({args.concurrency} clients, {args.duration}s)...")
+            results[name] = await run_scenario(clients, name, args.duration)
+    return results
+
+
+def print_report(results, baseline=None):
+    header = (
+        f"{'scenario':<14} {'rps':>8} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'ttfb p50':>9} {'errors':>7}"
+        f" {'health p99':>10} {'lag mean':>9} {'lag>100ms':>9}"
+    )
+    print(header)
+    print("-" * len(header))
+
+    def fmt(value):
+        return f"{value:>9.1f}" if value is not None else f"{'-':>9}"
+
+    for name, summary in results.items():
+        lag_share = summary.get("loop_lag_over_100ms")
+        print(
+            f"{name:<14} {summary['throughput_rps']:>8.1f} {fmt(summary['p50_ms'])} {fmt(summary['p95_ms'])} "
+            f"{fmt(summary['p99_ms'])} {fmt(summary.get('ttfb_p50_ms'))} {sum(summary['errors'].values()):>7}"
+            f" {fmt(summary.get('health_p99_ms')):>10} {fmt(summary.get('loop_lag_mean_ms'))}"
+            f" {f'{lag_share:.1%}' if lag_share is not None else '-':>9}"
+        )
+        previous = (baseline or {}).get(name)
+        if previous:
+            deltas = []
+            for key in ("throughput_rps", "p50_ms", "p95_ms", "p99_ms", "health_p99_ms"):
+                if previous.get(key) and summary.get(key) is not None:
+                    deltas.append(f"{key} {100 * (summary[key] - previous[key]) / previous[key]:+.1f}%")
+            print(f"{'':<14} vs baseline: {', '.join(deltas)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the JuriDOC API")
+    parser.add_argument("--base-url", help="Test an already running server instead of spawning one")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--gemini-port", type=int, default=8100)
+    parser.add_argument("--gemini-first-token-ms", type=float, default=400)
+    parser.add_argument("--gemini-token-ms", type=float, default=15)
+    parser.add_argument("--stub-retrieval", action="store_true")
+    parser.add_argument("--scenarios", type=lambda s: s.split(","), default=list(SCENARIOS))
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--duration", type=float, default=30)
+    parser.add_argument("--timeout", type=float, default=120)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--out", help="Write the report as JSON")
+    parser.add_argument("--compare", help="Baseline JSON to diff against")
+    args = parser.parse_args()
+
+    processes = [] if args.base_url else spawn_servers(args)
+    try:
+        results = asyncio.run(run(args))
+    finally:
+        for process in processes:
+            process.terminate()
+            process.wait()
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, "r") as f:
+            baseline = json.load(f)["results"]
+    print_report(results, baseline)
+
+    if args.out:
+        report = {
+            "config": {k: v for k, v in vars(args).items() if k not in ("out", "compare")},
+            "environment": {"python": platform.python_version(), "platform": platform.platform()},
+            "results": results,
+        }
+        with open(args.out, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Report written to {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+"""
+Serve the JuriDOC API against local stand-ins.
+
+Mongo is replaced by an in-memory mongomock client and Gemini by the stub
+server (see stub_gemini.py). With --stub-retrieval the retrieval models are
+replaced by a keyword-overlap retriever over knowledge_base/law_codes, so
+that no prebuilt index or GPU is needed.
+
+    python -m benchmarks.loadtest.serve --port 8000 --gemini-url http://127.0.0.1:8100 --stub-retrieval
+"""
+import argparse
+import os
+import re
+from collections import Counter
+from types import SimpleNamespace
+
+TOKEN_PATTERN = re.compile(r"\w+")
+
+
+class KeywordRetriever:
+    """Scores articles by query-term overlap; stands in for BM25 and the dense encoder."""
+
+    def __init__(self, articles):
+        self.doc_ids = [article["id"] for article in articles]
+        self.postings = {}
+        for position, article in enumerate(articles):
+            for token in set(TOKEN_PATTERN.findall(article["text"].lower())):
+                self.postings.setdefault(token, []).append(position)
+
+    def retrieve(self, query, top_k=5):
+        scores = Counter()
+        for token in set(TOKEN_PATTERN.findall(query.lower())):
+            for position in self.postings.get(token, ()):
+                scores[position] += 1
+        return [(self.doc_ids[position], float(score)) for position, score in scores.most_common(top_k)]
+
+    # Batched and fused forms used by /retrieve
+    depth = 100
+
+    def retrieve_batch(self, queries, top_k=5):
+        return [self.retrieve(query, top_k) for query in queries]
+
+    def fuse(self, sparse_results, dense_results, top_k=5):
+        return sparse_results[:top_k]
+
+
+def use_stub_retrieval():
+    """Patch the pipeline to build its corpus and retriever from the law code JSON files."""
+    from app.rag_pipeline import RAGPipeline, corpus_version
+    from app.law_codes import load_law_codes
+
+    articles = load_law_codes()
+
+    def load_corpus(self, corpus_lookup_path):
+        self.corpus_data = {
+            "doc_ids": [article["id"] for article in articles],
+            "corpus_lookup": {article["id"]: article["text"] for article in articles},
+            "documents": [
+                SimpleNamespace(metadata={k: v for k, v in article.items() if k != "text"})
+                for article in articles
+            ],
+        }
+        self.index_version = corpus_version("".join(self.corpus_data["doc_ids"]).encode())
+        print(f"Loaded stub corpus with {len(articles)} documents")
+
+    def load_retrieval_models(self, *paths):
+        retriever = KeywordRetriever(articles)
+        self.sparse_model = self.dense_model = self.hybrid_retriever = retriever
+
+    RAGPipeline._load_corpus = load_corpus
+    RAGPipeline._load_retrieval_models = load_retrieval_models
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the API with local stand-ins")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--gemini-url", default="http://127.0.0.1:8100")
+    parser.add_argument("--stub-retrieval", action="store_true")
+    parser.add_argument("--gemini-rpm", default="100000", help="Scheduler quota (high = unthrottled)")
+    args = parser.parse_args()
+
+    # Must be set before the app modules are imported
+    os.environ["MONGODB_URI"] = "mongomock://"
+    os.environ["GEMINI_API_BASE"] = args.gemini_url
+    os.environ.setdefault("GEMINI_API_KEY", "stub-key")
+    os.environ.setdefault("GEMINI_RPM", args.gemini_rpm)
+    os.environ.setdefault("GEMINI_BURST", args.gemini_rpm)
+    os.environ.setdefault("SCHEDULER_MAX_QUEUE_PER_USER", "1000")
+    os.environ.setdefault("SCHEDULER_MAX_QUEUE", "100000")
+
+    if args.stub_retrieval:
+        use_stub_retrieval()
+
+    import uvicorn
+    from app.main import app
+
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,101 @@
+"""
+Local stand-in for the Gemini generateContent API.
+
+Implements `POST /v1beta/models/{model}:generateContent` and
+`:streamGenerateContent?alt=sse` with configurable latency, answer length
+and error injection, so the API can be load-tested without Gemini access.
+
+    python -m benchmarks.loadtest.stub_gemini --port 8100 --first-token-ms 400 --token-ms 15
+"""
+import argparse
+import asyncio
+import json
+import random
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+WORDS = (
+    "D'après l'article 147 du Code du Travail, il est interdit d'employer des mineurs "
+    "de moins de seize ans dans les représentations publiques. L'employeur qui ne respecte "
+    "pas cette disposition s'expose aux sanctions prévues par la loi."
+).split()
+
+config = {
+    "first_token_ms": 400.0,
+    "token_ms": 15.0,
+    "tokens": 120,
+    "chunk_tokens": 8,
+    "jitter": 0.2,
+    "error_rate": 0.0,
+    "rate_limit_rate": 0.0,
+    "seed": 0,
+}
+rng = random.Random(0)
+app = FastAPI()
+
+
+def _delay(ms: float) -> float:
+    jitter = config["jitter"]
+    return max(0.0, ms * rng.uniform(1 - jitter, 1 + jitter)) / 1000
+
+
+def _answer_words():
+    return [WORDS[i % len(WORDS)] for i in range(config["tokens"])]
+
+
+def _candidate(text: str) -> dict:
+    return {"candidates": [{"content": {"role": "model", "parts": [{"text": text}]}}]}
+
+
+def _injected_error():
+    roll = rng.random()
+    if roll < config["rate_limit_rate"]:
+        return JSONResponse(status_code=429, content={"error": {
+            "code": 429,
+            "status": "RESOURCE_EXHAUSTED",
+            "details": [{"@type": "type.googleapis.com/google.rpc.RetryInfo", "retryDelay": "5s"}],
+        }})
+    if roll < config["rate_limit_rate"] + config["error_rate"]:
+        return JSONResponse(status_code=500, content={"error": {"code": 500, "status": "INTERNAL"}})
+    return None
+
+
+@app.post("/v1beta/models/{model_action}")
+async def generate(model_action: str, request: Request):
+    await request.body()
+    error = _injected_error()
+    if error is not None:
+        return error
+
+    words = _answer_words()
+    if model_action.endswith(":streamGenerateContent"):
+        async def events():
+            await asyncio.sleep(_delay(config["first_token_ms"]))
+            size = config["chunk_tokens"]
+            for start in range(0, len(words), size):
+                chunk = " ".join(words[start:start + size]) + " "
+                yield f"data: {json.dumps(_candidate(chunk))}\r\n\r\n"
+                await asyncio.sleep(_delay(config["token_ms"] * size))
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    await asyncio.sleep(_delay(config["first_token_ms"] + config["token_ms"] * len(words)))
+    return _candidate(" ".join(words))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Stub Gemini API server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8100)
+    for key, value in config.items():
+        parser.add_argument(f"--{key.replace('_', '-')}", type=type(value), default=value)
+    args = parser.parse_args()
+    for key in config:
+        config[key] = getattr(args, key)
+    rng.seed(config["seed"])
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+"""
+Measure how a login storm affects a concurrent streaming /ask on the same worker.
+
+A probe coroutine emits one "token" every TOKEN_INTERVAL seconds, like
+stream_response does, and records how late each token is. Meanwhile a burst
+of password verifications runs either inline on the event loop (the old
+behaviour of authenticate_user) or through verify_password_async.
+
+Run from the backend directory:
+
+    python -m benchmarks.login_storm --logins 50
+"""
+import argparse
+import asyncio
+import statistics
+import time
+
+from app.auth.utils import BCRYPT_ROUNDS, get_password_hash, verify_password, verify_password_async
+
+TOKEN_INTERVAL = 0.005
+
+
+def percentile(values, p):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+async def stream_probe(stop: asyncio.Event, delays: list):
+    """Emit tokens at a fixed interval and record the extra delay of each one."""
+    while not stop.is_set():
+        expected = time.perf_counter() + TOKEN_INTERVAL
+        await asyncio.sleep(TOKEN_INTERVAL)
+        delays.append(max(0.0, time.perf_counter() - expected))
+
+
+async def inline_login(password, hashed):
+    return verify_password(password, hashed)
+
+
+async def offloaded_login(password, hashed):
+    return await verify_password_async(password, hashed)
+
+
+async def run(mode: str, logins: int, hashed: str) -> dict:
+    login = inline_login if mode == "inline" else offloaded_login
+    stop = asyncio.Event()
+    delays = []
+    probe = asyncio.create_task(stream_probe(stop, delays))
+    await asyncio.sleep(0.05)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(login("password123", hashed) for _ in range(logins)))
+    storm_seconds = time.perf_counter() - start
+
+    stop.set()
+    await probe
+    return {
+        "mode": mode,
+        "storm_seconds": storm_seconds,
+        "tokens": len(delays),
+        "p50_ms": percentile(delays, 50) * 1000,
+        "p99_ms": percentile(delays, 99) * 1000,
+        "max_ms": max(delays) * 1000,
+        "mean_ms": statistics.mean(delays) * 1000,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Streaming latency during a login storm")
+    parser.add_argument("--logins", type=int, default=50, help="Concurrent login attempts")
+    args = parser.parse_args()
+
+    hashed = get_password_hash("password123")
+    print(f"bcrypt rounds: {BCRYPT_ROUNDS}, concurrent logins: {args.logins}")
+    print(f"{'mode':<10} {'storm s':>8} {'tokens':>7} {'p50 ms':>8} {'p99 ms':>8} {'max ms':>8}")
+    for mode in ("inline", "offloaded"):
+        result = asyncio.run(run(mode, args.logins, hashed))
+        print(
+            f"{result['mode']:<10} {result['storm_seconds']:>8.2f} {result['tokens']:>7} "
+            f"{result['p50_ms']:>8.1f} {result['p99_ms']:>8.1f} {result['max_ms']:>8.1f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,68 @@
+"""
+Build the versioned retrieval question set from the generation evaluation data.
+
+Each example of Notebooks/final-results/generation2/model_evaluation_results.csv
+carries the articles it was written from in its `context` column
+("Article 147: ..." or "Article 54 [CODE DE COMMERCE]: ..."). Those become
+the relevance judgements. Examples whose articles cannot be resolved in
+knowledge_base/law_codes are skipped.
+
+    python -m benchmarks.retrieval.build_questions --version v1
+"""
+import argparse
+import csv
+import json
+import os
+import re
+
+from app.law_codes import load_law_codes, normalize_article_no
+
+SOURCE_CSV = os.path.join(
+    os.path.dirname(__file__), "..", "..", "..", "..",
+    "Notebooks", "final-results", "generation2", "model_evaluation_results.csv",
+)
+REFERENCE_PATTERN = re.compile(r"Article ([\w.\-–]+)(?: \[([^\]]+)\])?:")
+
+# Code names used in the evaluation data that differ from the JSON `code` field
+CODE_ALIASES = {
+    "code de commerce 2019": "code_comerce_2019",
+    "code penale 2018": "code_penale_2018",
+    "code famille 2016": "code_famille_2016",
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--source", default=SOURCE_CSV)
+    parser.add_argument("--version", default="v1")
+    args = parser.parse_args()
+
+    articles = load_law_codes()
+    folders = {article["code"].lower(): article["folder"] for article in articles}
+    folders.update(CODE_ALIASES)
+    known = {(article["folder"], normalize_article_no(article["article_no"])) for article in articles}
+
+    out_path = os.path.join(os.path.dirname(__file__), f"questions_{args.version}.jsonl")
+    kept = skipped = 0
+    with open(args.source, newline="", encoding="utf-8") as f, open(out_path, "w", encoding="utf-8") as out:
+        for row in csv.DictReader(f):
+            relevant = []
+            for number, code in REFERENCE_PATTERN.findall(row["context"]):
+                folder = folders.get((code or row["code"]).lower())
+                key = (folder, normalize_article_no(number))
+                if folder and key in known and list(key) not in relevant:
+                    relevant.append(list(key))
+            if not relevant:
+                skipped += 1
+                continue
+            out.write(json.dumps({
+                "qid": f"{args.version}-{row['example_id']}",
+                "question": row["question"],
+                "relevant": [{"folder": folder, "article": number} for folder, number in relevant],
+            }, ensure_ascii=False) + "\n")
+            kept += 1
+    print(f"Wrote {kept} questions to {out_path} ({skipped} without resolvable articles)")
+
+
+if __name__ == "__main__":
+    main()
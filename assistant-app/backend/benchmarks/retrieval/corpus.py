@@ -0,0 +1,76 @@
+import hashlib
+import json
+import os
+from typing import Dict, List
+
+from app.law_codes import normalize_article_no
+
+QUESTIONS_DIR = os.path.dirname(__file__)
+DEFAULT_INDEX_DIR = os.path.join(os.path.dirname(__file__), ".indexes")
+
+# Embedding models: the production one and a small one that runs on CPU in minutes
+FULL_MODEL = "intfloat/multilingual-e5-large"
+SMALL_MODEL = "intfloat/multilingual-e5-small"
+
+
+def load_questions(version: str, articles: List[Dict]) -> List[Dict]:
+    """Load a question set and resolve its relevance judgements to corpus ids."""
+    ids_by_article = {}
+    for article in articles:
+        key = (article["folder"], normalize_article_no(article["article_no"]))
+        ids_by_article.setdefault(key, []).append(article["id"])
+
+    questions = []
+    with open(os.path.join(QUESTIONS_DIR, f"questions_{version}.jsonl"), "r", encoding="utf-8") as f:
+        for line in f:
+            question = json.loads(line)
+            relevant = []
+            for ref in question["relevant"]:
+                relevant.extend(ids_by_article.get((ref["folder"], ref["article"]), []))
+            question["relevant_ids"] = relevant
+            questions.append(question)
+    return questions
+
+
+def index_version(articles: List[Dict], model_name: str) -> str:
+    """Fingerprint of the corpus and embedding model; changes whenever an index must be rebuilt."""
+    digest = hashlib.sha1(model_name.encode("utf-8"))
+    for article in articles:
+        digest.update(article["id"].encode("utf-8"))
+        digest.update(article["text"].encode("utf-8"))
+    return digest.hexdigest()[:12]
+
+
+def build_retrievers(articles: List[Dict], model_name: str, index_dir: str = DEFAULT_INDEX_DIR):
+    """Build (or load from index_dir) the BM25+, dense and RRF retrievers over the articles."""
+    from llama_index.core import Document
+    from app.retrievers import BM25PlusRetriever, DenseRetriever, ReciprocalRankFusionRetriever
+
+    version = index_version(articles, model_name)
+    path = os.path.join(index_dir, version)
+    sparse_path = os.path.join(path, "sparse", "bm25_plus.pkl")
+    dense_path = os.path.join(path, "dense")
+
+    if os.path.exists(sparse_path):
+        sparse = BM25PlusRetriever.load(sparse_path)
+    else:
+        sparse = BM25PlusRetriever()
+        sparse.fit([article["text"] for article in articles], [article["id"] for article in articles])
+        sparse.save(sparse_path)
+
+    if os.path.exists(dense_path):
+        dense = DenseRetriever.load(dense_path, embed_model_name=model_name)
+    else:
+        dense = DenseRetriever(embed_model_name=model_name)
+        dense.fit([
+            Document(text=article["text"], metadata={"id": article["id"], "code": article["code"]})
+            for article in articles
+        ])
+        dense.save(dense_path)
+
+    retrievers = {
+        "BM25-Plus": sparse,
+        "LlamaIndex Dense": dense,
+        "rrf_k60": ReciprocalRankFusionRetriever(sparse, dense, k=60),
+    }
+    return retrievers, version
@@ -0,0 +1,102 @@
+import math
+from typing import Dict, List, Sequence
+
+# Same metric set (and column names) as Notebooks/final-results
+METRIC_NAMES = ("precision@1", "precision@5", "recall@5", "f1@5", "mrr", "ndcg@5", "map", "hit_rate@5")
+
+
+def query_metrics(ranked: Sequence[str], relevant: Sequence[str]) -> Dict[str, float]:
+    """Compute the retrieval metrics of one ranked list against its relevant ids."""
+    relevant = set(relevant)
+    hits = [doc_id in relevant for doc_id in ranked]
+
+    precision_1 = float(hits[0]) if hits else 0.0
+    hits_5 = sum(hits[:5])
+    precision_5 = hits_5 / 5
+    recall_5 = hits_5 / len(relevant) if relevant else 0.0
+    f1_5 = 2 * precision_5 * recall_5 / (precision_5 + recall_5) if hits_5 else 0.0
+
+    first_hit = next((rank for rank, hit in enumerate(hits, start=1) if hit), None)
+    mrr = 1 / first_hit if first_hit else 0.0
+
+    dcg = sum(1 / math.log2(rank + 1) for rank, hit in enumerate(hits[:5], start=1) if hit)
+    idcg = sum(1 / math.log2(rank + 1) for rank in range(1, min(len(relevant), 5) + 1))
+    ndcg_5 = dcg / idcg if idcg else 0.0
+
+    found, precisions = 0, []
+    for rank, hit in enumerate(hits, start=1):
+        if hit:
+            found += 1
+            precisions.append(found / rank)
+    average_precision = sum(precisions) / len(relevant) if relevant else 0.0
+
+    return {
+        "precision@1": precision_1,
+        "precision@5": precision_5,
+        "recall@5": recall_5,
+        "f1@5": f1_5,
+        "mrr": mrr,
+        "ndcg@5": ndcg_5,
+        "map": average_precision,
+        "hit_rate@5": float(hits_5 > 0),
+    }
+
+
+def mean_metrics(per_query: List[Dict[str, float]]) -> Dict[str, float]:
+    if not per_query:
+        return {name: 0.0 for name in METRIC_NAMES}
+    return {name: sum(m[name] for m in per_query) / len(per_query) for name in METRIC_NAMES}
+
+
+def percentile(values: Sequence[float], p: float) -> float:
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    index = min(len(ordered) - 1, int(round(p / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def batch_metrics(ranked, relevance) -> Dict[str, float]:
+    """
+    Vectorized counterpart of query_metrics averaged over a question set.
+
+    `ranked` is a (questions, k) array of corpus positions (-1 pads) and
+    `relevance` a (questions, corpus) boolean matrix of judgements.
+    """
+    import numpy as np
+
+    n_questions = ranked.shape[0]
+    rows = np.arange(n_questions)[:, None]
+    hits = np.where(ranked >= 0, relevance[rows, np.maximum(ranked, 0)], False)
+    n_relevant = relevance.sum(axis=1)
+    safe_relevant = np.maximum(n_relevant, 1)
+    positions = np.arange(1, hits.shape[1] + 1)
+
+    hits_5 = hits[:, :5].sum(axis=1)
+    precision_5 = hits_5 / 5
+    recall_5 = np.where(n_relevant > 0, hits_5 / safe_relevant, 0.0)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        f1_5 = np.where(hits_5 > 0, 2 * precision_5 * recall_5 / (precision_5 + recall_5), 0.0)
+
+    first_hit = np.where(hits.any(axis=1), hits.argmax(axis=1) + 1, 0)
+    mrr = np.where(first_hit > 0, 1 / np.maximum(first_hit, 1), 0.0)
+
+    discounts = 1 / np.log2(np.arange(1, 6) + 1)
+    dcg = (hits[:, :5] * discounts[: min(5, hits.shape[1])]).sum(axis=1)
+    idcg = np.cumsum(discounts)[np.clip(n_relevant, 1, 5) - 1]
+    ndcg_5 = np.where(n_relevant > 0, dcg / idcg, 0.0)
+
+    precisions = np.cumsum(hits, axis=1) / positions * hits
+    average_precision = np.where(n_relevant > 0, precisions.sum(axis=1) / safe_relevant, 0.0)
+
+    per_metric = {
+        "precision@1": hits[:, 0].astype(float),
+        "precision@5": precision_5,
+        "recall@5": recall_5,
+        "f1@5": f1_5,
+        "mrr": mrr,
+        "ndcg@5": ndcg_5,
+        "map": average_precision,
+        "hit_rate@5": (hits_5 > 0).astype(float),
+    }
+    return {name: float(per_metric[name].mean()) if n_questions else 0.0 for name in METRIC_NAMES}
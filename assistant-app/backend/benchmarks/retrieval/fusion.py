@@ -0,0 +1,80 @@
+"""
+Vectorized fusion of cached branch runs.
+
+Every strategy maps the (questions, depth) runs of the base retrievers to
+a (questions, corpus) score matrix in a few numpy operations. The formulas
+match the notebook implementations: min-max, z-score + sigmoid and
+(n - rank) / n normalizations, linear interpolation, CombMNZ and RRF.
+"""
+import numpy as np
+
+from .runs import BranchRun
+
+
+def normalize(run: BranchRun, method: str) -> np.ndarray:
+    """Normalize each question's scores over the documents the branch returned."""
+    valid = run.valid
+    scores = run.scores.astype(np.float64)
+    counts = valid.sum(axis=1, keepdims=True)
+
+    if method == "minmax":
+        low = np.where(valid, scores, np.inf).min(axis=1, keepdims=True)
+        high = np.where(valid, scores, -np.inf).max(axis=1, keepdims=True)
+        spread = high - low
+        with np.errstate(invalid="ignore", divide="ignore"):
+            result = np.where(spread > 0, (scores - low) / spread, 1.0)
+    elif method == "zscore":
+        safe_counts = np.maximum(counts, 1)
+        mean = np.where(valid, scores, 0).sum(axis=1, keepdims=True) / safe_counts
+        std = np.sqrt(np.where(valid, (scores - mean) ** 2, 0).sum(axis=1, keepdims=True) / safe_counts)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            z = (scores - mean) / std
+        result = np.where(np.isclose(std, 0), 0.75, 1 / (1 + np.exp(-z)))
+    elif method == "rank":
+        # Runs are sorted best first, so the column is the rank
+        ranks = np.arange(scores.shape[1])[None, :]
+        result = (counts - ranks) / np.maximum(counts, 1)
+    else:
+        raise ValueError(f"Unknown normalization: {method}")
+    return np.where(valid, result, 0.0)
+
+
+def _scatter(run: BranchRun, values: np.ndarray, n_docs: int) -> np.ndarray:
+    matrix = np.zeros((run.indices.shape[0], n_docs))
+    rows, cols = np.nonzero(run.valid)
+    matrix[rows, run.indices[rows, cols]] = values[rows, cols]
+    return matrix
+
+
+def presence(runs, n_docs: int) -> np.ndarray:
+    """Number of branches that returned each document, per question."""
+    return sum(_scatter(run, run.valid.astype(np.float64), n_docs) for run in runs.values())
+
+
+def fuse(runs, n_docs: int, strategy: str, **params) -> np.ndarray:
+    """Return the fused (questions, corpus) score matrix of a strategy."""
+    sparse, dense = runs["bm25"], runs["dense"]
+    if strategy == "rrf":
+        k = params.get("k", 60)
+        depth = sparse.scores.shape[1]
+        reciprocal = np.broadcast_to(1 / (k + np.arange(depth) + 1), sparse.scores.shape)
+        return sum(_scatter(run, reciprocal, n_docs) for run in runs.values())
+    if strategy == "linear":
+        alpha = params.get("alpha", 0.5)
+        return (alpha * _scatter(sparse, normalize(sparse, "minmax"), n_docs)
+                + (1 - alpha) * _scatter(dense, normalize(dense, "minmax"), n_docs))
+    if strategy == "combmnz":
+        method = params.get("normalization", "zscore")
+        total = sum(_scatter(run, normalize(run, method), n_docs) for run in runs.values())
+        return total * presence(runs, n_docs)
+    raise ValueError(f"Unknown fusion strategy: {strategy}")
+
+
+def top_k(scores: np.ndarray, candidates: np.ndarray, k: int) -> np.ndarray:
+    """Corpus positions of the k best candidates per question, best first."""
+    masked = np.where(candidates > 0, scores, -np.inf)
+    part = np.argpartition(-masked, kth=min(k, masked.shape[1] - 1), axis=1)[:, :k]
+    order = np.argsort(-np.take_along_axis(masked, part, axis=1), axis=1, kind="stable")
+    ranked = np.take_along_axis(part, order, axis=1)
+    # Questions with fewer than k candidates are padded with -1
+    return np.where(np.take_along_axis(masked, ranked, axis=1) > -np.inf, ranked, -1)
@@ -0,0 +1,148 @@
+"""
+Headless retrieval benchmark over knowledge_base/law_codes.
+
+Builds (or reuses) the BM25+, dense and RRF indexes, runs a versioned
+question set through each retriever and reports the quality metrics of
+Notebooks/final-results next to per-query latency percentiles and memory.
+
+    python -m benchmarks.retrieval.run --small --out results.json
+    python -m benchmarks.retrieval.run --small --baseline results.json --max-latency-regression 0.25
+
+With --baseline the run fails (exit code 1) if a retriever's p95 latency
+grew by more than the allowed fraction, or its nDCG@5 dropped by more than
+--max-quality-drop.
+"""
+import argparse
+import csv
+import json
+import resource
+import sys
+import time
+
+from app.law_codes import load_law_codes
+
+from .corpus import DEFAULT_INDEX_DIR, FULL_MODEL, SMALL_MODEL, build_retrievers, load_questions
+from .evaluation import METRIC_NAMES, mean_metrics, percentile, query_metrics
+
+
+def rss_mb() -> float:
+    """Current resident set size in MB (Linux), falling back to the peak."""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return peak_rss_mb()
+
+
+def peak_rss_mb() -> float:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in kB on Linux and in bytes on macOS
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def evaluate(retriever, questions, top_k: int, warmup: int):
+    for question in questions[:warmup]:
+        retriever.retrieve(question["question"], top_k=top_k)
+
+    per_query, latencies = [], []
+    for question in questions:
+        start = time.perf_counter()
+        results = retriever.retrieve(question["question"], top_k=top_k)
+        latencies.append(time.perf_counter() - start)
+        per_query.append(query_metrics([doc_id for doc_id, _ in results], question["relevant_ids"]))
+
+    summary = mean_metrics(per_query)
+    summary["time"] = sum(latencies) / len(latencies)
+    summary["retrieve_time_ms"] = summary["time"] * 1000
+    for p in (50, 95, 99):
+        summary[f"p{p}_ms"] = percentile(latencies, p) * 1000
+    return summary
+
+
+def check_regressions(results, baseline, max_latency_regression, max_quality_drop):
+    failures = []
+    for name, summary in results.items():
+        previous = baseline.get(name)
+        if not previous:
+            continue
+        if summary["p95_ms"] > previous["p95_ms"] * (1 + max_latency_regression):
+            failures.append(f"{name}: p95 {summary['p95_ms']:.1f} ms vs baseline {previous['p95_ms']:.1f} ms")
+        if summary["ndcg@5"] < previous["ndcg@5"] - max_quality_drop:
+            failures.append(f"{name}: ndcg@5 {summary['ndcg@5']:.3f} vs baseline {previous['ndcg@5']:.3f}")
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Retrieval latency and quality benchmark")
+    parser.add_argument("--questions", default="v1", help="Question set version")
+    parser.add_argument("--small", action="store_true", help=f"Use {SMALL_MODEL} (CPU friendly)")
+    parser.add_argument("--model", help="Embedding model name (overrides --small)")
+    parser.add_argument("--index-dir", default=DEFAULT_INDEX_DIR)
+    parser.add_argument("--retrievers", help="Comma-separated subset of retrievers to run")
+    parser.add_argument("--top-k", type=int, default=10)
+    parser.add_argument("--warmup", type=int, default=3)
+    parser.add_argument("--out", help="Write the JSON report here")
+    parser.add_argument("--csv", help="Write a CSV in the Notebooks/final-results format")
+    parser.add_argument("--baseline", help="Previous JSON report to check for regressions")
+    parser.add_argument("--max-latency-regression", type=float, default=0.2)
+    parser.add_argument("--max-quality-drop", type=float, default=0.01)
+    args = parser.parse_args()
+
+    model_name = args.model or (SMALL_MODEL if args.small else FULL_MODEL)
+    articles = load_law_codes()
+    questions = load_questions(args.questions, articles)
+
+    memory = {"rss_start_mb": rss_mb()}
+    start = time.perf_counter()
+    retrievers, version = build_retrievers(articles, model_name, args.index_dir)
+    memory["index_build_seconds"] = time.perf_counter() - start
+    memory["rss_after_index_mb"] = rss_mb()
+    print(f"Index {version}: {len(articles)} articles, {len(questions)} questions, model {model_name}")
+
+    selected = args.retrievers.split(",") if args.retrievers else list(retrievers)
+    results = {}
+    for name in selected:
+        results[name] = evaluate(retrievers[name], questions, args.top_k, args.warmup)
+    memory["rss_peak_mb"] = peak_rss_mb()
+
+    print(f"{'model':<18} {'p@1':>6} {'mrr':>6} {'ndcg@5':>7} {'hit@5':>6} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+    for name, s in results.items():
+        print(
+            f"{name:<18} {s['precision@1']:>6.3f} {s['mrr']:>6.3f} {s['ndcg@5']:>7.3f} {s['hit_rate@5']:>6.3f} "
+            f"{s['p50_ms']:>8.1f} {s['p95_ms']:>8.1f} {s['p99_ms']:>8.1f}"
+        )
+    print(f"RSS: {memory['rss_after_index_mb']:.0f} MB after index, {memory['rss_peak_mb']:.0f} MB peak")
+
+    if args.csv:
+        with open(args.csv, "w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow([*METRIC_NAMES, "time", "model", "retrieve_time_ms"])
+            for name, s in results.items():
+                writer.writerow([*(s[m] for m in METRIC_NAMES), s["time"], name, s["retrieve_time_ms"]])
+
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump({
+                "questions": args.questions,
+                "model": model_name,
+                "index_version": version,
+                "top_k": args.top_k,
+                "memory": memory,
+                "results": results,
+            }, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)["results"]
+        failures = check_regressions(results, baseline, args.max_latency_regression, args.max_quality_drop)
+        for failure in failures:
+            print(f"REGRESSION {failure}")
+        if failures:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,72 @@
+import os
+import time
+from typing import Dict, List
+
+import numpy as np
+
+# Base retrievers whose rankings are cached; fusion strategies combine these
+BRANCHES = {"bm25": "BM25-Plus", "dense": "LlamaIndex Dense"}
+
+
+class BranchRun:
+    """
+    Ranked results of one base retriever for a whole question set.
+
+    `indices` holds corpus positions (-1 pads short rankings) and `scores`
+    the raw retriever scores, both shaped (questions, depth) and sorted best
+    first. `latencies` is the per-question retrieval time in seconds.
+    """
+
+    def __init__(self, indices: np.ndarray, scores: np.ndarray, latencies: np.ndarray):
+        self.indices = indices
+        self.scores = scores
+        self.latencies = latencies
+
+    @property
+    def valid(self) -> np.ndarray:
+        return self.indices >= 0
+
+    def save(self, path: str):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        np.savez_compressed(path, indices=self.indices, scores=self.scores, latencies=self.latencies)
+
+    @classmethod
+    def load(cls, path: str) -> "BranchRun":
+        data = np.load(path)
+        return cls(data["indices"], data["scores"], data["latencies"])
+
+
+def run_path(index_dir: str, version: str, questions_version: str, branch: str, depth: int) -> str:
+    return os.path.join(index_dir, version, "runs", f"{questions_version}_{branch}_d{depth}.npz")
+
+
+def compute_run(retriever, questions: List[Dict], positions: Dict[str, int], depth: int) -> BranchRun:
+    indices = np.full((len(questions), depth), -1, dtype=np.int32)
+    scores = np.zeros((len(questions), depth), dtype=np.float32)
+    latencies = np.zeros(len(questions), dtype=np.float64)
+    for row, question in enumerate(questions):
+        start = time.perf_counter()
+        results = retriever.retrieve(question["question"], top_k=depth)
+        latencies[row] = time.perf_counter() - start
+        for column, (doc_id, score) in enumerate(results[:depth]):
+            indices[row, column] = positions[doc_id]
+            scores[row, column] = score
+    return BranchRun(indices, scores, latencies)
+
+
+def load_or_compute_runs(
+    retrievers: Dict, questions: List[Dict], doc_ids: List[str],
+    index_dir: str, version: str, questions_version: str, depth: int = 100,
+) -> Dict[str, BranchRun]:
+    """Run every base retriever once per (index version, question set, depth) and cache the result."""
+    positions = {doc_id: i for i, doc_id in enumerate(doc_ids)}
+    runs = {}
+    for branch, retriever_name in BRANCHES.items():
+        path = run_path(index_dir, version, questions_version, branch, depth)
+        if os.path.exists(path):
+            runs[branch] = BranchRun.load(path)
+            continue
+        print(f"Computing {branch} run ({len(questions)} questions, depth {depth})...")
+        runs[branch] = compute_run(retrievers[retriever_name], questions, positions, depth)
+        runs[branch].save(path)
+    return runs
@@ -0,0 +1,124 @@
+"""
+Fusion-strategy sweep over cached branch runs.
+
+BM25+ and the dense retriever run once per (index version, question set,
+depth) and their rankings are cached next to the indexes; every fusion
+configuration is then scored with vectorized metrics, so a sweep of
+hundreds of configurations takes seconds.
+
+    python -m benchmarks.retrieval.sweep --small
+    python -m benchmarks.retrieval.sweep --small --alphas 0:1:0.05 --rrf-k 1:100:1 --csv sweep.csv
+
+`time` in the output is the estimated per-query latency: both cached branch
+latencies plus the amortized fusion time.
+"""
+import argparse
+import csv
+import os
+import time
+
+import numpy as np
+
+from app.law_codes import load_law_codes
+
+from .corpus import DEFAULT_INDEX_DIR, FULL_MODEL, SMALL_MODEL, build_retrievers, index_version, load_questions
+from .evaluation import METRIC_NAMES, batch_metrics
+from .fusion import fuse, presence, top_k
+from .runs import BRANCHES, load_or_compute_runs, run_path
+
+# Configurations evaluated in Notebooks/final-results
+NOTEBOOK_ALPHAS = "0.3,0.5,0.7"
+NOTEBOOK_NORMALIZATIONS = "zscore,rank,minmax"
+NOTEBOOK_RRF_K = "60"
+
+
+def parse_values(spec: str, cast=float):
+    """Parse "a,b,c" or an inclusive "start:stop:step" range."""
+    if not spec:
+        return []
+    if ":" in spec:
+        start, stop, step = (float(part) for part in spec.split(":"))
+        count = int(round((stop - start) / step)) + 1
+        return [cast(round(start + i * step, 6)) for i in range(count)]
+    return [cast(value) for value in spec.split(",")]
+
+
+def configurations(args):
+    for alpha in parse_values(args.alphas):
+        yield f"linear_{alpha:g}", "linear", {"alpha": alpha}
+    for normalization in filter(None, args.combmnz.split(",")):
+        yield f"combmnz_{normalization}", "combmnz", {"normalization": normalization}
+    for k in parse_values(args.rrf_k, int):
+        yield f"rrf_k{k}", "rrf", {"k": k}
+
+
+def relevance_matrix(questions, doc_ids):
+    positions = {doc_id: i for i, doc_id in enumerate(doc_ids)}
+    relevance = np.zeros((len(questions), len(doc_ids)), dtype=bool)
+    for row, question in enumerate(questions):
+        for doc_id in question["relevant_ids"]:
+            relevance[row, positions[doc_id]] = True
+    return relevance
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fusion-strategy sweep over cached retrieval runs")
+    parser.add_argument("--questions", default="v1", help="Question set version")
+    parser.add_argument("--small", action="store_true", help=f"Use {SMALL_MODEL} (CPU friendly)")
+    parser.add_argument("--model", help="Embedding model name (overrides --small)")
+    parser.add_argument("--index-dir", default=DEFAULT_INDEX_DIR)
+    parser.add_argument("--depth", type=int, default=100, help="Documents cached per branch and question")
+    parser.add_argument("--top-k", type=int, default=10)
+    parser.add_argument("--alphas", default=NOTEBOOK_ALPHAS, help="Linear weights of BM25, list or start:stop:step")
+    parser.add_argument("--combmnz", default=NOTEBOOK_NORMALIZATIONS, help="CombMNZ normalizations")
+    parser.add_argument("--rrf-k", default=NOTEBOOK_RRF_K, help="RRF constants, list or start:stop:step")
+    parser.add_argument("--sort", default="ndcg@5", help="Metric used to rank configurations")
+    parser.add_argument("--csv", help="Write a CSV in the Notebooks/final-results format")
+    args = parser.parse_args()
+
+    model_name = args.model or (SMALL_MODEL if args.small else FULL_MODEL)
+    articles = load_law_codes()
+    questions = load_questions(args.questions, articles)
+    doc_ids = [article["id"] for article in articles]
+    version = index_version(articles, model_name)
+
+    # Only load the models when a branch run is missing from the cache
+    cached = all(
+        os.path.exists(run_path(args.index_dir, version, args.questions, branch, args.depth))
+        for branch in BRANCHES
+    )
+    retrievers = {} if cached else build_retrievers(articles, model_name, args.index_dir)[0]
+    runs = load_or_compute_runs(retrievers, questions, doc_ids, args.index_dir, version, args.questions, args.depth)
+
+    relevance = relevance_matrix(questions, doc_ids)
+    candidates = presence(runs, len(doc_ids))
+    branch_time = sum(run.latencies.mean() for run in runs.values())
+
+    start = time.perf_counter()
+    results = {}
+    for name, strategy, params in configurations(args):
+        fuse_start = time.perf_counter()
+        ranked = top_k(fuse(runs, len(doc_ids), strategy, **params), candidates, args.top_k)
+        fuse_time = (time.perf_counter() - fuse_start) / len(questions)
+        summary = batch_metrics(ranked, relevance)
+        summary["time"] = branch_time + fuse_time
+        summary["retrieve_time_ms"] = summary["time"] * 1000
+        results[name] = summary
+    elapsed = time.perf_counter() - start
+    print(f"Index {version}: {len(results)} configurations over {len(questions)} questions in {elapsed:.2f}s")
+
+    ordered = sorted(results.items(), key=lambda item: item[1][args.sort], reverse=True)
+    print(f"{'model':<18} {'p@1':>6} {'mrr':>6} {'ndcg@5':>7} {'hit@5':>6} {'map':>6}")
+    for name, s in ordered:
+        print(f"{name:<18} {s['precision@1']:>6.3f} {s['mrr']:>6.3f} {s['ndcg@5']:>7.3f} {s['hit_rate@5']:>6.3f} {s['map']:>6.3f}")
+
+    if args.csv:
+        with open(args.csv, "w", newline="") as f:
+            writer = csv.writer(f)
+            writer.writerow([*METRIC_NAMES, "time", "model", "retrieve_time_ms"])
+            for name, s in ordered:
+                writer.writerow([*(s[m] for m in METRIC_NAMES), s["time"], name, s["retrieve_time_ms"]])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,44 @@
+import random
+
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from benchmarks.retrieval.evaluation import METRIC_NAMES, batch_metrics, mean_metrics, query_metrics
+
+CORPUS = 40
+K = 10
+
+
+def random_question_set(seed: int, questions: int = 200):
+    rng = random.Random(seed)
+    ranked = np.full((questions, K), -1)
+    relevance = np.zeros((questions, CORPUS), dtype=bool)
+    for row in range(questions):
+        # Some questions have no judgement, some rankings are shorter than K
+        relevance[row, rng.sample(range(CORPUS), rng.choice([0, 1, 2, 3, 7]))] = True
+        ranking = rng.sample(range(CORPUS), rng.randint(0, K))
+        ranked[row, :len(ranking)] = ranking
+    return ranked, relevance
+
+
+@pytest.mark.parametrize("seed", [0, 1, 2])
+def test_batch_metrics_match_the_per_query_metrics(seed):
+    ranked, relevance = random_question_set(seed)
+    per_query = [
+        query_metrics([str(i) for i in row if i >= 0], [str(i) for i in np.flatnonzero(judged)])
+        for row, judged in zip(ranked, relevance)
+    ]
+    expected = mean_metrics(per_query)
+    produced = batch_metrics(ranked, relevance)
+    for name in METRIC_NAMES:
+        assert produced[name] == pytest.approx(expected[name], abs=1e-12), name
+
+
+def test_query_metrics_of_a_known_ranking():
+    metrics = query_metrics(["a", "x", "b", "y", "z"], ["a", "b"])
+    assert metrics["precision@1"] == 1.0
+    assert metrics["precision@5"] == pytest.approx(0.4)
+    assert metrics["recall@5"] == 1.0
+    assert metrics["mrr"] == 1.0
+    assert metrics["map"] == pytest.approx((1 + 2 / 3) / 2)
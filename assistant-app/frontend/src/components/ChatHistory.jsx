@@ -32,23 +32,29 @@ function ChatHistory({ fullWidth = false }) {
       try {
         setIsLoading(true);
         const token = localStorage.getItem('token');
-        const response = await fetch('http://localhost:8000/chat/history', {
-          headers: {
-            'Authorization': `Bearer ${token}`
+        // Sessions come in pages (summaries only, with their message_count);
+        // the X-Next-Cursor header points to the next page
+        const sessions = [];
+        let cursor = null;
+        do {
+          const url = cursor
+            ? `http://localhost:8000/chat/history?before=${encodeURIComponent(cursor)}`
+            : 'http://localhost:8000/chat/history';
+          const response = await fetch(url, {
+            headers: {
+              'Authorization': `Bearer ${token}`
+            }
+          });
+          
+          if (!response.ok) {
+            throw new Error('Failed to fetch chat history');
           }
-        });
-        
-        if (!response.ok) {
-          throw new Error('Failed to fetch chat history');
-        }
-        
-        const data = await response.json();
-        const processedData = data.map(chat => ({
-          ...chat,
-          message_count: chat.messages?.length || 0
-        }));
+          
+          sessions.push(...await response.json());
+          cursor = response.headers.get('X-Next-Cursor');
+        } while (cursor);
         
-        const sortedSessions = processedData.sort((a, b) => {
+        const sortedSessions = sessions.sort((a, b) => {
           return new Date(b.date || 0) - new Date(a.date || 0);
         });
         
@@ -239,15 +245,7 @@ function ChatHistory({ fullWidth = false }) {
   
   // Get message count safely
   const getMessageCount = (chat) => {
-    if (typeof chat.message_count === 'number') {
-      return chat.message_count;
-    }
-    
-    if (Array.isArray(chat.messages)) {
-      return chat.messages.length;
-    }
-    
-    return 0;
+    return typeof chat.message_count === 'number' ? chat.message_count : 0;
   };
   
   return (
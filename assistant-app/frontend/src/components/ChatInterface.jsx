@@ -39,15 +39,27 @@ function ChatInterface() {
   const fetchChatSession = async (chatId) => {
     try {
       setIsLoading(true);
-      const response = await fetch(`http://localhost:8000/chat/history/${chatId}`, {
-        headers: {
-          'Authorization': `Bearer ${localStorage.getItem('token')}`
-        }
-      });
+      const headers = {
+        'Authorization': `Bearer ${localStorage.getItem('token')}`
+      };
+      const response = await fetch(`http://localhost:8000/chat/history/${chatId}`, { headers });
       if (response.ok) {
         const data = await response.json();
+        // The session comes with its first page of messages; next_cursor
+        // (the last seq read) leads to the following ones
+        const sessionMessages = [...data.messages];
+        let cursor = data.next_cursor;
+        while (cursor != null) {
+          const page = await fetch(
+            `http://localhost:8000/chat/history/${chatId}/messages?after=${cursor}`, { headers }
+          );
+          if (!page.ok) break;
+          const pageData = await page.json();
+          sessionMessages.push(...pageData.messages);
+          cursor = pageData.next_cursor;
+        }
         setActiveChat(data);
-        const formattedMessages = data.messages.map(msg => ({
+        const formattedMessages = sessionMessages.map(msg => ({
           type: msg.role,
           content: msg.content,
           articles: msg.articles || [],